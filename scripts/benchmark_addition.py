@@ -0,0 +1,114 @@
+"""Benchmark addition blend modes: attempts and time per accepted addition.
+
+Runs ObjectDuplicator on synthetic textured scenes with each blend mode and
+applies the same quality gate the generator uses, retrying up to
+--max-attempts times per addition.
+
+Usage:
+    python scripts/benchmark_addition.py [--trials 50] [--size 1024]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.models.segment import Segment
+from src.services.object_duplicator import BLEND_MODES, ObjectDuplicator
+from src.services.quality_evaluator import QualityEvaluator
+
+
+def make_scene(size: int, rng: np.random.Generator) -> tuple[np.ndarray, Segment]:
+    """Create a textured background with one elliptical object."""
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    base = rng.uniform(60, 200, size=3)
+    image = np.empty((size, size, 3), dtype=np.float32)
+    for c in range(3):
+        image[:, :, c] = base[c] + 30 * np.sin(xx / rng.uniform(40, 120) + c) \
+            + 20 * np.cos(yy / rng.uniform(40, 120))
+    image += rng.normal(0, 6, size=image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+
+    radius = int(rng.integers(size // 24, size // 12))
+    cx = int(rng.integers(radius + 10, size // 3))
+    cy = int(rng.integers(radius + 10, size // 3))
+    mask = np.zeros((size, size), dtype=np.uint8)
+    cv2.ellipse(mask, (cx, cy), (radius, int(radius * 0.7)), 0, 0, 360, 255, -1)
+    color = tuple(int(v) for v in rng.uniform(0, 255, size=3))
+    cv2.ellipse(image, (cx, cy), (radius, int(radius * 0.7)), 0, 0, 360, color, -1)
+
+    ys, xs = np.nonzero(mask)
+    bbox = [int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1]
+    segment = Segment(id=0, mask=mask > 0, bbox=bbox, area=int(np.count_nonzero(mask)))
+    return image, segment
+
+
+def run(blend_mode: str, trials: int, size: int, max_attempts: int) -> dict:
+    random.seed(0)
+    rng = np.random.default_rng(0)
+    duplicator = ObjectDuplicator()
+    evaluator = QualityEvaluator()
+
+    accepted = 0
+    attempts = 0
+    elapsed = 0.0
+
+    for _ in range(trials):
+        image, segment = make_scene(size, rng)
+        x1, y1, x2, y2 = segment.bbox
+        local_mask = segment.mask[y1:y2, x1:x2]
+
+        t0 = time.perf_counter()
+        for _attempt in range(max_attempts):
+            attempts += 1
+            result, new_bbox = duplicator.duplicate(image, segment, blend_mode=blend_mode)
+            if new_bbox is None:
+                continue
+            nx1, ny1, nx2, ny2 = new_bbox
+            ok, _, _ = evaluator.evaluate_modification_quality(
+                image[ny1:ny2, nx1:nx2],
+                result[ny1:ny2, nx1:nx2],
+                local_mask,
+                "addition",
+            )
+            if ok:
+                accepted += 1
+                break
+        elapsed += time.perf_counter() - t0
+
+    return {
+        "accepted": accepted,
+        "attempts": attempts,
+        "attempts_per_accepted": attempts / accepted if accepted else float("inf"),
+        "ms_per_accepted": elapsed * 1000 / accepted if accepted else float("inf"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=50)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--max-attempts", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{'mode':<10} {'accepted':>9} {'attempts':>9} {'att/acc':>8} {'ms/acc':>9}")
+    for mode in BLEND_MODES:
+        r = run(mode, args.trials, args.size, args.max_attempts)
+        print(
+            f"{mode:<10} {r['accepted']:>5}/{args.trials:<3} {r['attempts']:>9} "
+            f"{r['attempts_per_accepted']:>8.2f} {r['ms_per_accepted']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
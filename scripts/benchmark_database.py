@@ -0,0 +1,107 @@
+"""Benchmark job status polling against concurrent status writers.
+
+Starts --writers threads that keep saving the status of their own job and
+--readers threads that poll random jobs, as browsers do every 500 ms, on a
+fresh database for --seconds. Reports polls and writes per second, poll
+latency percentiles and how many operations failed on a locked database.
+
+Usage:
+    python scripts/benchmark_database.py [--readers 8] [--writers 2] [--seconds 5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src import database
+
+
+def writer(db_path: str, job_id: str, stop: threading.Event, counts: dict) -> None:
+    progress = 0
+    while not stop.is_set():
+        progress = (progress + 1) % 100
+        try:
+            database.save_job_status(
+                db_path, job_id, "processing", progress=progress, current_step="変更を適用中..."
+            )
+            counts["writes"] += 1
+        except sqlite3.OperationalError:
+            counts["errors"] += 1
+
+
+def reader(
+    db_path: str,
+    job_ids: list[str],
+    stop: threading.Event,
+    latencies: list[float],
+    counts: dict,
+) -> None:
+    rng = random.Random()
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            database.get_job_status(db_path, rng.choice(job_ids))
+        except sqlite3.OperationalError:
+            counts["errors"] += 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+
+
+def percentile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100)[int(q) - 1] if len(values) > 1 else 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = str(Path(tmpdir) / "benchmark.db")
+        database.init_db(db_path)
+        job_ids = [f"job_{i:04d}" for i in range(max(args.writers, 1) * 4)]
+        for job_id in job_ids:
+            database.save_job_status(db_path, job_id, "queued")
+
+        stop = threading.Event()
+        counts = {"writes": 0, "errors": 0}
+        latencies: list[list[float]] = [[] for _ in range(args.readers)]
+        threads = [
+            threading.Thread(target=writer, args=(db_path, job_ids[i], stop, counts))
+            for i in range(args.writers)
+        ] + [
+            threading.Thread(target=reader, args=(db_path, job_ids, stop, latencies[i], counts))
+            for i in range(args.readers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    polls = [latency for per_reader in latencies for latency in per_reader]
+    print(f"readers={args.readers} writers={args.writers} seconds={args.seconds}")
+    print(f"polls/s:   {len(polls) / args.seconds:>10.0f}")
+    print(f"writes/s:  {counts['writes'] / args.seconds:>10.0f}")
+    print(f"poll p50:  {percentile(polls, 50) * 1000:>10.3f} ms")
+    print(f"poll p99:  {percentile(polls, 99) * 1000:>10.3f} ms")
+    print(f"errors:    {counts['errors']:>10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark the ROI SSIM used by QualityEvaluator against skimage.
+
+Times both implementations on synthetic regions where a disc covering part
+of the region was changed, as in a colour change or deletion check, and
+reports the largest score difference.
+
+Usage:
+    python scripts/benchmark_ssim.py [--repeat 50] [--sizes 64 128 256 512]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from skimage.metrics import structural_similarity as skimage_ssim
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.services.quality_evaluator import structural_similarity
+
+
+def make_pair(size: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """Textured grayscale region and a copy with a changed disc."""
+    original = rng.integers(0, 256, size=(size, size), dtype=np.uint8)
+    original = cv2.GaussianBlur(original, (5, 5), 1.0)
+    modified = original.copy()
+    cv2.circle(modified, (size // 2, size // 2), size // 3, 200, -1)
+    return original, modified
+
+
+def time_per_call(fn, a: np.ndarray, b: np.ndarray, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(a, b)
+    return (time.perf_counter() - t0) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256, 512])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>6} {'skimage ms':>11} {'roi ms':>9} {'speedup':>8} {'|diff|':>10}")
+    for size in args.sizes:
+        a, b = make_pair(size, rng)
+        reference = skimage_ssim(a, b, full=True)[0]
+        score = structural_similarity(a, b)
+        t_ref = time_per_call(lambda x, y: skimage_ssim(x, y, full=True), a, b, args.repeat)
+        t_roi = time_per_call(structural_similarity, a, b, args.repeat)
+        print(
+            f"{size:>6} {t_ref * 1000:>11.2f} {t_roi * 1000:>9.2f} "
+            f"{t_ref / t_roi:>7.1f}x {abs(reference - score):>10.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Fit the per-megapixel memory model (MEMORY_MODEL) from real generation runs.
+
+Generates puzzles from the given photos, each resized to every --scales
+factor and run with every --variants count, through the same job path as
+the web app (queue, worker thread, output encoding). Resident memory is
+sampled while each job runs; the peak above the idle process is one
+observation. Prints the observations and the fitted MEMORY_MODEL.
+
+Needs the FastSAM model (python scripts/download_model.py).
+
+Usage:
+    python scripts/calibrate_memory.py photo1.jpg photo2.jpg [--scales 0.5 0.75 1.0] [--variants 1 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import cv2
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.app import create_app
+from src.config import config
+from src.models.job import JobState
+from src.services.memory_budget import MemoryModel, process_rss_mb
+from src.utils.image_io import load_image, save_image
+
+SAMPLE_INTERVAL = 0.01
+
+
+def measure(job_manager, image_path: Path, variants: int, difficulty: str) -> float | None:
+    """Peak MB above the resident memory before the job, sampled while it runs.
+
+    None if a job failed.
+    """
+    gc.collect()
+    baseline = process_rss_mb()
+    peak = baseline
+    job_ids = [f"calibrate_{uuid.uuid4().hex[:8]}" for _ in range(variants)]
+    seeds = [random.getrandbits(32) for _ in range(variants)]
+    job_manager.submit_many(job_ids, str(image_path), [difficulty] * variants, seeds)
+
+    done = threading.Event()
+    errors = []
+
+    def wait() -> None:
+        while True:
+            statuses = [job_manager.get_status(job_id) for job_id in job_ids]
+            if all(s.status in (JobState.COMPLETED, JobState.FAILED) for s in statuses):
+                errors.extend(s.error for s in statuses if s.status == JobState.FAILED)
+                done.set()
+                return
+            time.sleep(0.1)
+
+    threading.Thread(target=wait, daemon=True).start()
+    while not done.wait(SAMPLE_INTERVAL):
+        peak = max(peak, process_rss_mb())
+    if errors:
+        print(f"  {image_path.name}: job failed: {errors[0]}", file=sys.stderr)
+        return None
+    return peak - baseline
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="+", type=Path)
+    parser.add_argument("--env", choices=sorted(config), default="development")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.5, 0.75, 1.0])
+    parser.add_argument("--variants", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--difficulty", default="hard", help="Most changes, i.e. the largest footprint")
+    args = parser.parse_args()
+
+    if process_rss_mb() is None:
+        parser.error("resident memory can only be measured where /proc is available")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        settings = config[args.env]
+        settings.UPLOAD_FOLDER = str(Path(tmpdir) / "uploads")
+        settings.OUTPUT_FOLDER = str(Path(tmpdir) / "outputs")
+        settings.DATABASE_PATH = str(Path(tmpdir) / "calibrate.db")
+        settings.MAX_WORKERS = 1
+        settings.MEMORY_BUDGET_MB = 0
+        settings.STAGE_CACHE_MB = 0  # every run computes every stage
+        settings.JOB_DEADLINE_SECONDS = None  # no cheaper fallbacks
+        settings.JOB_TIME_LIMIT_SECONDS = None
+        settings.JOB_ABANDON_SECONDS = None
+        settings.MAX_QUEUED_JOBS = 1
+        app = create_app(args.env)
+        job_manager = app.extensions["job_manager"]
+
+        inputs = []
+        for path in args.images:
+            image = load_image(path)
+            for scale in args.scales:
+                resized = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                target = Path(settings.UPLOAD_FOLDER) / f"{path.stem}_{scale:g}.png"
+                save_image(resized, target)
+                inputs.append((target, resized.shape[0] * resized.shape[1] / 1e6))
+
+        # Warm-up: lazy imports and allocator arenas are not part of a job
+        measure(job_manager, inputs[0][0], 1, args.difficulty)
+
+        runs = []
+        print(f"{'image':<32} {'MP':>6} {'variants':>8} {'peak MB':>8}")
+        for target, megapixels in inputs:
+            for variants in args.variants:
+                peak = measure(job_manager, target, variants, args.difficulty)
+                if peak is None:
+                    continue
+                runs.append((megapixels, variants, peak))
+                print(f"{target.name:<32} {megapixels:>6.2f} {variants:>8d} {peak:>8.0f}")
+        job_manager.shutdown()
+
+    if len(runs) < 2:
+        sys.exit("Too few successful runs to fit a model")
+    model = MemoryModel.fit(runs)
+    print()
+    print("MEMORY_MODEL = {")
+    print(f'    "base_mb": {model.base_mb:.0f},')
+    print(f'    "mb_per_megapixel": {model.mb_per_megapixel:.0f},')
+    print(f'    "mb_per_variant_megapixel": {model.mb_per_variant_megapixel:.0f},')
+    print("}")
+    worst = max(peak - model.estimate(mp, variants) for mp, variants, peak in runs)
+    print(f"Largest underestimate: {max(worst, 0):.0f} MB (add it to base_mb for headroom)")
+
+
+if __name__ == "__main__":
+    main()
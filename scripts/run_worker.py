@@ -0,0 +1,55 @@
+"""Process queued generation jobs outside the web server.
+
+Claims jobs from the database queue that the web workers fill, so generation
+capacity can be added, or restarted, independently of gunicorn. Run the web
+server with MAX_WORKERS=0 to leave every job to these processes. Stops on
+SIGINT or SIGTERM after finishing the jobs it holds; queued jobs stay queued.
+
+Usage:
+    python scripts/run_worker.py [--env production] [--workers 1]
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import signal
+import sys
+import threading
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.app import create_app
+from src.config import config
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--env", choices=sorted(config), default="production")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Jobs processed in parallel (default: MAX_WORKERS)")
+    args = parser.parse_args()
+
+    if args.workers is not None:
+        config[args.env].MAX_WORKERS = args.workers
+    if config[args.env].MAX_WORKERS < 1:
+        parser.error("a worker needs at least one job thread")
+
+    app = create_app(args.env)
+    job_manager = app.extensions["job_manager"]
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    logging.info("Worker processing queued jobs with %d threads", app.config["MAX_WORKERS"])
+    stop.wait()
+    logging.info("Worker stopping after its running jobs")
+    job_manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,15 +11,12 @@ from flask import Flask
 from src.config import config
 from src.database import init_db
 from src.routes import register_blueprints
-from src.services.segmentation import SegmentationService
-from src.services.saliency import SaliencyService
-from src.services.inpainting import InpaintingService
-from src.services.color_changer import ColorChanger
-from src.services.object_duplicator import ObjectDuplicator
 from src.services.answer_visualizer import AnswerVisualizer
 from src.services.a4_layout_composer import A4LayoutComposer
-from src.services.difference_generator import DifferenceGenerator
+from src.services.janitor import Janitor
 from src.services.job_manager import JobManager
+from src.services.memory_budget import MemoryBudget, MemoryModel
+from src.services.worker_pool import GenerationPool, build_generator
 from src.utils.file_manager import ensure_directories
 
 
@@ -117,49 +114,28 @@ def _init_security(app: Flask) -> None:
 
 
 def _init_services(app: Flask) -> None:
-    model_path = os.path.join(
-        app.config["MODEL_FOLDER"], app.config["FASTSAM_MODEL"]
-    )
-
-    segmentation = SegmentationService(
-        model_path=model_path,
-        conf=app.config["FASTSAM_CONF"],
-        iou=app.config["FASTSAM_IOU"],
-        imgsz=app.config["PROCESSING_IMAGE_SIZE"],
-    )
-
-    # Pre-load FastSAM model at startup to avoid first-request timeout
-    # This takes ~30-60 seconds but prevents WORKER TIMEOUT on first request
-    # Only pre-load if model file exists (skips on first deployment)
-    from pathlib import Path
-    model_file = Path(model_path)
-    if model_file.exists():
-        logging.info("Pre-loading FastSAM model at startup...")
-        segmentation._ensure_model()
-        logging.info("FastSAM model pre-loaded successfully")
-    else:
-        logging.warning(
-            "FastSAM model not found at startup. Model will be loaded on first request. "
-            "Consider downloading model before deployment: python scripts/download_model.py"
-        )
+    generates = app.config["MAX_WORKERS"] > 0
+    use_processes = generates and app.config["JOB_EXECUTOR"] == "process"
 
-    saliency = SaliencyService()
-    inpainting = InpaintingService(radius=app.config["INPAINT_RADIUS"])
-    color_changer = ColorChanger()
-    duplicator = ObjectDuplicator()
+    # With worker processes the model is loaded in each worker instead; the
+    # in-process generator then only serves rerolls, which never segment
+    generator = build_generator(app.config, preload_model=generates and not use_processes)
     answer_visualizer = AnswerVisualizer()
     a4_composer = A4LayoutComposer()
 
-    generator = DifferenceGenerator(
-        segmentation=segmentation,
-        saliency=saliency,
-        inpainting=inpainting,
-        color_changer=color_changer,
-        object_duplicator=duplicator,
-        difficulty_config=app.config["DIFFICULTY_CONFIG"],
-        segment_min_area_ratio=app.config["SEGMENT_MIN_AREA_RATIO"],
-        segment_max_area_ratio=app.config["SEGMENT_MAX_AREA_RATIO"],
-    )
+    generation_pool = None
+    if use_processes:
+        generation_pool = GenerationPool(app.config, max_workers=app.config["MAX_WORKERS"])
+        logging.info(
+            "Generating in %d worker processes", app.config["MAX_WORKERS"]
+        )
+
+    # A single worker claims jobs only when idle, which the budget always admits
+    memory_budget = None
+    if app.config["MAX_WORKERS"] > 1 and app.config["MEMORY_BUDGET_MB"]:
+        memory_budget = MemoryBudget(
+            app.config["MEMORY_BUDGET_MB"], MemoryModel.from_config(app.config["MEMORY_MODEL"])
+        )
 
     job_manager = JobManager(
         generator=generator,
@@ -168,6 +144,36 @@ def _init_services(app: Flask) -> None:
         output_folder=app.config["OUTPUT_FOLDER"],
         database_path=app.config["DATABASE_PATH"],
         max_workers=app.config["MAX_WORKERS"],
+        job_deadline=app.config["JOB_DEADLINE_SECONDS"],
+        stage_budgets=app.config["STAGE_BUDGETS"],
+        stage_estimates=app.config["STAGE_ESTIMATES"],
+        status_flush_interval=app.config["STATUS_FLUSH_INTERVAL"],
+        generation_pool=generation_pool,
+        max_queued=app.config["MAX_QUEUED_JOBS"],
+        lease_seconds=app.config["JOB_LEASE_SECONDS"],
+        max_attempts=app.config["JOB_MAX_ATTEMPTS"],
+        stale_seconds=app.config["JOB_STALE_SECONDS"],
+        time_limit=app.config["JOB_TIME_LIMIT_SECONDS"],
+        abandon_seconds=app.config["JOB_ABANDON_SECONDS"],
+        memory_budget=memory_budget,
+        history_retention_hours=app.config["HISTORY_RETENTION_HOURS"],
+        poll_interval=app.config["QUEUE_POLL_INTERVAL"],
     )
 
     app.extensions["job_manager"] = job_manager
+
+    if app.config["JANITOR_INTERVAL"]:
+        janitor = Janitor(
+            database_path=app.config["DATABASE_PATH"],
+            upload_folder=app.config["UPLOAD_FOLDER"],
+            output_folder=app.config["OUTPUT_FOLDER"],
+            retention_hours=app.config["SESSION_EXPIRY_HOURS"],
+            interval=app.config["JANITOR_INTERVAL"],
+            cycle_seconds=app.config["JANITOR_CYCLE_SECONDS"],
+            delete_rate=app.config["JANITOR_DELETE_RATE"],
+            high_water=app.config["DISK_HIGH_WATER"],
+            low_water=app.config["DISK_LOW_WATER"],
+            cache_dir=app.config["STAGE_CACHE_DIR"],
+        )
+        janitor.start()
+        app.extensions["janitor"] = janitor
@@ -34,13 +34,123 @@ class Config:
     MIN_IMAGE_DIMENSION = 512
     MAX_IMAGE_DIMENSION = 4096
     PROCESSING_IMAGE_SIZE = 768  # Reduced from 1024 for 4GB memory optimization
+    # Longest side of the proxy used for segmentation, saliency, selection and
+    # quality checks; edits are re-rendered at full resolution. None disables.
+    PROXY_MAX_SIZE = 1024
 
     # Database
     DATABASE_PATH = str(INSTANCE_DIR / "spotdiff.db")
 
     # Job processing
-    MAX_WORKERS = 1  # Reduced from 2 for 4GB memory optimization
+    # Jobs processed in parallel per process, as long as MEMORY_BUDGET_MB
+    # admits them. Reduced from 2 for 4GB memory optimization. Jobs wait in
+    # the database and any process's workers take them; 0 makes a process
+    # only queue jobs for others (scripts/run_worker.py)
+    MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 1))
+    # Resident MB (model included) one process's running jobs may plan to
+    # reach; a job whose estimated peak does not fit waits, so several small
+    # images run at once and large ones alone. Only gates anything with
+    # MAX_WORKERS > 1: a process's single worker is idle whenever it claims a
+    # job, and an idle process admits any job. Per process: each gunicorn
+    # worker (-w) has its own budget, so set it to host memory divided by -w
+    # (4GB host, -w 1). 0 disables
+    MEMORY_BUDGET_MB = int(os.environ.get("MEMORY_BUDGET_MB", 3000))
+    # Peak MB of a batch above the idle process: base_mb + mb_per_megapixel
+    # per input megapixel, plus mb_per_variant_megapixel per megapixel of each
+    # further variant. Initial estimates for CPU; fit them to the host with
+    # scripts/calibrate_memory.py
+    MEMORY_MODEL = {
+        "base_mb": 250,
+        "mb_per_megapixel": 120,
+        "mb_per_variant_megapixel": 45,
+    }
+    # "thread" generates inside the web process; "process" runs MAX_WORKERS
+    # worker processes, each with its own model copy (~MAX_WORKERS times the
+    # memory), so concurrent jobs do not contend on the GIL
+    JOB_EXECUTOR = "thread"
+    # Generation requests waiting for a worker; more are rejected with 503
+    MAX_QUEUED_JOBS = 8
+    # A worker holds a job for this long without renewing (it renews every
+    # third of it); a job whose worker died is then queued again, and fails
+    # after JOB_MAX_ATTEMPTS tries
+    JOB_LEASE_SECONDS = 60
+    JOB_MAX_ATTEMPTS = 3
+    # On startup, jobs processing without a status update for this long are
+    # queued again (resuming from their checkpoints) without waiting for the
+    # lease, which a hung worker may still be renewing
+    JOB_STALE_SECONDS = 600
+    # A job running longer than this (from when a worker took it) fails; one
+    # whose status no client has polled for JOB_ABANDON_SECONDS (the user
+    # left the page) is cancelled. None disables either
+    JOB_TIME_LIMIT_SECONDS = 600
+    JOB_ABANDON_SECONDS = 120
+    # Seconds between an idle worker's looks for jobs queued by other processes
+    QUEUE_POLL_INTERVAL = 1.0
+    # Threads applying spatially independent differences within one job
+    EDIT_WORKERS = min(4, os.cpu_count() or 1)
     SESSION_EXPIRY_HOURS = 24
+    # Background cleanup: every JANITOR_INTERVAL seconds, outputs and uploads
+    # unused for SESSION_EXPIRY_HOURS, orphaned checkpoints and old database
+    # rows are deleted, oldest first, at most JANITOR_DELETE_RATE paths per
+    # second for at most JANITOR_CYCLE_SECONDS. With the output folder's disk
+    # above DISK_HIGH_WATER full, the least recently used outputs, uploads
+    # and stage cache entries go early, down to DISK_LOW_WATER. None disables
+    JANITOR_INTERVAL = 300
+    JANITOR_CYCLE_SECONDS = 5.0
+    JANITOR_DELETE_RATE = 50
+    DISK_HIGH_WATER = 0.9
+    DISK_LOW_WATER = 0.8
+    MAX_VARIANTS = 3  # Puzzle variants per /api/generate request (shared segmentation)
+    # Per-job deadline in seconds from submission (queue wait included), kept
+    # below gunicorn's --timeout 300. When the time left drops below the
+    # budgets of the stages still to run, they take cheaper options: a smaller
+    # analysis proxy and model input, one inpaint method, one attempt per
+    # change and no post-filters. None disables.
+    JOB_DEADLINE_SECONDS = 240
+    STAGE_BUDGETS = {
+        "segmentation": 90,
+        "saliency": 5,
+        "changes": 60,
+        "render": 20,
+        "outputs": 20,
+    }
+    FALLBACK_PROXY_SIZE = 640
+    FALLBACK_IMGSZ = 512
+    # Stage outputs (segments, saliency ranking, edits, ...) cached by content
+    # key, so regenerating an image with another difficulty or seed skips the
+    # stages upstream of the change. 0 disables. STAGE_CACHE_DIR adds an
+    # unpruned on-disk tier that survives restarts; None keeps it in memory.
+    STAGE_CACHE_MB = 256
+    STAGE_CACHE_DIR = None
+    # Initial seconds per pipeline stage for progress and ETA on CPU; replaced
+    # by a moving average of measured durations as jobs complete
+    STAGE_ESTIMATES = {
+        "decode": 0.3,
+        "proxy": 0.05,
+        "segment": 12.0,
+        "saliency": 0.3,
+        "quality": 0.1,
+        "select": 0.01,
+        "edit": 2.0,
+        "render": 2.0,
+        "encode": 2.5,
+    }
+    # Seconds between write-behind flushes of job progress to the job_status table
+    STATUS_FLUSH_INTERVAL = 0.5
+    # /api/status/<job_id>/stream pushes a job's status as it changes. A
+    # stream re-reads the status at least every STATUS_STREAM_RECHECK seconds
+    # (jobs of other processes, queue positions), sends a comment after
+    # STATUS_STREAM_HEARTBEAT idle seconds so proxies keep the connection,
+    # and ends after STATUS_STREAM_SECONDS; the browser then reconnects.
+    # Each open stream holds a server thread: run gunicorn with --threads
+    STATUS_STREAM_RECHECK = 1.0
+    STATUS_STREAM_HEARTBEAT = 15.0
+    STATUS_STREAM_SECONDS = 300
+    # Processed jobs are recorded in generation_history (stage timings, input
+    # size, outcome) for /api/admin/stats, and kept this long
+    HISTORY_RETENTION_HOURS = 24 * 30
+    # Bearer token for /api/admin/*; unset disables those endpoints
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
 
     # FastSAM
     FASTSAM_MODEL = "FastSAM-x.pt"
@@ -61,18 +171,22 @@ class Config:
     MIN_MODIFICATION_SSIM = 0.7
 
     # Difficulty presets - adjusted for higher quality standards
+    # blend_mode: how additions are pasted ("alpha" | "seamless" Poisson clone)
     DIFFICULTY_CONFIG = {
         "easy": {
             "num_changes": 3,
             "max_saliency": 0.65,  # Slightly more conservative
+            "blend_mode": "alpha",
         },
         "medium": {
             "num_changes": 5,
             "max_saliency": 0.45,  # More conservative
+            "blend_mode": "seamless",
         },
         "hard": {
             "num_changes": 7,  # Reduced from 8 for better quality
             "max_saliency": 0.25,  # More conservative
+            "blend_mode": "seamless",
         },
     }
 
@@ -99,6 +213,7 @@ class Config:
     RATELIMIT_DEFAULT = "100 per hour"
     RATELIMIT_UPLOAD = "10 per minute"
     RATELIMIT_GENERATE = "5 per minute"
+    RATELIMIT_REROLL = "20 per minute"
     RATELIMIT_STATUS = "500 per 5 minutes"  # Relaxed limit for status polling (500ms interval)
 
 
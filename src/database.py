@@ -5,11 +5,21 @@ from __future__ import annotations
 import json
 import sqlite3
 import logging
+import threading
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Seconds a statement waits for another connection's write lock
+BUSY_TIMEOUT = 5.0
+# Prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 64
+
+# Per-thread connections by database path; sqlite3 connections must not be
+# shared between threads
+_local = threading.local()
+
 _SCHEMA = """
 CREATE TABLE IF NOT EXISTS generation_history (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,11 +32,30 @@ CREATE TABLE IF NOT EXISTS generation_history (
     num_differences INTEGER NOT NULL,
     processing_time REAL NOT NULL,
     metadata TEXT NOT NULL,
+    -- Outcome: completed, failed or cancelled, and the input size
+    status TEXT NOT NULL DEFAULT 'completed',
+    error TEXT,
+    width INTEGER,
+    height INTEGER,
     created_at TEXT NOT NULL,
     expires_at TEXT NOT NULL
 );
 CREATE INDEX IF NOT EXISTS idx_job_id ON generation_history(job_id);
 CREATE INDEX IF NOT EXISTS idx_expires_at ON generation_history(expires_at);
+CREATE INDEX IF NOT EXISTS idx_generation_created ON generation_history(created_at);
+
+-- One row per measured stage run (cache hits excluded); a stage shared by
+-- the variants of a batch is recorded once, under its first job
+CREATE TABLE IF NOT EXISTS stage_timings (
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    created_at TEXT NOT NULL,
+    expires_at TEXT NOT NULL
+);
+-- Covers the stats query: a time range read without touching the table
+CREATE INDEX IF NOT EXISTS idx_stage_timings_window ON stage_timings(created_at, stage, seconds);
+CREATE INDEX IF NOT EXISTS idx_stage_timings_expires ON stage_timings(expires_at);
 
 CREATE TABLE IF NOT EXISTS job_status (
     job_id TEXT PRIMARY KEY,
@@ -35,13 +64,130 @@ CREATE TABLE IF NOT EXISTS job_status (
     current_step TEXT NOT NULL DEFAULT '',
     error TEXT,
     result_path TEXT,
+    stage TEXT NOT NULL DEFAULT '',
+    eta_seconds REAL,
+    preview_path TEXT,
+    -- Queue: jobs submitted together share a batch and are processed together
+    batch_id TEXT,
+    client TEXT NOT NULL DEFAULT '',
+    image_path TEXT,
+    difficulty TEXT,
+    seed INTEGER,
+    cache_key TEXT,
+    cost REAL NOT NULL DEFAULT 0,  -- expected seconds of processing
+    megapixels REAL,  -- input size, for the memory estimate
+    submitted_at REAL,  -- Unix time, like the lease columns
+    started_at REAL,
+    claimed_by TEXT,
+    lease_expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    -- Cancellation: set for the worker to notice, and the last client poll
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    polled_at REAL,
+    -- Identical requests while the batch is queued or running attach to it
+    dedupe_key TEXT,
     created_at TEXT NOT NULL,
     updated_at TEXT NOT NULL
 );
 CREATE INDEX IF NOT EXISTS idx_job_status_updated ON job_status(updated_at);
+
+CREATE TABLE IF NOT EXISTS result_cache (
+    cache_key TEXT PRIMARY KEY,
+    result_path TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS uploads (
+    file_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+-- Clients holding a batch: the one that queued it and those whose identical
+-- requests joined it. It is cancelled once none of them is left
+CREATE TABLE IF NOT EXISTS batch_requesters (
+    batch_id TEXT NOT NULL,
+    client TEXT NOT NULL,
+    PRIMARY KEY (batch_id, client)
+);
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    idempotency_key TEXT PRIMARY KEY,
+    job_ids TEXT NOT NULL,  -- JSON list, in request order
+    created_at TEXT NOT NULL
+);
+"""
+
+# Columns added after a table was first released: CREATE TABLE IF NOT EXISTS
+# leaves existing databases without them
+_ADDED_COLUMNS = {
+    "generation_history": {
+        "status": "TEXT NOT NULL DEFAULT 'completed'",
+        "error": "TEXT",
+        "width": "INTEGER",
+        "height": "INTEGER",
+    },
+    "job_status": {
+        "stage": "TEXT NOT NULL DEFAULT ''",
+        "eta_seconds": "REAL",
+        "preview_path": "TEXT",
+        "batch_id": "TEXT",
+        "client": "TEXT NOT NULL DEFAULT ''",
+        "image_path": "TEXT",
+        "difficulty": "TEXT",
+        "seed": "INTEGER",
+        "cache_key": "TEXT",
+        "cost": "REAL NOT NULL DEFAULT 0",
+        "megapixels": "REAL",
+        "submitted_at": "REAL",
+        "started_at": "REAL",
+        "claimed_by": "TEXT",
+        "lease_expires_at": "REAL",
+        "attempts": "INTEGER NOT NULL DEFAULT 0",
+        "cancel_requested": "INTEGER NOT NULL DEFAULT 0",
+        "polled_at": "REAL",
+        "dedupe_key": "TEXT",
+    },
+}
+
+# Indexes on added columns, created once the columns exist
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_job_status_queue ON job_status(status, batch_id);
+CREATE INDEX IF NOT EXISTS idx_job_status_dedupe ON job_status(dedupe_key);
+CREATE INDEX IF NOT EXISTS idx_job_status_batch ON job_status(batch_id);
 """
 
 
+def _connect(db_path: str) -> sqlite3.Connection:
+    """This thread's connection to db_path, opened on first use.
+
+    Use it as a context manager to commit (or roll back) a transaction.
+    WAL lets status polls read while a job writes, and synchronous=NORMAL
+    syncs at checkpoints instead of on every commit; a crash can lose the
+    last commits, never corrupt the database.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(
+            db_path, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[db_path] = conn
+    return conn
+
+
+def close_connection(db_path: str) -> None:
+    """Close this thread's connection to db_path, if it has one."""
+    conn = getattr(_local, "connections", {}).pop(db_path, None)
+    if conn is not None:
+        conn.close()
+
+
 def init_db(db_path: str) -> None:
     """Create the database and tables if they don't exist.
 
@@ -61,15 +207,29 @@ def init_db(db_path: str) -> None:
         ) from e
 
     try:
-        # Create database and schema
-        with sqlite3.connect(db_path) as conn:
+        # Create database and schema; a file replaced since this thread
+        # last used the path needs a new connection
+        close_connection(db_path)
+        with _connect(db_path) as conn:
             conn.executescript(_SCHEMA)
+            for table, columns in _ADDED_COLUMNS.items():
+                _ensure_columns(conn, table, columns)
+            conn.executescript(_INDEXES)
         logger.info(f"Database initialized: {db_path}")
     except sqlite3.Error as e:
         logger.error(f"Failed to initialize database: {e}")
         raise
 
 
+def _ensure_columns(conn: sqlite3.Connection, table: str, columns: dict[str, str]) -> None:
+    """Add any of columns (name -> declaration) that table lacks."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, declaration in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+            logger.info(f"Added column {table}.{name}")
+
+
 def save_generation(
     db_path: str,
     job_id: str,
@@ -87,7 +247,7 @@ def save_generation(
     now = datetime.now(timezone.utc)
     expires = now + timedelta(hours=expiry_hours)
 
-    with sqlite3.connect(db_path) as conn:
+    with _connect(db_path) as conn:
         cursor = conn.execute(
             """INSERT INTO generation_history
                (job_id, session_id, original_filename, original_path,
@@ -113,8 +273,7 @@ def save_generation(
 
 def get_generation(db_path: str, job_id: str) -> dict | None:
     """Retrieve a generation record by job_id."""
-    with sqlite3.connect(db_path) as conn:
-        conn.row_factory = sqlite3.Row
+    with _connect(db_path) as conn:
         row = conn.execute(
             "SELECT * FROM generation_history WHERE job_id = ?", (job_id,)
         ).fetchone()
@@ -125,19 +284,149 @@ def get_generation(db_path: str, job_id: str) -> dict | None:
         return d
 
 
-def cleanup_expired(db_path: str) -> int:
-    """Delete expired records. Returns count of deleted rows."""
-    now = datetime.now(timezone.utc).isoformat()
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.execute(
-            "DELETE FROM generation_history WHERE expires_at < ?", (now,)
+def save_generations(db_path: str, records: list[dict], expiry_hours: int = 24) -> None:
+    """Save several generation records and their stage timings in one transaction.
+
+    Each dict has the arguments of save_generation, plus status, error,
+    width, height and stage_timings ({stage: seconds} to record for the
+    job). A job already recorded is left as it is, timings included.
+    """
+    now = datetime.now(timezone.utc)
+    created = now.isoformat()
+    expires = (now + timedelta(hours=expiry_hours)).isoformat()
+
+    with _connect(db_path) as conn:
+        timings = []
+        for r in records:
+            cursor = conn.execute(
+                """INSERT INTO generation_history
+                   (job_id, session_id, original_filename, original_path,
+                    output_path, difficulty, num_differences, processing_time,
+                    metadata, status, error, width, height, created_at, expires_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(job_id) DO NOTHING""",
+                (
+                    r["job_id"],
+                    r["session_id"],
+                    r["original_filename"],
+                    r["original_path"],
+                    r["output_path"],
+                    r["difficulty"],
+                    r["num_differences"],
+                    r["processing_time"],
+                    json.dumps(r["metadata"], ensure_ascii=False),
+                    r.get("status", "completed"),
+                    r.get("error"),
+                    r.get("width"),
+                    r.get("height"),
+                    created,
+                    expires,
+                ),
+            )
+            # Timings of a job recorded before (e.g. re-run after its lease
+            # expired) would be counted twice
+            if cursor.rowcount:
+                timings.extend(
+                    (r["job_id"], stage, seconds, created, expires)
+                    for stage, seconds in r.get("stage_timings", {}).items()
+                )
+        conn.executemany(
+            """INSERT INTO stage_timings (job_id, stage, seconds, created_at, expires_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            timings,
         )
-        return cursor.rowcount
+
+
+def get_stage_timings(db_path: str, since: str) -> dict[str, list[float]]:
+    """Measured seconds per stage recorded since (ISO time)."""
+    timings: dict[str, list[float]] = {}
+    with _connect(db_path) as conn:
+        for stage, seconds in conn.execute(
+            "SELECT stage, seconds FROM stage_timings WHERE created_at >= ?", (since,)
+        ):
+            timings.setdefault(stage, []).append(seconds)
+    return timings
+
+
+def get_generation_summary(db_path: str, since: str) -> list[dict]:
+    """Job counts by status and difficulty recorded since (ISO time).
+
+    Each dict has status, difficulty, jobs and megapixels (the sizes of
+    those jobs' inputs, where known).
+    """
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            """SELECT status, difficulty, COUNT(*) AS jobs,
+                      GROUP_CONCAT(width * height / 1e6) AS megapixels
+               FROM generation_history WHERE created_at >= ?
+               GROUP BY status, difficulty""",
+            (since,),
+        ).fetchall()
+    return [
+        {
+            "status": row["status"],
+            "difficulty": row["difficulty"],
+            "jobs": row["jobs"],
+            "megapixels": [float(v) for v in row["megapixels"].split(",")] if row["megapixels"] else [],
+        }
+        for row in rows
+    ]
+
+
+def cleanup_expired(db_path: str, limit: int | None = None) -> int:
+    """Delete expired records, at most limit of them. Returns count of deleted rows.
+
+    Stage timings expire with the records they were saved with.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    with _connect(db_path) as conn:
+        return _delete_before(
+            conn, "stage_timings", "expires_at", now, limit
+        ) + _delete_before(conn, "generation_history", "expires_at", now, limit)
+
+
+def _delete_before(
+    conn: sqlite3.Connection,
+    table: str,
+    column: str,
+    cutoff: str,
+    limit: int | None,
+    condition: str = "1",
+) -> int:
+    """Delete up to limit rows of table whose column is before cutoff, oldest first.
+
+    A bounded delete holds the write lock briefly, so a large backlog can be
+    removed a batch at a time without stalling job status writes.
+    """
+    cursor = conn.execute(
+        f"""DELETE FROM {table} WHERE rowid IN (
+               SELECT rowid FROM {table} WHERE {column} < ? AND {condition}
+               ORDER BY {column} LIMIT ?)""",
+        (cutoff, -1 if limit is None else limit),
+    )
+    return cursor.rowcount
 
 
 # Job status persistence functions for JobManager
 
 
+# Updates in place: no delete and re-insert, and created_at is kept
+_SAVE_JOB_STATUS = """INSERT INTO job_status
+   (job_id, status, progress, current_step, error, result_path,
+    stage, eta_seconds, preview_path, created_at, updated_at)
+   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+   ON CONFLICT(job_id) DO UPDATE SET
+       status = excluded.status,
+       progress = excluded.progress,
+       current_step = excluded.current_step,
+       error = excluded.error,
+       result_path = excluded.result_path,
+       stage = excluded.stage,
+       eta_seconds = excluded.eta_seconds,
+       preview_path = excluded.preview_path,
+       updated_at = excluded.updated_at"""
+
+
 def save_job_status(
     db_path: str,
     job_id: str,
@@ -146,44 +435,56 @@ def save_job_status(
     current_step: str = "",
     error: str | None = None,
     result_path: str | None = None,
+    stage: str = "",
+    eta_seconds: float | None = None,
+    preview_path: str | None = None,
 ) -> None:
     """Save or update job status in database."""
+    save_job_statuses(db_path, [{
+        "job_id": job_id,
+        "status": status,
+        "progress": progress,
+        "current_step": current_step,
+        "error": error,
+        "result_path": result_path,
+        "stage": stage,
+        "eta_seconds": eta_seconds,
+        "preview_path": preview_path,
+    }])
+
+
+def save_job_statuses(db_path: str, statuses: list[dict]) -> None:
+    """Save or update several job statuses in one transaction.
+
+    Each dict has the keyword arguments of save_job_status.
+    """
     now = datetime.now(timezone.utc).isoformat()
 
-    with sqlite3.connect(db_path) as conn:
-        # Use INSERT OR REPLACE to handle both new and existing jobs
-        conn.execute(
-            """INSERT OR REPLACE INTO job_status
-               (job_id, status, progress, current_step, error, result_path,
-                created_at, updated_at)
-               VALUES (
-                   ?,
-                   ?,
-                   ?,
-                   ?,
-                   ?,
-                   ?,
-                   COALESCE((SELECT created_at FROM job_status WHERE job_id = ?), ?),
-                   ?
-               )""",
-            (
-                job_id,
-                status,
-                progress,
-                current_step,
-                error,
-                result_path,
-                job_id,
-                now,
-                now,
-            ),
+    with _connect(db_path) as conn:
+        conn.executemany(
+            _SAVE_JOB_STATUS,
+            [
+                (
+                    s["job_id"],
+                    s["status"],
+                    s.get("progress", 0),
+                    s.get("current_step", ""),
+                    s.get("error"),
+                    s.get("result_path"),
+                    s.get("stage", ""),
+                    s.get("eta_seconds"),
+                    s.get("preview_path"),
+                    now,
+                    now,
+                )
+                for s in statuses
+            ],
         )
 
 
 def get_job_status(db_path: str, job_id: str) -> dict | None:
     """Retrieve job status by job_id."""
-    with sqlite3.connect(db_path) as conn:
-        conn.row_factory = sqlite3.Row
+    with _connect(db_path) as conn:
         row = conn.execute(
             "SELECT * FROM job_status WHERE job_id = ?", (job_id,)
         ).fetchone()
@@ -192,11 +493,444 @@ def get_job_status(db_path: str, job_id: str) -> dict | None:
         return dict(row)
 
 
-def cleanup_old_job_status(db_path: str, hours: int = 24) -> int:
-    """Delete job status records older than specified hours. Returns count of deleted rows."""
-    cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
-    with sqlite3.connect(db_path) as conn:
+# Durable job queue: queued rows of job_status, claimed by batch under a lease
+
+_ENQUEUE_JOB = """INSERT INTO job_status
+   (job_id, status, current_step, batch_id, client, image_path, difficulty,
+    seed, cache_key, cost, megapixels, dedupe_key, submitted_at, created_at, updated_at)
+   VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+def enqueue_jobs(db_path: str, jobs: list[dict], max_batches: int) -> str | None:
+    """Queue the jobs of one batch unless max_batches batches are already queued.
+
+    Each dict has job_id, current_step, batch_id, client, image_path,
+    difficulty, seed, cache_key, cost, megapixels, dedupe_key and
+    submitted_at. Returns the batch id now holding the request: the jobs'
+    own, or that of a queued or running batch with the same dedupe_key
+    (then nothing is queued). Either way the client becomes one of the
+    batch's requesters (see cancel_batch). Returns None, and queues nothing,
+    when the queue is full.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    dedupe_key = jobs[0]["dedupe_key"]
+    client = jobs[0]["client"]
+    with _connect(db_path) as conn:
+        # Check, count and insert under one write lock so concurrent
+        # duplicates find each other and workers cannot overfill the queue
+        conn.execute("BEGIN IMMEDIATE")
+        if dedupe_key is not None:
+            row = conn.execute(
+                """SELECT batch_id FROM job_status
+                   WHERE dedupe_key = ? AND status IN ('queued', 'processing')
+                     AND cancel_requested = 0
+                   LIMIT 1""",
+                (dedupe_key,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO batch_requesters (batch_id, client) VALUES (?, ?)",
+                    (row["batch_id"], client),
+                )
+                return row["batch_id"]
+        queued = conn.execute(
+            "SELECT COUNT(DISTINCT batch_id) FROM job_status WHERE status = 'queued'"
+            " AND batch_id IS NOT NULL"
+        ).fetchone()[0]
+        if queued >= max_batches:
+            return None
+        conn.executemany(
+            _ENQUEUE_JOB,
+            [
+                (
+                    job["job_id"],
+                    job["current_step"],
+                    job["batch_id"],
+                    job["client"],
+                    job["image_path"],
+                    job["difficulty"],
+                    job["seed"],
+                    job["cache_key"],
+                    job["cost"],
+                    job["megapixels"],
+                    job["dedupe_key"],
+                    job["submitted_at"],
+                    now,
+                    now,
+                )
+                for job in jobs
+            ],
+        )
+        conn.execute(
+            "INSERT INTO batch_requesters (batch_id, client) VALUES (?, ?)",
+            (jobs[0]["batch_id"], client),
+        )
+    return jobs[0]["batch_id"]
+
+
+def get_batch_job_ids(db_path: str, batch_id: str) -> list[str]:
+    """Job ids of a batch, in submission order."""
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT job_id FROM job_status WHERE batch_id = ? ORDER BY rowid", (batch_id,)
+        ).fetchall()
+        return [row["job_id"] for row in rows]
+
+
+def get_active_jobs(db_path: str) -> list[dict]:
+    """Queued jobs and jobs being processed under a lease, in submission order."""
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            """SELECT job_id, status, batch_id, client, cost, megapixels, submitted_at,
+                      started_at
+               FROM job_status
+               WHERE status IN ('queued', 'processing') AND batch_id IS NOT NULL
+                 AND (status = 'queued' OR claimed_by IS NOT NULL)
+               ORDER BY rowid"""
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def claim_batch(
+    db_path: str, batch_id: str, worker: str, now: float, lease_expires_at: float
+) -> list[dict]:
+    """Take every queued job of a batch for worker, at Unix time now.
+
+    Returns the claimed rows, or an empty list when another worker was first.
+    """
+    with _connect(db_path) as conn:
         cursor = conn.execute(
-            "DELETE FROM job_status WHERE updated_at < ?", (cutoff,)
+            """UPDATE job_status
+               SET status = 'processing', claimed_by = ?, lease_expires_at = ?,
+                   started_at = ?, attempts = attempts + 1, updated_at = ?
+               WHERE batch_id = ? AND status = 'queued'""",
+            (
+                worker,
+                lease_expires_at,
+                now,
+                datetime.now(timezone.utc).isoformat(),
+                batch_id,
+            ),
+        )
+        if cursor.rowcount == 0:
+            return []
+        rows = conn.execute(
+            "SELECT * FROM job_status WHERE batch_id = ? AND claimed_by = ? ORDER BY rowid",
+            (batch_id, worker),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def renew_leases(db_path: str, worker: str, lease_expires_at: float) -> int:
+    """Extend the leases of the jobs worker is processing. Returns their count."""
+    with _connect(db_path) as conn:
+        cursor = conn.execute(
+            """UPDATE job_status SET lease_expires_at = ?
+               WHERE claimed_by = ? AND status = 'processing'""",
+            (lease_expires_at, worker),
         )
         return cursor.rowcount
+
+
+def requeue_expired(db_path: str, now: float, max_attempts: int, error: str) -> tuple[int, int]:
+    """Return jobs whose lease ran out before Unix time now to the queue.
+
+    Jobs that already had max_attempts claims fail with error instead, so a
+    job that kills its worker cannot take down one worker after another.
+    Returns (requeued, failed) job counts.
+    """
+    updated_at = datetime.now(timezone.utc).isoformat()
+    with _connect(db_path) as conn:
+        failed = conn.execute(
+            """UPDATE job_status
+               SET status = 'failed', error = ?, current_step = 'エラー',
+                   eta_seconds = NULL, claimed_by = NULL, lease_expires_at = NULL,
+                   updated_at = ?
+               WHERE status = 'processing' AND lease_expires_at < ? AND attempts >= ?""",
+            (error, updated_at, now, max_attempts),
+        ).rowcount
+        requeued = conn.execute(
+            """UPDATE job_status
+               SET status = 'queued', progress = 0, current_step = '待機中', stage = '',
+                   eta_seconds = NULL, claimed_by = NULL, lease_expires_at = NULL,
+                   started_at = NULL, updated_at = ?
+               WHERE status = 'processing' AND lease_expires_at < ?""",
+            (updated_at, now),
+        ).rowcount
+    if failed or requeued:
+        logger.warning(f"Expired job leases: {requeued} requeued, {failed} failed")
+    return requeued, failed
+
+
+def cancel_batch(
+    db_path: str, job_id: str, error: str, client: str | None = None
+) -> str | None:
+    """Cancel a job together with the other jobs of its batch.
+
+    Queued jobs are cancelled at once, with error. Jobs being processed get
+    cancel_requested, which their worker checks between steps. With client,
+    only that client leaves the batch's requesters; the batch is cancelled
+    once no other requester is left. Returns the job's status afterwards, or
+    None when there is no such job.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    with _connect(db_path) as conn:
+        # Under one write lock, so a worker cannot claim the batch in between
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT batch_id FROM job_status WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row["batch_id"] is None:
+            where, key = "job_id = ?", job_id
+        else:
+            where, key = "batch_id = ?", row["batch_id"]
+            if client is not None:
+                conn.execute(
+                    "DELETE FROM batch_requesters WHERE batch_id = ? AND client = ?",
+                    (key, client),
+                )
+                others = conn.execute(
+                    "SELECT COUNT(*) FROM batch_requesters WHERE batch_id = ?", (key,)
+                ).fetchone()[0]
+                if others:
+                    logger.info(f"Client left batch {key}; {others} other requesters keep it")
+                    return conn.execute(
+                        "SELECT status FROM job_status WHERE job_id = ?", (job_id,)
+                    ).fetchone()["status"]
+        conn.execute(
+            f"""UPDATE job_status
+                SET status = 'cancelled', error = ?, current_step = 'キャンセル',
+                    eta_seconds = NULL, updated_at = ?
+                WHERE {where} AND status = 'queued'""",
+            (error, now, key),
+        )
+        conn.execute(
+            f"UPDATE job_status SET cancel_requested = 1 WHERE {where} AND status = 'processing'",
+            (key,),
+        )
+        return conn.execute(
+            "SELECT status FROM job_status WHERE job_id = ?", (job_id,)
+        ).fetchone()["status"]
+
+
+def record_poll(db_path: str, job_id: str, now: float) -> None:
+    """Note that a client asked for an unfinished job's status at Unix time now."""
+    with _connect(db_path) as conn:
+        conn.execute(
+            """UPDATE job_status SET polled_at = ?
+               WHERE job_id = ? AND status IN ('queued', 'processing')""",
+            (now, job_id),
+        )
+
+
+def get_batch_signals(db_path: str, batch_id: str) -> tuple[bool, float | None]:
+    """(cancel requested, Unix time of the last poll or else the submission) of a batch."""
+    with _connect(db_path) as conn:
+        row = conn.execute(
+            """SELECT MAX(cancel_requested), MAX(COALESCE(polled_at, submitted_at))
+               FROM job_status WHERE batch_id = ?""",
+            (batch_id,),
+        ).fetchone()
+        return bool(row[0]), row[1]
+
+
+def get_claiming_workers(db_path: str) -> list[str]:
+    """Workers holding the lease of at least one job."""
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            """SELECT DISTINCT claimed_by FROM job_status
+               WHERE status = 'processing' AND claimed_by IS NOT NULL"""
+        ).fetchall()
+        return [row["claimed_by"] for row in rows]
+
+
+def expire_leases(db_path: str, workers: list[str]) -> int:
+    """End the leases of every job the given workers hold. Returns the job count.
+
+    requeue_expired() then returns the jobs to the queue as if the leases had
+    run out.
+    """
+    if not workers:
+        return 0
+    placeholders = ", ".join("?" for _ in workers)
+    with _connect(db_path) as conn:
+        cursor = conn.execute(
+            f"""UPDATE job_status SET lease_expires_at = 0
+                WHERE status = 'processing' AND claimed_by IN ({placeholders})""",
+            workers,
+        )
+    if cursor.rowcount:
+        logger.warning(f"Expired the leases of {cursor.rowcount} jobs held by {len(workers)} dead workers")
+    return cursor.rowcount
+
+
+def expire_stale_jobs(db_path: str, updated_before: str, error: str) -> tuple[int, int]:
+    """Handle jobs whose status has not changed since updated_before.
+
+    Stale processing jobs get their lease ended, so requeue_expired() queues
+    them again. Queued or processing jobs from before the durable queue (no
+    batch_id) cannot be queued again and fail with error instead. Returns
+    (expired, failed) job counts.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    with _connect(db_path) as conn:
+        expired = conn.execute(
+            """UPDATE job_status SET lease_expires_at = 0
+               WHERE status = 'processing' AND batch_id IS NOT NULL AND updated_at < ?""",
+            (updated_before,),
+        ).rowcount
+        failed = conn.execute(
+            """UPDATE job_status
+               SET status = 'failed', error = ?, current_step = 'エラー',
+                   eta_seconds = NULL, updated_at = ?
+               WHERE status IN ('queued', 'processing') AND batch_id IS NULL
+                 AND updated_at < ?""",
+            (error, now, updated_before),
+        ).rowcount
+    if expired or failed:
+        logger.warning(f"Stale jobs: {expired} leases expired, {failed} failed")
+    return expired, failed
+
+
+def cleanup_old_job_status(db_path: str, hours: int = 24, limit: int | None = None) -> int:
+    """Delete job status records older than specified hours. Returns count of deleted rows.
+
+    Jobs still queued or processing are kept. Idempotency keys of that age
+    go too, as the jobs they name are gone, and so do the requesters of
+    batches without jobs left. At most limit rows of each table are deleted.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+    with _connect(db_path) as conn:
+        _delete_before(conn, "idempotency_keys", "created_at", cutoff, limit)
+        deleted = _delete_before(
+            conn, "job_status", "updated_at", cutoff, limit,
+            "status NOT IN ('queued', 'processing')",
+        )
+        conn.execute(
+            """DELETE FROM batch_requesters WHERE rowid IN (
+                   SELECT rowid FROM batch_requesters WHERE batch_id NOT IN (
+                       SELECT batch_id FROM job_status WHERE batch_id IS NOT NULL)
+                   LIMIT ?)""",
+            (-1 if limit is None else limit,),
+        )
+        return deleted
+
+
+def get_active_job_files(db_path: str) -> tuple[set[str], set[str], set[str]]:
+    """Job ids, batch ids and input image paths of jobs queued or processing.
+
+    Their output, checkpoint and upload files must not be deleted.
+    """
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            """SELECT job_id, batch_id, image_path FROM job_status
+               WHERE status IN ('queued', 'processing')"""
+        ).fetchall()
+    return (
+        {row["job_id"] for row in rows},
+        {row["batch_id"] for row in rows if row["batch_id"]},
+        {row["image_path"] for row in rows if row["image_path"]},
+    )
+
+
+# Result cache for seeded (reproducible) generations
+
+
+def save_cached_result(db_path: str, cache_key: str, result_path: str) -> None:
+    """Remember the output directory produced for a cache key."""
+    now = datetime.now(timezone.utc).isoformat()
+    with _connect(db_path) as conn:
+        conn.execute(
+            """INSERT INTO result_cache (cache_key, result_path, created_at)
+               VALUES (?, ?, ?)
+               ON CONFLICT(cache_key) DO UPDATE SET
+                   result_path = excluded.result_path,
+                   created_at = excluded.created_at""",
+            (cache_key, result_path, now),
+        )
+
+
+def get_cached_result(db_path: str, cache_key: str) -> str | None:
+    """Return the output directory stored for a cache key, if any."""
+    with _connect(db_path) as conn:
+        row = conn.execute(
+            "SELECT result_path FROM result_cache WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+        return row[0] if row else None
+
+
+def delete_cached_result(db_path: str, cache_key: str) -> None:
+    """Forget a cache entry (e.g. when its output directory is gone)."""
+    with _connect(db_path) as conn:
+        conn.execute("DELETE FROM result_cache WHERE cache_key = ?", (cache_key,))
+
+
+def cleanup_old_cached_results(db_path: str, hours: int = 24, limit: int | None = None) -> int:
+    """Forget cache entries older than hours. Returns count of deleted rows."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+    with _connect(db_path) as conn:
+        return _delete_before(conn, "result_cache", "created_at", cutoff, limit)
+
+
+# Upload content hashes and idempotent requests
+
+
+def save_upload(db_path: str, file_id: str, sha256: str) -> None:
+    """Remember the content hash of an uploaded file."""
+    now = datetime.now(timezone.utc).isoformat()
+    with _connect(db_path) as conn:
+        conn.execute(
+            """INSERT INTO uploads (file_id, sha256, created_at) VALUES (?, ?, ?)
+               ON CONFLICT(file_id) DO UPDATE SET sha256 = excluded.sha256""",
+            (file_id, sha256, now),
+        )
+
+
+def get_upload_hash(db_path: str, file_id: str) -> str | None:
+    """Content hash recorded for an upload, if any."""
+    with _connect(db_path) as conn:
+        row = conn.execute("SELECT sha256 FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+        return row[0] if row else None
+
+
+def claim_idempotency_key(db_path: str, key: str, job_ids: list[str]) -> list[str]:
+    """Bind key to job_ids unless it is bound already. Returns the bound job ids.
+
+    Of concurrent requests with one key, exactly one gets its own job ids back.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    with _connect(db_path) as conn:
+        conn.execute(
+            """INSERT INTO idempotency_keys (idempotency_key, job_ids, created_at)
+               VALUES (?, ?, ?)
+               ON CONFLICT(idempotency_key) DO NOTHING""",
+            (key, json.dumps(job_ids), now),
+        )
+        row = conn.execute(
+            "SELECT job_ids FROM idempotency_keys WHERE idempotency_key = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0])
+
+
+def rebind_idempotency_key(db_path: str, key: str, job_ids: list[str]) -> None:
+    """Point a claimed key at the jobs its request ended up with."""
+    with _connect(db_path) as conn:
+        conn.execute(
+            "UPDATE idempotency_keys SET job_ids = ? WHERE idempotency_key = ?",
+            (json.dumps(job_ids), key),
+        )
+
+
+def delete_idempotency_key(db_path: str, key: str) -> None:
+    """Release a key whose request failed, so a retry can use it."""
+    with _connect(db_path) as conn:
+        conn.execute("DELETE FROM idempotency_keys WHERE idempotency_key = ?", (key,))
+
+
+def cleanup_old_uploads(db_path: str, hours: int = 24, limit: int | None = None) -> int:
+    """Delete upload hashes older than hours. Returns count of deleted rows."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+    with _connect(db_path) as conn:
+        return _delete_before(conn, "uploads", "created_at", cutoff, limit)
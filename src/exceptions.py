@@ -9,5 +9,17 @@ class ProcessingError(Exception):
     """Raised when AI processing fails."""
 
 
+class JobCancelledError(Exception):
+    """Raised inside a job that was cancelled or abandoned, to stop it."""
+
+
+class JobTimeoutError(JobCancelledError):
+    """Raised inside a job that ran past its time limit."""
+
+
 class ResourceExhaustedError(Exception):
     """Raised when server resources are exhausted."""
+
+    def __init__(self, message: str = "", retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds until capacity is expected back
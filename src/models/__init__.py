@@ -2,6 +2,9 @@
 
 from src.models.segment import Segment
 from src.models.difference import Difference, GenerationResult
+from src.models.edit import EditLog, EditPatch, EditState
 from src.models.job import JobStatus
+from src.models.progress import ProgressEvent
 
-__all__ = ["Segment", "Difference", "GenerationResult", "JobStatus"]
+__all__ = ["Segment", "Difference", "GenerationResult", "EditLog", "EditPatch", "EditState",
+           "JobStatus", "ProgressEvent"]
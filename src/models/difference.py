@@ -7,6 +7,8 @@ from typing import Any
 
 import numpy as np
 
+from src.models.edit import EditState
+
 
 @dataclass
 class Difference:
@@ -30,6 +32,8 @@ class GenerationResult:
     modified_image: np.ndarray
     differences: list[Difference]
     metadata: dict[str, Any] = field(default_factory=dict)
+    # Segments and edits kept so one difference can be rerolled later
+    edit_state: EditState | None = field(default=None, repr=False)
 
     def get_metadata_with_differences(self) -> dict[str, Any]:
         return {
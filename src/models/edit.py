@@ -0,0 +1,230 @@
+"""Edit log: candidate changes as ROI patches over an untouched base image."""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from src.models.segment import Segment
+
+
+@dataclass
+class EditPatch:
+    """A single change confined to a rectangular region of interest."""
+
+    bbox: list[int]  # ROI [x1, y1, x2, y2] covered by pixels
+    pixels: np.ndarray  # (h, w, 3) ROI content after the change
+    mask: np.ndarray  # (h, w) boolean, True where pixels differ from the source
+    change_type: str
+    segment_id: int
+    target_bbox: list[int]  # bbox of the visible difference
+    params: dict[str, Any] = field(default_factory=dict)
+    diff_id: int | None = None  # id of the difference it makes, once committed
+
+    def crop(self, bbox: list[int]) -> np.ndarray:
+        """Return the patch pixels for a sub-rectangle of its ROI."""
+        x1, y1, x2, y2 = bbox
+        ox, oy = self.bbox[0], self.bbox[1]
+        return self.pixels[y1 - oy:y2 - oy, x1 - ox:x2 - ox]
+
+
+class EditLog:
+    """Ordered list of committed patches over a read-only base image.
+
+    Candidate changes read their ROI through the log, so they see every
+    committed edit without a full-image copy per attempt. The full-resolution
+    result is only built by materialize().
+    """
+
+    def __init__(self, base: np.ndarray) -> None:
+        self._base = base
+        self._patches: list[EditPatch] = []
+
+    @property
+    def base(self) -> np.ndarray:
+        return self._base
+
+    @property
+    def patches(self) -> list[EditPatch]:
+        return list(self._patches)
+
+    def read(self, bbox: list[int]) -> np.ndarray:
+        """Return a copy of the current state of the image inside bbox."""
+        x1, y1, x2, y2 = bbox
+        region = self._base[y1:y2, x1:x2].copy()
+        for patch in self._patches:
+            _overlay(region, bbox, patch)
+        return region
+
+    def make_patch(
+        self,
+        bbox: list[int],
+        before: np.ndarray,
+        after: np.ndarray,
+        change_type: str,
+        segment_id: int,
+        target_bbox: list[int],
+        params: dict[str, Any] | None = None,
+        diff_id: int | None = None,
+    ) -> EditPatch:
+        """Build a patch from an ROI before and after a change."""
+        changed = np.any(before != after, axis=2)
+        return EditPatch(
+            bbox=list(bbox),
+            pixels=after,
+            mask=changed,
+            change_type=change_type,
+            segment_id=segment_id,
+            target_bbox=list(target_bbox),
+            params=params or {},
+            diff_id=diff_id,
+        )
+
+    def commit(self, patch: EditPatch) -> None:
+        """Accept a patch. Rejected patches are simply never committed."""
+        self._patches.append(patch)
+
+    def materialize(self) -> np.ndarray:
+        """Build the full-resolution modified image."""
+        h, w = self._base.shape[:2]
+        result = self._base.copy()
+        for patch in self._patches:
+            _overlay(result, [0, 0, w, h], patch)
+        return result
+
+
+@dataclass
+class EditState:
+    """What a finished puzzle keeps so that one difference can be replaced.
+
+    Segments and proxy_patches are at analysis resolution (proxy_shape);
+    patches are the matching full-resolution edits and are the same list when
+    scale is 1.0. Both patch lists are aligned with the puzzle's differences:
+    patch i is difference i + 1.
+    """
+
+    difficulty: str
+    seed: int
+    scale: float
+    proxy_shape: tuple[int, int]  # (h, w)
+    segments: list[Segment]
+    # segment id -> (is_acceptable, quality_score, reason)
+    quality: dict[int, tuple[bool, float, str]]
+    proxy_patches: list[EditPatch]
+    patches: list[EditPatch]
+
+    def save(self, path: str | Path) -> None:
+        """Write the state as a compressed .npz archive.
+
+        Segment masks are stored cropped to their bbox.
+        """
+        arrays: dict[str, np.ndarray] = {}
+        segments = []
+        for i, seg in enumerate(self.segments):
+            x1, y1, x2, y2 = seg.bbox
+            arrays[f"segment_{i}"] = seg.mask[y1:y2, x1:x2]
+            segments.append({
+                "id": seg.id,
+                "bbox": seg.bbox,
+                "area": seg.area,
+                "confidence": seg.confidence,
+                "saliency_score": seg.saliency_score,
+            })
+
+        shared = self.patches is self.proxy_patches
+        meta = {
+            "difficulty": self.difficulty,
+            "seed": self.seed,
+            "scale": self.scale,
+            "proxy_shape": list(self.proxy_shape),
+            "segments": segments,
+            "quality": {str(k): list(v) for k, v in self.quality.items()},
+            "proxy_patches": _pack_patches("proxy", self.proxy_patches, arrays),
+            "patches": None if shared else _pack_patches("full", self.patches, arrays),
+        }
+        arrays["meta"] = np.array(json.dumps(meta, default=_json_default))
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str | Path) -> EditState:
+        """Read a state written by save()."""
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            h, w = meta["proxy_shape"]
+
+            segments = []
+            for i, info in enumerate(meta["segments"]):
+                x1, y1, x2, y2 = info["bbox"]
+                mask = np.zeros((h, w), dtype=bool)
+                mask[y1:y2, x1:x2] = data[f"segment_{i}"]
+                segments.append(Segment(mask=mask, **info))
+
+            proxy_patches = _unpack_patches("proxy", meta["proxy_patches"], data)
+            if meta["patches"] is None:
+                patches = proxy_patches
+            else:
+                patches = _unpack_patches("full", meta["patches"], data)
+
+        return cls(
+            difficulty=meta["difficulty"],
+            seed=meta["seed"],
+            scale=meta["scale"],
+            proxy_shape=(h, w),
+            segments=segments,
+            quality={int(k): tuple(v) for k, v in meta["quality"].items()},
+            proxy_patches=proxy_patches,
+            patches=patches,
+        )
+
+
+def _pack_patches(prefix: str, patches: list[EditPatch], arrays: dict) -> list[dict]:
+    records = []
+    for i, patch in enumerate(patches):
+        arrays[f"{prefix}_{i}_pixels"] = patch.pixels
+        arrays[f"{prefix}_{i}_mask"] = patch.mask
+        records.append({
+            "bbox": patch.bbox,
+            "change_type": patch.change_type,
+            "segment_id": patch.segment_id,
+            "target_bbox": patch.target_bbox,
+            "params": patch.params,
+            "diff_id": patch.diff_id,
+        })
+    return records
+
+
+def _unpack_patches(prefix: str, records: list[dict], data) -> list[EditPatch]:
+    return [
+        EditPatch(
+            pixels=data[f"{prefix}_{i}_pixels"],
+            mask=data[f"{prefix}_{i}_mask"],
+            **record,
+        )
+        for i, record in enumerate(records)
+    ]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def _overlay(region: np.ndarray, bbox: list[int], patch: EditPatch) -> None:
+    """Write the changed pixels of patch into region (located at bbox) in place."""
+    x1 = max(bbox[0], patch.bbox[0])
+    y1 = max(bbox[1], patch.bbox[1])
+    x2 = min(bbox[2], patch.bbox[2])
+    y2 = min(bbox[3], patch.bbox[3])
+    if x1 >= x2 or y1 >= y2:
+        return
+
+    px, py = patch.bbox[0], patch.bbox[1]
+    changed = patch.mask[y1 - py:y2 - py, x1 - px:x2 - px]
+    dst = region[y1 - bbox[1]:y2 - bbox[1], x1 - bbox[0]:x2 - bbox[0]]
+    dst[changed] = patch.pixels[y1 - py:y2 - py, x1 - px:x2 - px][changed]
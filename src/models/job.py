@@ -12,6 +12,7 @@ class JobState(str, Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 @dataclass
@@ -24,8 +25,27 @@ class JobStatus:
     current_step: str = ""
     error: str | None = None
     result_path: str | None = None
+    stage: str = ""  # pipeline stage currently running
+    eta_seconds: float | None = None
+    preview_path: str | None = None  # low-resolution preview of the edits
+    queue_position: int | None = None  # 1-based, while queued; not persisted
 
     def to_dict(self) -> dict[str, Any]:
         d = asdict(self)
         d["status"] = self.status.value
         return d
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any]) -> JobStatus:
+        """Rebuild a status from a job_status row."""
+        return cls(
+            job_id=d["job_id"],
+            status=JobState(d["status"]),
+            progress=d["progress"],
+            current_step=d["current_step"],
+            error=d["error"],
+            result_path=d["result_path"],
+            stage=d.get("stage") or "",
+            eta_seconds=d.get("eta_seconds"),
+            preview_path=d.get("preview_path"),
+        )
@@ -0,0 +1,31 @@
+"""Structured progress events emitted while a job runs."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+
+STAGE_START = "stage_start"
+STAGE_END = "stage_end"
+PROGRESS = "progress"  # done/total within a stage
+PREVIEW = "preview"  # an intermediate image is available
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    """One step of a job, as reported to whoever drives its status."""
+
+    kind: str
+    stage: str
+    variant: int | None = None  # index of the puzzle variant; None for shared stages
+    seconds: float | None = None  # duration, on STAGE_END
+    cached: bool = False  # STAGE_END served from the stage cache
+    done: int | None = None
+    total: int | None = None
+    message: str = ""
+    preview: np.ndarray | None = field(default=None, repr=False, compare=False)
+
+
+ProgressCallback = Callable[[ProgressEvent], None] | None
@@ -8,8 +8,10 @@ def register_blueprints(app: Flask) -> None:
     from src.routes.upload import bp as upload_bp
     from src.routes.generate import bp as generate_bp
     from src.routes.pages import bp as pages_bp
+    from src.routes.admin import bp as admin_bp
 
     app.register_blueprint(main_bp)
     app.register_blueprint(upload_bp)
     app.register_blueprint(generate_bp)
     app.register_blueprint(pages_bp)
+    app.register_blueprint(admin_bp)
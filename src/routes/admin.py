@@ -0,0 +1,68 @@
+"""Operator API endpoints, enabled by ADMIN_TOKEN."""
+
+import hmac
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from flask import Blueprint, request, jsonify, current_app, abort
+
+from src import database
+from src.utils.validation import validate_stats_window
+from src.exceptions import ValidationError
+
+bp = Blueprint("admin", __name__, url_prefix="/api/admin")
+
+STATS_PERCENTILES = (50, 95, 99)
+
+
+@bp.before_request
+def require_token():
+    token = current_app.config.get("ADMIN_TOKEN")
+    if not token:
+        abort(404)
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+        return jsonify({"error": "認証が必要です"}), 401
+
+
+@bp.route("/stats", methods=["GET"])
+def stats():
+    """Job counts and p50/p95/p99 stage seconds and input sizes over the last hours."""
+    try:
+        hours = validate_stats_window(
+            request.args.get("hours"), current_app.config["HISTORY_RETENTION_HOURS"]
+        )
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    since = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+    db_path = current_app.config["DATABASE_PATH"]
+    summary = database.get_generation_summary(db_path, since)
+    timings = database.get_stage_timings(db_path, since)
+
+    jobs: dict[str, int] = {}
+    difficulties: dict[str, int] = {}
+    megapixels: list[float] = []
+    for row in summary:
+        jobs[row["status"]] = jobs.get(row["status"], 0) + row["jobs"]
+        difficulties[row["difficulty"]] = difficulties.get(row["difficulty"], 0) + row["jobs"]
+        megapixels.extend(row["megapixels"])
+
+    return jsonify({
+        "window_hours": hours,
+        "since": since,
+        "jobs": {"total": sum(jobs.values()), **jobs},
+        "difficulties": difficulties,
+        "megapixels": _percentiles(megapixels),
+        "stages": {
+            stage: {"count": len(seconds), **_percentiles(seconds)}
+            for stage, seconds in sorted(timings.items())
+        },
+    })
+
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    points = np.percentile(values, STATS_PERCENTILES)
+    return {f"p{p}": round(float(v), 3) for p, v in zip(STATS_PERCENTILES, points)}
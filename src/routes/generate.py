@@ -1,14 +1,23 @@
-"""Generation API endpoints: submit, status, result."""
+"""Generation API endpoints: submit, status, result, cancel."""
 
 import json
+import math
+import time
 import uuid
 from pathlib import Path
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app
 
-from src.models.job import JobState
-from src.utils.validation import validate_difficulty
-from src.exceptions import ValidationError
+from src.models.job import JobState, JobStatus
+from src.utils.validation import (
+    validate_diff_id,
+    validate_idempotency_key,
+    validate_seed,
+    validate_variants,
+)
+from src.exceptions import ProcessingError, ResourceExhaustedError, ValidationError
+from src.services.status_store import TERMINAL_STATES
+from src.utils.file_manager import touch
 
 bp = Blueprint("generate", __name__, url_prefix="/api")
 
@@ -36,7 +45,10 @@ def generate():
         return jsonify({"error": "file_id is required"}), 400
 
     try:
-        difficulty = validate_difficulty(data.get("difficulty", "medium"))
+        difficulties = validate_variants(data, current_app.config.get("MAX_VARIANTS", 3))
+        seed = validate_seed(data.get("seed"))
+        # Retries with the same key (e.g. after a lost response) get the same jobs
+        idempotency_key = validate_idempotency_key(request.headers.get("Idempotency-Key"))
     except ValidationError as e:
         return jsonify({"error": str(e)}), 400
 
@@ -47,15 +59,37 @@ def generate():
         return jsonify({"error": "アップロードされた画像が見つかりません"}), 404
 
     image_path = str(matches[0])
-    job_id = f"job_{uuid.uuid4().hex[:12]}"
+    job_ids = [f"job_{uuid.uuid4().hex[:12]}" for _ in difficulties]
+    # Seeded variants of one request use consecutive seeds
+    seeds = None if seed is None else [(seed + i) % 2**32 for i in range(len(difficulties))]
 
     job_manager = current_app.extensions["job_manager"]
-    job_manager.submit(job_id, image_path, difficulty)
+    try:
+        statuses = job_manager.submit_many(
+            job_ids,
+            image_path,
+            difficulties,
+            seeds,
+            client=request.remote_addr or "",
+            image_hash=job_manager.upload_hash(file_id),
+            idempotency_key=idempotency_key,
+        )
+    except ResourceExhaustedError as e:
+        response = jsonify({"error": str(e)})
+        if e.retry_after is not None:
+            response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+        return response, 503
 
     return jsonify({
         "success": True,
-        "job_id": job_id,
-        "status": "queued",
+        "job_id": statuses[0].job_id,
+        "jobs": [
+            {"job_id": status.job_id, "difficulty": difficulty, "status": status.status.value}
+            for status, difficulty in zip(statuses, difficulties)
+        ],
+        "status": statuses[0].status.value,
+        # Joined identical jobs already queued or running (or a repeated request)
+        "deduplicated": [status.job_id for status in statuses] != job_ids,
     })
 
 
@@ -70,10 +104,87 @@ def get_status(job_id: str):
         )()
 
     job_manager = current_app.extensions["job_manager"]
-    status = job_manager.get_status(job_id)
+    status = job_manager.poll_status(job_id)
+    if status is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    return jsonify(_status_data(status))
+
+
+@bp.route("/status/<job_id>/stream", methods=["GET"])
+def stream_status(job_id: str):
+    """The job's status as Server-Sent Events, one per change, until it finishes.
+
+    Each event's data is what GET /api/status/<job_id> returns. Like polls,
+    an open stream keeps the job from being cancelled as abandoned.
+    """
+    limiter = _get_limiter()
+    if limiter:
+        limiter.limit(current_app.config.get("RATELIMIT_STATUS", "500 per 5 minutes"))(
+            lambda: None
+        )()
+
+    job_manager = current_app.extensions["job_manager"]
+    if job_manager.get_status(job_id) is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+
+    recheck = current_app.config["STATUS_STREAM_RECHECK"]
+    heartbeat = current_app.config["STATUS_STREAM_HEARTBEAT"]
+    lifetime = current_app.config["STATUS_STREAM_SECONDS"]
+
+    def events():
+        started = sent_at = time.monotonic()
+        version = 0
+        last = None
+        # The client reconnects after this many ms if the stream breaks
+        yield f"retry: {int(recheck * 1000)}\n\n"
+        while time.monotonic() - started < lifetime:
+            status = job_manager.poll_status(job_id)
+            if status is None:
+                return
+            data = _status_data(status)
+            if data != last:
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+                last = data
+                sent_at = time.monotonic()
+                if status.status in TERMINAL_STATES:
+                    return
+            elif time.monotonic() - sent_at >= heartbeat:
+                yield ": heartbeat\n\n"
+                sent_at = time.monotonic()
+            version = job_manager.wait_for_update(version, recheck)
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        # No caching, and no buffering by nginx-style proxies
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _status_data(status: JobStatus) -> dict:
+    """A job status as the status endpoints return it."""
+    data = status.to_dict()
+    data["preview_url"] = None
+    if status.preview_path and status.status != JobState.COMPLETED:
+        preview = Path(status.preview_path)
+        data["preview_url"] = f"/outputs/{preview.parent.name}/{preview.name}"
+    return data
+
+
+@bp.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id: str):
+    """Cancel a queued or running job and the variants submitted with it."""
+    job_manager = current_app.extensions["job_manager"]
+    try:
+        # Jobs that other clients' requests joined go on for them
+        status = job_manager.cancel(job_id, client=request.remote_addr or "")
+    except ProcessingError as e:
+        return jsonify({"error": str(e)}), 409
     if status is None:
         return jsonify({"error": "ジョブが見つかりません"}), 404
-    return jsonify(status.to_dict())
+
+    # A running job stops at its next check; 202 until it has
+    return jsonify(status.to_dict()), 200 if status.status == JobState.CANCELLED else 202
 
 
 @bp.route("/result/<job_id>", methods=["GET"])
@@ -86,8 +197,12 @@ def get_result(job_id: str):
     if status.status != JobState.COMPLETED:
         return jsonify({"error": "ジョブが完了していません", "status": status.status.value}), 400
 
-    # Load metadata
+    # Load metadata. Cached results live in the directory of the job that
+    # first produced them, so build URLs from the result path, not the job id.
     out_dir = Path(status.result_path)
+    output_id = out_dir.name
+    # Last use, for the janitor's expiry and disk-space eviction
+    touch(out_dir)
     metadata_path = out_dir / "metadata.json"
     metadata = {}
     if metadata_path.exists():
@@ -97,11 +212,40 @@ def get_result(job_id: str):
     return jsonify({
         "success": True,
         "job_id": job_id,
-        "original_image_url": f"/outputs/{job_id}/original.png",
-        "modified_image_url": f"/outputs/{job_id}/modified.png",
-        "original_with_answers_url": f"/outputs/{job_id}/original_with_answers.png",
-        "modified_with_answers_url": f"/outputs/{job_id}/modified_with_answers.png",
-        "a4_layout_url": f"/outputs/{job_id}/a4_layout.png",
-        "a4_layout_with_answers_url": f"/outputs/{job_id}/a4_layout_with_answers.png",
+        "original_image_url": f"/outputs/{output_id}/original.png",
+        "modified_image_url": f"/outputs/{output_id}/modified.png",
+        "original_with_answers_url": f"/outputs/{output_id}/original_with_answers.png",
+        "modified_with_answers_url": f"/outputs/{output_id}/modified_with_answers.png",
+        "a4_layout_url": f"/outputs/{output_id}/a4_layout.png",
+        "a4_layout_with_answers_url": f"/outputs/{output_id}/a4_layout_with_answers.png",
         "metadata": metadata,
     })
+
+
+@bp.route("/reroll/<job_id>", methods=["POST"])
+def reroll(job_id: str):
+    """Replace one difference of a completed job and return the new result."""
+    limiter = _get_limiter()
+    if limiter:
+        limiter.limit(current_app.config.get("RATELIMIT_REROLL", "20 per minute"))(
+            lambda: None
+        )()
+
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({"error": "JSON body required"}), 400
+
+    job_manager = current_app.extensions["job_manager"]
+    if job_manager.get_status(job_id) is None:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+
+    try:
+        diff_id = validate_diff_id(data.get("diff_id"))
+        seed = validate_seed(data.get("seed"))
+        job_manager.reroll(job_id, diff_id, seed)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except ProcessingError as e:
+        return jsonify({"error": str(e)}), 409
+
+    return get_result(job_id)
@@ -47,6 +47,8 @@ def upload_image():
     file.save(str(filepath))
 
     file_id = filename.rsplit(".", 1)[0]
+    # Hashed once here; generation requests find identical jobs by content
+    current_app.extensions["job_manager"].register_upload(file_id, str(filepath))
 
     return jsonify({
         "success": True,
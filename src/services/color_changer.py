@@ -16,6 +16,9 @@ class ColorChanger:
         image: np.ndarray,
         mask: np.ndarray,
         hue_shift: int | None = None,
+        sat_factor: float | None = None,
+        val_factor: float | None = None,
+        rng: random.Random | None = None,
     ) -> tuple[np.ndarray, int]:
         """Shift the hue of masked pixels in a BGR image with intelligent selection.
 
@@ -23,16 +26,24 @@ class ColorChanger:
             image: BGR image (H, W, 3) uint8.
             mask: Boolean or uint8 mask (H, W).
             hue_shift: Hue shift in [30, 150]. Random if None.
+            sat_factor: Saturation multiplier. Random in [1.05, 1.15] if None.
+            val_factor: Value multiplier. Random in [0.95, 1.05] if None.
+            rng: Random source for the parameters above (module RNG if None).
 
         Returns:
             (modified_image, actual_hue_shift).
         """
+        rng = rng or random
         bool_mask = mask.astype(bool)
         result = image.copy()
 
         # Analyze original color to avoid similar hues
         if hue_shift is None:
-            hue_shift = self._intelligent_hue_selection(image, bool_mask)
+            hue_shift = self._intelligent_hue_selection(image, bool_mask, rng)
+        if sat_factor is None:
+            sat_factor = rng.uniform(1.05, 1.15)
+        if val_factor is None:
+            val_factor = rng.uniform(0.95, 1.05)
 
         hsv = cv2.cvtColor(result, cv2.COLOR_BGR2HSV).astype(np.float32)
 
@@ -40,11 +51,9 @@ class ColorChanger:
         hsv[:, :, 0][bool_mask] = (hsv[:, :, 0][bool_mask] + hue_shift) % 180
 
         # Slightly adjust saturation to make color more vibrant (but not oversaturated)
-        sat_factor = random.uniform(1.05, 1.15)
         hsv[:, :, 1][bool_mask] = np.clip(hsv[:, :, 1][bool_mask] * sat_factor, 0, 255)
 
         # Slight value adjustment to maintain visibility
-        val_factor = random.uniform(0.95, 1.05)
         hsv[:, :, 2][bool_mask] = np.clip(hsv[:, :, 2][bool_mask] * val_factor, 0, 255)
 
         result = cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
@@ -53,26 +62,47 @@ class ColorChanger:
         result = self._blend_edges(image, result, bool_mask)
         return result, hue_shift
 
+    def sample_params(
+        self,
+        image: np.ndarray,
+        mask: np.ndarray,
+        rng: random.Random | None = None,
+    ) -> dict[str, float]:
+        """Draw the random parameters of change_hue up front.
+
+        Passing them back to change_hue reproduces the same change, e.g. when
+        re-rendering a proxy-resolution edit at full resolution.
+        """
+        rng = rng or random
+        return {
+            "hue_shift": self._intelligent_hue_selection(image, mask.astype(bool), rng),
+            "sat_factor": rng.uniform(1.05, 1.15),
+            "val_factor": rng.uniform(0.95, 1.05),
+        }
+
     def _intelligent_hue_selection(
         self,
         image: np.ndarray,
         mask: np.ndarray,
+        rng: random.Random | None = None,
     ) -> int:
         """Select a hue shift that is visibly different from the original.
 
         Args:
             image: BGR image.
             mask: Boolean mask of region to change.
+            rng: Random source (module RNG if None).
 
         Returns:
             Hue shift value.
         """
+        rng = rng or random
         # Get average hue of masked region
         hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
         masked_hues = hsv[:, :, 0][mask]
 
         if len(masked_hues) == 0:
-            return random.randint(60, 120)
+            return rng.randint(60, 120)
 
         avg_hue = np.median(masked_hues)
 
@@ -92,10 +122,10 @@ class ColorChanger:
                     candidates.append(shift)
 
         if candidates:
-            return random.choice(candidates)
+            return rng.choice(candidates)
         else:
             # Fallback to large shift
-            return random.choice([90, 100, 110, 120])
+            return rng.choice([90, 100, 110, 120])
 
     def _blend_edges(
         self,
@@ -2,26 +2,69 @@
 
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
 import random
 import time
-from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
 
 import cv2
 import numpy as np
 
 from src.models.segment import Segment
 from src.models.difference import Difference, GenerationResult
+from src.models.edit import EditLog, EditPatch, EditState
+from src.models.progress import PREVIEW, PROGRESS, ProgressCallback, ProgressEvent
+from src.exceptions import ProcessingError, ValidationError
 from src.services.segmentation import SegmentationService
 from src.services.saliency import SaliencyService
 from src.services.inpainting import InpaintingService
 from src.services.color_changer import ColorChanger
 from src.services.object_duplicator import ObjectDuplicator
+from src.services.pipeline import Pipeline, PipelineRun, Stage, StageCache
 from src.services.quality_evaluator import QualityEvaluator
+from src.utils.deadline import Deadline
+from src.utils.image_io import resize_for_processing, scale_bbox, upscale_mask
 
 logger = logging.getLogger(__name__)
 
-ProgressCallback = Callable[[int, str], None] | None
+# ROI padding (px) per change type: inpainting samples up to its radius (max 15)
+# beyond the dilated mask, colour changes only touch pixels inside the mask.
+_ROI_PADDING = {
+    "deletion": 24,
+    "color_change": 2,
+}
+_MAX_ROI_PADDING = max(_ROI_PADDING.values())
+
+# Selection stops quality-checking once this many times the number of
+# changes have passed; the changes are then sampled from those
+_CANDIDATE_POOL_FACTOR = 3
+
+# Segments tried per reroll before giving up
+_REROLL_CANDIDATES = 6
+
+
+@dataclass(frozen=True)
+class _EditSettings:
+    """How edits are rendered; the cheaper values are used under deadline pressure."""
+
+    blend_mode: str = "alpha"
+    max_retries: int = 2
+    inpaint_method: str | None = None  # None keeps the service's method
+    post_filters: bool = True
+
+
+@dataclass
+class _ChangeOutcome:
+    """Result of the retry loop for one segment, before it is committed."""
+
+    patch: EditPatch
+    is_acceptable: bool
+    quality_score: float
+    reason: str
 
 
 class DifferenceGenerator:
@@ -37,6 +80,11 @@ class DifferenceGenerator:
         difficulty_config: dict,
         segment_min_area_ratio: float = 0.002,
         segment_max_area_ratio: float = 0.15,
+        edit_workers: int = 1,
+        proxy_max_size: int | None = None,
+        fallback_proxy_size: int = 640,
+        fallback_imgsz: int = 512,
+        stage_cache: StageCache | None = None,
     ) -> None:
         self._seg = segmentation
         self._sal = saliency
@@ -47,70 +95,242 @@ class DifferenceGenerator:
         self._difficulty_config = difficulty_config
         self._min_area_ratio = segment_min_area_ratio
         self._max_area_ratio = segment_max_area_ratio
+        self._proxy_max_size = proxy_max_size
+        # Analysis resolution and model input size when the deadline is tight
+        self._fallback_proxy_size = fallback_proxy_size
+        self._fallback_imgsz = fallback_imgsz
+        # cv2 releases the GIL, so threads give real parallelism for ROI edits
+        self._edit_pool = (
+            ThreadPoolExecutor(max_workers=edit_workers, thread_name_prefix="edit")
+            if edit_workers > 1
+            else None
+        )
+        self._pipeline = self._build_pipeline(stage_cache)
+
+    def close(self) -> None:
+        """Stop the edit threads once the edits running now are done."""
+        if self._edit_pool is not None:
+            self._edit_pool.shutdown(wait=True)
+
+    def _build_pipeline(self, cache: StageCache | None) -> Pipeline:
+        """The generation stages, from the input image to the rendered result.
+
+        Decoding the upload and encoding the outputs stay in JobManager, next
+        to the files they read and write. The stages from segmentation to the
+        proxy edits are checkpointed; the proxy and the render are cheaper to
+        redo than to save.
+        """
+        return Pipeline(
+            [
+                Stage("proxy", self._stage_proxy, ("image", "proxy_size")),
+                Stage(
+                    "segment", self._stage_segment, ("proxy", "segment_options"),
+                    count=len, checkpoint=True,
+                ),
+                Stage("saliency", self._stage_saliency, ("proxy", "segment"), checkpoint=True),
+                Stage("quality", self._stage_quality, ("saliency",), checkpoint=True),
+                Stage(
+                    "select", self._stage_select, ("saliency", "quality", "selection", "seed"),
+                    count=lambda selection: len(selection[0]), checkpoint=True,
+                ),
+                Stage(
+                    "edit", self._stage_edit, ("proxy", "select", "settings"),
+                    context=("progress", "deadline"), count=lambda edits: len(edits[1]),
+                    checkpoint=True, version=2,
+                ),
+                Stage("render", self._stage_render, ("image", "proxy", "select", "edit", "settings")),
+            ],
+            cache,
+        )
 
     def generate(
         self,
         image: np.ndarray,
         difficulty: str = "medium",
         progress: ProgressCallback = None,
+        seed: int | None = None,
+        deadline: Deadline | None = None,
     ) -> GenerationResult:
         """Run the full generation pipeline.
 
         Args:
             image: BGR image (H, W, 3) uint8.
             difficulty: "easy", "medium", or "hard".
-            progress: Optional callback(percent, step_name).
+            progress: Optional callback receiving a ProgressEvent when each
+                stage starts and ends, per applied change and when a proxy
+                preview of the result is available.
+            seed: Seed for every random choice; the same image, difficulty,
+                seed and configuration reproduce the same puzzle. Random if None.
+            deadline: Time budget for the job. Stages switch to cheaper options
+                (recorded in metadata["degradations"]) when it gets tight.
+                Its check() runs between stages and between edits.
+
+        Raises:
+            JobCancelledError: deadline.check() stopped the job.
 
         Returns:
             GenerationResult with original, modified image, and difference metadata.
+
+        When proxy_max_size is set, segmentation, saliency, selection and quality
+        checks run on a downscaled proxy; only the accepted edits are re-rendered
+        at full resolution, inside their ROIs.
         """
-        timings: dict[str, float] = {}
-        _notify(progress, 5, "セグメンテーション開始...")
+        seeds = None if seed is None else [seed]
+        return self.generate_many(image, [difficulty], progress, seeds, deadline)[0]
 
-        # 1. Segmentation
-        t0 = time.time()
-        segments = self._seg.segment(
-            image,
-            min_area_ratio=self._min_area_ratio,
-            max_area_ratio=self._max_area_ratio,
+    def generate_many(
+        self,
+        image: np.ndarray,
+        difficulties: list[str],
+        progress: ProgressCallback = None,
+        seeds: list[int] | None = None,
+        deadline: Deadline | None = None,
+        checkpoint_dir: str | Path | None = None,
+    ) -> list[GenerationResult]:
+        """Generate several puzzles from one segmentation and saliency pass.
+
+        The stages run through the pipeline graph: segments, the saliency
+        ranking and segment quality scores are computed once per image and
+        shared; each variant only pays for its own selection and edits,
+        applied over its own edit log. With a stage cache, a later call that
+        changes only the difficulty or the seed reuses the upstream stages.
+        Repeating a difficulty yields several independent variants of it.
+
+        Args:
+            image: BGR image (H, W, 3) uint8.
+            difficulties: One entry per variant ("easy", "medium" or "hard").
+            progress: Optional event callback (see generate). Events of
+                per-variant stages carry the variant's index.
+            seeds: One seed per variant (see generate). Random if None.
+            deadline: Time budget shared by all variants (see generate).
+            checkpoint_dir: Directory where segments, the selections and the
+                proxy edits are saved as their stages finish. A call with the
+                same arguments and directory, e.g. after the worker died,
+                resumes after the saved stages.
+
+        Returns:
+            One GenerationResult per entry of difficulties, in the same order.
+        """
+        if seeds is None:
+            seeds = [new_seed() for _ in difficulties]
+        if len(seeds) != len(difficulties):
+            raise ValueError("seeds must have one entry per difficulty")
+
+        if deadline is None:
+            deadline = Deadline(None)
+
+        run = self._pipeline.run(
+            self._analysis_params(image, deadline, len(difficulties)),
+            context={"deadline": deadline},
+            # Past the deadline an edit may switch to cheap settings mid-way,
+            # so its output no longer matches its key
+            store=lambda: not deadline.expired,
+            listener=progress,
+            checkpoint=StageCache(0, checkpoint_dir) if checkpoint_dir else None,
+            check=deadline.check,
         )
-        timings["segmentation"] = time.time() - t0
-        _notify(progress, 40, f"セグメンテーション完了 ({len(segments)}個検出)")
+        segments = run.get("segment")
 
         if len(segments) < 2:
             logger.warning("Too few segments (%d) to generate differences.", len(segments))
-            return GenerationResult(
-                original_image=image,
-                modified_image=image.copy(),
-                differences=[],
-                metadata={"error": "検出されたオブジェクトが少なすぎます"},
-            )
+            return [
+                GenerationResult(
+                    original_image=image,
+                    modified_image=image.copy(),
+                    differences=[],
+                    metadata={
+                        "error": "検出されたオブジェクトが少なすぎます",
+                        "seed": seed,
+                        "degradations": deadline.degradations,
+                    },
+                )
+                for seed in seeds
+            ]
 
-        # 2. Saliency analysis
-        t0 = time.time()
-        saliency_map = self._sal.compute_map(image)
-        ranked = self._sal.rank_segments(segments, saliency_map)
-        timings["saliency"] = time.time() - t0
-        _notify(progress, 50, "顕著性解析完了")
+        run.get("saliency")
+        run.get("quality")
 
-        # 3. Select segments based on difficulty
-        selected = self._select_segments(ranked, difficulty)
-        _notify(progress, 55, f"{len(selected)}個のオブジェクトを変更します")
+        results = []
+        count = len(difficulties)
+        for i, (difficulty, seed) in enumerate(zip(difficulties, seeds)):
+            results.append(self._generate_variant(
+                run, difficulty, _for_variant(progress, i), seed, deadline, count - i
+            ))
+        return results
 
-        # 4. Apply changes
-        t0 = time.time()
-        modified, differences = self._apply_changes(image, selected, progress)
-        timings["changes"] = time.time() - t0
+    def _analysis_params(self, image: np.ndarray, deadline: Deadline, variants: int) -> dict:
+        """Pipeline parameters of the stages shared by every variant."""
+        proxy_size = self._proxy_max_size
+        imgsz = None
+        needed = deadline.budget("segmentation", "saliency") + variants * deadline.budget(
+            "changes", "render", "outputs"
+        )
+        if deadline.remaining() < needed:
+            # Not enough time left for a full-resolution analysis
+            proxy_size = min(proxy_size or self._fallback_proxy_size, self._fallback_proxy_size)
+            imgsz = self._fallback_imgsz
+            deadline.degrade("reduced_resolution")
 
-        total_time = sum(timings.values())
-        timings["total"] = total_time
+        return {
+            "image": image,
+            "proxy_size": proxy_size,
+            "segment_options": {
+                "model": type(self._seg).__name__,
+                "min_area_ratio": self._min_area_ratio,
+                "max_area_ratio": self._max_area_ratio,
+                "imgsz": imgsz,
+            },
+        }
 
-        _notify(progress, 95, "メタデータを生成中...")
+    def _generate_variant(
+        self,
+        run: PipelineRun,
+        difficulty: str,
+        progress: ProgressCallback,
+        seed: int,
+        deadline: Deadline,
+        variants_left: int = 1,
+    ) -> GenerationResult:
+        """Select segments and apply edits for one puzzle variant."""
+        settings = self._edit_settings(difficulty)
+        if deadline.tight("changes", "render", "outputs", repeat=variants_left):
+            settings = self._cheap_settings(settings, deadline)
+        config = self._difficulty_config[difficulty]
+        run = run.derive(
+            {
+                "selection": {
+                    "num_changes": config["num_changes"],
+                    "max_saliency": config["max_saliency"],
+                },
+                "seed": seed,
+                "settings": settings,
+            },
+            context={"progress": progress},
+            listener=progress,
+        )
+
+        proxy_patches, _ = run.get("edit")
+        proxy, scale = run.get("proxy")
+        if progress is not None:
+            preview = EditLog(proxy)
+            for patch in proxy_patches:
+                preview.commit(patch)
+            progress(ProgressEvent(PREVIEW, "edit", preview=preview.materialize()))
+
+        modified, patches, differences = run.get("render")
+
+        timings = {name: run.timings[name] for name in self._pipeline.stages if name in run.timings}
+        timings["total"] = sum(timings.values())
 
         metadata = {
             "difficulty": difficulty,
+            "seed": seed,
             "processing_times": {k: round(v, 2) for k, v in timings.items()},
-            "segments_detected": len(segments),
+            "cached_stages": [name for name in self._pipeline.stages if name in run.cached],
+            "segments_detected": len(run.get("segment")),
+            "proxy_scale": round(scale, 4),
+            "deadline_seconds": deadline.seconds,
+            "degradations": deadline.degradations,
             "model_versions": {
                 "segmentation": "FastSAM-x",
                 "saliency": "OpenCV SpectralResidual",
@@ -118,44 +338,94 @@ class DifferenceGenerator:
             },
         }
 
-        _notify(progress, 100, "完了")
-
         return GenerationResult(
-            original_image=image,
+            original_image=run.get("image"),
             modified_image=modified,
             differences=differences,
             metadata=metadata,
+            edit_state=EditState(
+                difficulty=difficulty,
+                seed=seed,
+                scale=scale,
+                proxy_shape=proxy.shape[:2],
+                segments=run.get("saliency"),
+                quality=dict(run.get("quality")),
+                proxy_patches=proxy_patches,
+                patches=patches,
+            ),
+        )
+
+    def _stage_proxy(self, image: np.ndarray, proxy_size: int | None) -> tuple[np.ndarray, float]:
+        """Analysis-resolution copy of the image and its scale."""
+        if proxy_size:
+            return resize_for_processing(image, proxy_size)
+        return image, 1.0
+
+    def _stage_segment(self, proxy: tuple[np.ndarray, float], options: dict) -> list[Segment]:
+        seg_options = {"imgsz": options["imgsz"]} if options["imgsz"] else {}
+        return self._seg.segment(
+            proxy[0],
+            min_area_ratio=options["min_area_ratio"],
+            max_area_ratio=options["max_area_ratio"],
+            **seg_options,
         )
 
-    def _select_segments(
-        self, ranked: list[Segment], difficulty: str
+    def _stage_saliency(
+        self, proxy: tuple[np.ndarray, float], segments: list[Segment]
     ) -> list[Segment]:
-        """Pick segments based on difficulty settings with quality filtering."""
-        config = self._difficulty_config[difficulty]
-        num_changes = config["num_changes"]
-        max_saliency = config["max_saliency"]
-
-        # First, filter by quality
-        quality_filtered = []
-        for seg in ranked:
-            is_acceptable, quality_score, reason = self._quality.evaluate_segment_quality(
-                np.zeros((seg.mask.shape[0], seg.mask.shape[1], 3), dtype=np.uint8),
-                seg,
-            )
-            if is_acceptable:
-                seg.quality_score = quality_score  # Store for reference
-                quality_filtered.append(seg)
-            else:
-                logger.debug(f"Segment {seg.id} rejected: {reason}")
+        """Segments ranked by saliency, least noticeable first."""
+        if len(segments) < 2:
+            return []
+        saliency_map = self._sal.compute_map(proxy[0])
+        # Scores are set on copies so the segment stage's output stays as cached
+        return self._sal.rank_segments([replace(seg) for seg in segments], saliency_map)
+
+    def _stage_quality(self, ranked: list[Segment]) -> dict[int, tuple[bool, float, str]]:
+        """Quality-check segments in saliency order for every difficulty.
 
-        logger.info(f"Quality filtered: {len(quality_filtered)} / {len(ranked)} segments passed")
+        Evaluates until the largest candidate pool of any difficulty passed.
+        Segments below a difficulty's max_saliency come first in ranked, so
+        this usually covers every variant; the select stage evaluates further
+        segments for one that needs more.
+        """
+        pool = max(config["num_changes"] for config in self._difficulty_config.values())
+        return self._quality.evaluate_segments(ranked, needed=pool * _CANDIDATE_POOL_FACTOR)
+
+    def _stage_select(
+        self,
+        ranked: list[Segment],
+        quality: dict[int, tuple[bool, float, str]],
+        selection: dict,
+        seed: int,
+    ) -> tuple[list[Segment], tuple]:
+        """Pick segments based on difficulty settings with quality filtering.
+
+        Segments the quality stage did not reach are evaluated into a copy of
+        its results: the cached output must not change after it was stored.
+
+        Returns:
+            The selected segments and the state of the variant's RNG after
+            sampling, from which the edit stage continues.
+        """
+        num_changes = selection["num_changes"]
+        max_saliency = selection["max_saliency"]
+        pool = num_changes * _CANDIDATE_POOL_FACTOR
+        rng = random.Random(seed)
+        quality = dict(quality)
 
-        # Then filter by saliency
-        candidates = [s for s in quality_filtered if s.saliency_score <= max_saliency]
+        eligible = [s for s in ranked if s.saliency_score <= max_saliency]
+        self._quality.evaluate_segments(eligible, needed=pool, results=quality)
+        candidates = self._passed(eligible, quality)
 
-        # If not enough candidates below threshold, relax and take from full quality list
+        # If not enough candidates below threshold, go on through the full list
         if len(candidates) < num_changes:
-            candidates = quality_filtered.copy()
+            self._quality.evaluate_segments(ranked, needed=pool, results=quality)
+            candidates = self._passed(ranked, quality)
+
+        logger.info(
+            f"Quality filtered: {len(candidates)} passed of "
+            f"{len(quality)} / {len(ranked)} segments evaluated"
+        )
 
         # If still not enough, take from ranked list (without quality filter)
         if len(candidates) < num_changes:
@@ -163,84 +433,551 @@ class DifferenceGenerator:
             candidates = ranked.copy()
 
         n = min(num_changes, len(candidates))
-        return random.sample(candidates, n)
+        return rng.sample(candidates, n), rng.getstate()
+
+    def _stage_edit(
+        self,
+        proxy: tuple[np.ndarray, float],
+        selection: tuple[list[Segment], tuple],
+        settings: _EditSettings,
+        progress: ProgressCallback = None,
+        deadline: Deadline | None = None,
+    ) -> tuple[list[EditPatch], list[Difference]]:
+        """Edits on the proxy: the accepted patches and their differences."""
+        selected, rng_state = selection
+        rng = random.Random()
+        rng.setstate(rng_state)
+        log, differences = self._apply_changes(
+            proxy[0], selected, progress, settings, rng, deadline or Deadline(None)
+        )
+        return log.patches, differences
+
+    def _stage_render(
+        self,
+        image: np.ndarray,
+        proxy: tuple[np.ndarray, float],
+        selection: tuple[list[Segment], tuple],
+        edits: tuple[list[EditPatch], list[Difference]],
+        settings: _EditSettings,
+    ) -> tuple[np.ndarray, list[EditPatch], list[Difference]]:
+        """Build the full-resolution result.
+
+        Returns:
+            The modified image, the full-resolution patches (the proxy patches
+            at scale 1.0) and the differences with full-resolution bboxes.
+        """
+        proxy_image, scale = proxy
+        proxy_patches, proxy_differences = edits
+        log = EditLog(proxy_image)
+        for patch in proxy_patches:
+            log.commit(patch)
+        # Copies, so the edit stage's output stays as cached
+        differences = [replace(diff) for diff in proxy_differences]
+
+        if scale < 1.0:
+            modified, patches = self._render_full_resolution(
+                image, log, selection[0], differences, scale, settings
+            )
+        else:
+            modified, patches = log.materialize(), proxy_patches
+        return modified, patches, differences
+
+    def reroll(
+        self,
+        image: np.ndarray,
+        state: EditState,
+        diff_id: int,
+        seed: int | None = None,
+    ) -> GenerationResult:
+        """Replace one difference of a finished puzzle with a change to another segment.
+
+        Reuses the segments, quality scores and edits kept in state, so neither
+        segmentation nor saliency runs again. The old patch is dropped, edits
+        that read pixels it wrote are replayed with their original parameters,
+        and the new change is confined to a region no other edit touches.
+
+        Args:
+            image: Original full-resolution image of the puzzle.
+            state: EditState of the puzzle (from generation or a previous reroll).
+            diff_id: Id of the difference to replace; the new one keeps it.
+            seed: Seed for the new change. Random if None.
+
+        Returns:
+            GenerationResult with the new modified image, all differences and
+            the updated edit_state.
+        """
+        index = diff_id - 1
+        if not 0 <= index < len(state.proxy_patches):
+            raise ValidationError("指定された間違いが見つかりません")
+        if seed is None:
+            seed = new_seed()
+        rng = random.Random(seed)
+        t0 = time.time()
+
+        h, w = image.shape[:2]
+        ph, pw = state.proxy_shape
+        if state.scale < 1.0:
+            proxy = cv2.resize(image, (pw, ph), interpolation=cv2.INTER_AREA)
+        else:
+            proxy = image
+        settings = self._edit_settings(state.difficulty)
+        by_id = {seg.id: seg for seg in state.segments}
+
+        # Rebuild the other edits; replay those that read what the old one wrote
+        proxy_patches = list(state.proxy_patches)
+        proxy_log = EditLog(proxy)
+        changed = [proxy_patches[index].bbox]
+        replayed: set[int] = set()
+        for j, patch in enumerate(proxy_patches):
+            if j == index:
+                continue
+            if j > index and _intersects_any(_patch_reads(patch), changed):
+                spec = self._full_resolution_spec(by_id[patch.segment_id], patch, 1.0, pw, ph)
+                patch = proxy_patches[j] = self._render_spec(proxy_log, spec, 1.0, settings)
+                changed.append(patch.bbox)
+                replayed.add(j)
+            proxy_log.commit(patch)
+
+        # New change on an unused segment, away from every other edit
+        occupied = [roi for patch in proxy_log.patches for roi in _patch_reads(patch)]
+        used = {patch.segment_id for patch in state.proxy_patches}
+        outcome = None
+        for seg in self._reroll_candidates(state, used, occupied, rng):
+            candidate = self._attempt_change(
+                proxy_log, seg, self._decide_change_type(seg, rng), settings,
+                random.Random(rng.getrandbits(64)),
+            )
+            if candidate is not None and not _intersects_any(_patch_reads(candidate.patch), occupied):
+                outcome = candidate
+                break
+        if outcome is None:
+            raise ProcessingError("差し替えに使えるオブジェクトがありません")
+        proxy_patches[index] = replace(outcome.patch, diff_id=diff_id)
+        proxy_log.commit(proxy_patches[index])
+
+        if state.scale < 1.0:
+            patches = list(state.patches)
+            log = EditLog(image)
+            for j in range(len(patches)):
+                if j == index:
+                    continue
+                if j in replayed:
+                    spec = self._full_resolution_spec(
+                        by_id[proxy_patches[j].segment_id], proxy_patches[j], state.scale, w, h
+                    )
+                    patches[j] = self._render_spec(log, spec, state.scale, settings)
+                log.commit(patches[j])
+            spec = self._full_resolution_spec(
+                by_id[outcome.patch.segment_id], proxy_patches[index], state.scale, w, h
+            )
+            patches[index] = self._render_spec(log, spec, state.scale, settings)
+            log.commit(patches[index])
+            modified = log.materialize()
+        else:
+            patches = proxy_patches
+            modified = proxy_log.materialize()
+
+        differences = []
+        for i, patch in enumerate(patches):
+            diff = self._apply_single_change(image, by_id[patch.segment_id], patch.change_type, i + 1)
+            diff.bbox = patch.target_bbox
+            differences.append(diff)
+
+        logger.info(
+            f"Rerolled difference {diff_id} as {outcome.patch.change_type} "
+            f"on segment {outcome.patch.segment_id} ({len(replayed)} edits replayed)"
+        )
+        metadata = {
+            "difficulty": state.difficulty,
+            "seed": state.seed,
+            "reroll": {"diff_id": diff_id, "seed": seed, "replayed": len(replayed)},
+            "processing_times": {"reroll": round(time.time() - t0, 2)},
+        }
+        return GenerationResult(
+            original_image=image,
+            modified_image=modified,
+            differences=differences,
+            metadata=metadata,
+            edit_state=EditState(
+                difficulty=state.difficulty,
+                seed=state.seed,
+                scale=state.scale,
+                proxy_shape=state.proxy_shape,
+                segments=state.segments,
+                quality=state.quality,
+                proxy_patches=proxy_patches,
+                patches=patches,
+            ),
+        )
+
+    def _reroll_candidates(
+        self,
+        state: EditState,
+        used: set[int],
+        occupied: list[list[int]],
+        rng: random.Random,
+    ) -> list[Segment]:
+        """Unused segments clear of every other edit, best first.
+
+        Same preference order as _stage_select: quality and saliency
+        filtered, then quality only, then anything.
+        """
+        max_saliency = self._difficulty_config[state.difficulty]["max_saliency"]
+        h, w = state.proxy_shape
+        free = [
+            seg for seg in state.segments
+            if seg.id not in used
+            and not _intersects_any([_pad_bbox(seg.bbox, _MAX_ROI_PADDING, w, h)], occupied)
+        ]
+        # Selection stops early, so some segments may not have been checked yet
+        self._quality.evaluate_segments(free, results=state.quality)
+
+        tiers: list[list[Segment]] = [[], [], []]
+        for seg in free:
+            is_acceptable = state.quality.get(seg.id, (False,))[0]
+            if is_acceptable and seg.saliency_score <= max_saliency:
+                tiers[0].append(seg)
+            elif is_acceptable:
+                tiers[1].append(seg)
+            else:
+                tiers[2].append(seg)
+
+        ordered = []
+        for tier in tiers:
+            rng.shuffle(tier)
+            ordered.extend(tier)
+        return ordered[:_REROLL_CANDIDATES]
+
+    @staticmethod
+    def _passed(
+        segments: list[Segment], quality: dict[int, tuple[bool, float, str]]
+    ) -> list[Segment]:
+        """Segments that were evaluated and found acceptable, in order.
+
+        Their scores stay in quality, so the saliency stage's output stays as cached.
+        """
+        passed = []
+        for seg in segments:
+            if seg.id not in quality:
+                continue
+            is_acceptable, _, reason = quality[seg.id]
+            if is_acceptable:
+                passed.append(seg)
+            else:
+                logger.debug(f"Segment {seg.id} rejected: {reason}")
+        return passed
 
     def _apply_changes(
         self,
         image: np.ndarray,
         segments: list[Segment],
         progress: ProgressCallback,
-    ) -> tuple[np.ndarray, list[Difference]]:
-        """Apply a random change to each selected segment with quality checking."""
-        modified = image.copy()
+        settings: _EditSettings,
+        rng: random.Random,
+        deadline: Deadline,
+    ) -> tuple[EditLog, list[Difference]]:
+        """Apply a random change to each selected segment with quality checking.
+
+        Each attempt renders an ROI patch against the edit log; accepted patches
+        are committed, rejected ones are dropped. The caller builds the modified
+        image from the returned log, once.
+
+        Segments are grouped into waves whose padded ROIs are disjoint. A wave
+        is rendered and quality-checked concurrently, then committed in wave
+        order (selection order within a wave), which also numbers the
+        differences. A patch that read pixels written earlier in the same
+        wave (an addition landing on a neighbour) is re-rendered before commit,
+        so the result does not depend on the number of workers. Each segment
+        draws from its own RNG, seeded from rng in selection order, for the
+        same reason.
+
+        If the deadline passes between waves, the remaining waves use the
+        cheap settings. A cancelled job stops before its next attempt.
+        """
+        log = EditLog(image)
         differences: list[Difference] = []
+        h, w = image.shape[:2]
 
         total = len(segments)
-        successful_changes = 0
-        max_retries = 2
-
-        for i, seg in enumerate(segments):
-            pct = 55 + int((i / max(total, 1)) * 35)
-            change_type = self._decide_change_type(seg)
-
-            _notify(progress, pct, f"変更を適用中 ({i + 1}/{total}): {change_type}")
-
-            # Try to apply change with quality check
-            for attempt in range(max_retries):
-                temp_modified = modified.copy()
-                x1, y1, x2, y2 = seg.bbox
-                original_region = image[y1:y2, x1:x2].copy()
-                new_bbox_result = None
-
-                # Apply the change
-                if change_type == "deletion":
-                    temp_modified = self._inp.inpaint(temp_modified, seg.mask)
-                elif change_type == "color_change":
-                    temp_modified, _ = self._col.change_hue(temp_modified, seg.mask)
-                elif change_type == "addition":
-                    temp_modified, new_bbox_result = self._dup.duplicate(temp_modified, seg)
-                    if new_bbox_result is None:
-                        logger.debug(f"Addition failed for segment {seg.id}, trying different type")
-                        change_type = random.choice(["deletion", "color_change"])
-                        continue
-
-                # Check quality of the modification
-                modified_region = temp_modified[y1:y2, x1:x2]
-                local_mask = seg.mask[y1:y2, x1:x2]
-
-                is_acceptable, quality_score, reason = self._quality.evaluate_modification_quality(
-                    original_region,
-                    modified_region,
-                    local_mask,
-                    change_type,
-                )
+        plans = [
+            (seg, self._decide_change_type(seg, rng), rng.getrandbits(64)) for seg in segments
+        ]
+        done = 0
 
-                if is_acceptable or attempt == max_retries - 1:
-                    # Accept this modification
-                    modified = temp_modified
-                    diff = self._apply_single_change(modified, seg, change_type, successful_changes + 1)
-
-                    if diff is not None:
-                        if change_type == "addition" and new_bbox_result is not None:
-                            diff.bbox = new_bbox_result
-                        differences.append(diff)
-                        successful_changes += 1
-
-                    if not is_acceptable:
-                        logger.warning(f"Accepting lower quality change ({reason}) after {max_retries} attempts")
-                    else:
-                        logger.debug(f"Change accepted with quality score: {quality_score:.2f}")
-                    break
+        def attempt(plan: tuple[Segment, str, int]) -> _ChangeOutcome | None:
+            deadline.check()
+            seg, change_type, seg_seed = plan
+            return self._attempt_change(
+                log, seg, change_type, settings, random.Random(seg_seed)
+            )
+
+        rois = [[_pad_bbox(seg.bbox, _MAX_ROI_PADDING, w, h)] for seg, _, _ in plans]
+        for wave in ([plans[i] for i in group] for group in _conflict_free_waves(rois)):
+            if deadline.expired:
+                settings = self._cheap_settings(settings, deadline)
+            if self._edit_pool is not None and len(wave) > 1:
+                outcomes = list(self._edit_pool.map(attempt, wave))
+            else:
+                outcomes = [attempt(plan) for plan in wave]
+
+            written: list[list[int]] = []
+            for plan, outcome in zip(wave, outcomes):
+                seg = plan[0]
+                done += 1
+                if outcome is not None and _intersects_any(_patch_reads(outcome.patch), written):
+                    logger.debug(f"Segment {seg.id} read a region changed in this wave, re-rendering")
+                    outcome = attempt(plan)
+                if outcome is None:
+                    continue
+
+                patch = replace(outcome.patch, diff_id=len(differences) + 1)
+                if progress is not None:
+                    progress(ProgressEvent(
+                        PROGRESS, "edit", done=done, total=total,
+                        message=f"変更を適用中 ({done}/{total}): {patch.change_type}",
+                    ))
+                log.commit(patch)
+                written.append(patch.bbox)
+
+                diff = self._apply_single_change(image, seg, patch.change_type, patch.diff_id)
+                diff.bbox = patch.target_bbox
+                differences.append(diff)
+
+                if not outcome.is_acceptable:
+                    logger.warning(f"Accepting lower quality change ({outcome.reason}) after retries")
                 else:
-                    logger.debug(f"Modification rejected ({reason}), retrying with different parameters...")
-                    # Try a different change type on retry
-                    if change_type == "color_change":
-                        change_type = random.choice(["deletion", "addition"])
-                    elif change_type == "addition":
-                        change_type = "color_change"
+                    logger.debug(f"Change accepted with quality score: {outcome.quality_score:.2f}")
+
+        logger.info(f"Successfully applied {len(differences)} / {total} changes")
+        return log, differences
+
+    def _render_full_resolution(
+        self,
+        image: np.ndarray,
+        proxy_log: EditLog,
+        segments: list[Segment],
+        differences: list[Difference],
+        scale: float,
+        settings: _EditSettings,
+    ) -> tuple[np.ndarray, list[EditPatch]]:
+        """Replay the accepted proxy edits on the full-resolution image.
+
+        Masks are upscaled only inside each edit's ROI and the edits reuse the
+        parameters drawn on the proxy. The bbox of each patch's difference
+        (by diff_id) is updated in place.
+
+        Returns:
+            The modified image and the full-resolution patches, in the order
+            of the proxy patches.
+        """
+        h, w = image.shape[:2]
+        log = EditLog(image)
+        by_id = {seg.id: seg for seg in segments}
+        by_diff_id = {diff.id: diff for diff in differences}
+        specs = [
+            self._full_resolution_spec(by_id[patch.segment_id], patch, scale, w, h)
+            for patch in proxy_log.patches
+        ]
+        rendered: list[EditPatch] = [None] * len(specs)
+
+        for group in _conflict_free_waves([spec["rois"] for spec in specs]):
+            if self._edit_pool is not None and len(group) > 1:
+                patches = list(self._edit_pool.map(
+                    lambda i: self._render_spec(log, specs[i], scale, settings), group
+                ))
+            else:
+                patches = [self._render_spec(log, specs[i], scale, settings) for i in group]
+            for i, patch in zip(group, patches):
+                log.commit(patch)
+                by_diff_id[patch.diff_id].bbox = patch.target_bbox
+                rendered[i] = patch
+
+        return log.materialize(), rendered
+
+    def _full_resolution_spec(
+        self,
+        seg: Segment,
+        proxy_patch: EditPatch,
+        scale: float,
+        width: int,
+        height: int,
+    ) -> dict:
+        """Work out the full-resolution ROIs for replaying one proxy edit."""
+        target = scale_bbox(seg.bbox, scale, width, height)
+        spec = {"seg": seg, "patch": proxy_patch, "target": target}
+
+        if proxy_patch.change_type != "addition":
+            roi = _pad_bbox(target, _ROI_PADDING[proxy_patch.change_type], width, height)
+            spec["rois"] = [roi]
+            return spec
+
+        # Tight full-resolution bbox of the object, then the same offset as on the proxy
+        search = _pad_bbox(target, 2, width, height)
+        ys, xs = np.nonzero(upscale_mask(seg.mask, scale, search))
+        if len(xs):
+            src_bbox = [
+                search[0] + int(xs.min()), search[1] + int(ys.min()),
+                search[0] + int(xs.max()) + 1, search[1] + int(ys.max()) + 1,
+            ]
+        else:
+            src_bbox = target
+        dx, dy = proxy_patch.params["offset"]
+        dx = int(np.clip(round(dx / scale), -src_bbox[0], width - src_bbox[2]))
+        dy = int(np.clip(round(dy / scale), -src_bbox[1], height - src_bbox[3]))
+        dst_bbox = [src_bbox[0] + dx, src_bbox[1] + dy, src_bbox[2] + dx, src_bbox[3] + dy]
+
+        src_roi, dst_roi = self._dup.patch_rois((height, width), src_bbox, dst_bbox)
+        spec.update(target=dst_bbox, src_roi=src_roi, rois=[dst_roi, src_roi])
+        return spec
+
+    def _render_spec(
+        self, log: EditLog, spec: dict, scale: float, settings: _EditSettings
+    ) -> EditPatch:
+        """Render one full-resolution edit described by _full_resolution_spec."""
+        seg: Segment = spec["seg"]
+        proxy_patch: EditPatch = spec["patch"]
+        change_type = proxy_patch.change_type
+        roi = spec["rois"][0]
+        h, w = log.base.shape[:2]
 
-        logger.info(f"Successfully applied {successful_changes} / {total} changes")
-        return modified, differences
+        before = log.read(roi)
+        if change_type == "addition":
+            src_roi = spec["src_roi"]
+            after = self._dup.render(
+                log.read(src_roi), before, upscale_mask(seg.mask, scale, src_roi),
+                settings.blend_mode, post_process=settings.post_filters,
+            )
+        elif change_type == "deletion":
+            after = self._inp.inpaint(
+                before, upscale_mask(seg.mask, scale, roi), reference_area=h * w,
+                method=settings.inpaint_method, post_process=settings.post_filters,
+            )
+        else:
+            after, _ = self._col.change_hue(
+                before, upscale_mask(seg.mask, scale, roi), **proxy_patch.params
+            )
+
+        return log.make_patch(
+            roi, before, after, change_type, seg.id, spec["target"],
+            params=proxy_patch.params, diff_id=proxy_patch.diff_id,
+        )
+
+    def _attempt_change(
+        self,
+        log: EditLog,
+        seg: Segment,
+        change_type: str,
+        settings: _EditSettings,
+        rng: random.Random,
+    ) -> _ChangeOutcome | None:
+        """Render and quality-check a change for one segment, with retries.
+
+        Only reads from the log; committing is left to the caller.
+        Returns None if no change could be rendered.
+        """
+        image = log.base
+        x1, y1, x2, y2 = seg.bbox
+        local_mask = seg.mask[y1:y2, x1:x2]
+        max_retries = settings.max_retries
+
+        for attempt in range(max_retries):
+            patch = self._make_patch(log, seg, change_type, settings, rng)
+            if patch is None:
+                logger.debug(f"Addition failed for segment {seg.id}, trying different type")
+                change_type = rng.choice(["deletion", "color_change"])
+                continue
+
+            # Check quality of the modification where the difference is visible:
+            # for an addition that is where the copy lands, not its source
+            tx1, ty1, tx2, ty2 = patch.target_bbox
+            is_acceptable, quality_score, reason = self._quality.evaluate_modification_quality(
+                image[ty1:ty2, tx1:tx2],
+                patch.crop(patch.target_bbox),
+                local_mask,
+                change_type,
+            )
+
+            if is_acceptable or attempt == max_retries - 1:
+                return _ChangeOutcome(patch, is_acceptable, quality_score, reason)
+
+            logger.debug(f"Modification rejected ({reason}), retrying with different parameters...")
+            # Try a different change type on retry
+            if change_type == "color_change":
+                change_type = rng.choice(["deletion", "addition"])
+            elif change_type == "addition":
+                change_type = "color_change"
+
+        return None
+
+    def _make_patch(
+        self,
+        log: EditLog,
+        seg: Segment,
+        change_type: str,
+        settings: _EditSettings,
+        rng: random.Random,
+    ) -> EditPatch | None:
+        """Render one candidate change as an ROI patch.
+
+        Returns None when an addition finds no valid placement.
+        """
+        h, w = log.base.shape[:2]
+
+        if change_type == "addition":
+            new_bbox = self._dup.find_placement(log.base, seg, rng)
+            if new_bbox is None:
+                return None
+            src_roi, dst_roi = self._dup.patch_rois(log.base.shape, seg.bbox, new_bbox)
+            sx1, sy1, sx2, sy2 = src_roi
+            before = log.read(dst_roi)
+            after = self._dup.render(
+                log.read(src_roi), before, seg.mask[sy1:sy2, sx1:sx2],
+                settings.blend_mode, post_process=settings.post_filters,
+            )
+            offset = (new_bbox[0] - seg.bbox[0], new_bbox[1] - seg.bbox[1])
+            return log.make_patch(
+                dst_roi, before, after, change_type, seg.id, new_bbox,
+                params={"src_roi": src_roi, "offset": offset},
+            )
+
+        roi = _pad_bbox(seg.bbox, _ROI_PADDING[change_type], w, h)
+        rx1, ry1, rx2, ry2 = roi
+        before = log.read(roi)
+        roi_mask = seg.mask[ry1:ry2, rx1:rx2]
+
+        params: dict = {}
+        if change_type == "deletion":
+            after = self._inp.inpaint(
+                before, roi_mask, reference_area=h * w,
+                method=settings.inpaint_method, post_process=settings.post_filters,
+            )
+        else:
+            params = self._col.sample_params(before, roi_mask, rng)
+            after, _ = self._col.change_hue(before, roi_mask, **params)
+
+        return log.make_patch(roi, before, after, change_type, seg.id, seg.bbox, params=params)
+
+    def _edit_settings(self, difficulty: str) -> _EditSettings:
+        return _EditSettings(
+            blend_mode=self._difficulty_config[difficulty].get("blend_mode", "alpha"),
+            # Explicit, so the stage cache keys reflect the configured method
+            inpaint_method=self._inp.method,
+        )
+
+    def _cheap_settings(self, settings: _EditSettings, deadline: Deadline) -> _EditSettings:
+        """Cheapest edit options, recording each one that changes something."""
+        if self._inp.method == "auto":
+            deadline.degrade("single_inpaint_method")
+        if settings.max_retries > 1:
+            deadline.degrade("fewer_retries")
+        if settings.post_filters:
+            deadline.degrade("skip_post_filters")
+        return _EditSettings(
+            blend_mode=settings.blend_mode,
+            max_retries=1,
+            inpaint_method="ns" if self._inp.method == "auto" else settings.inpaint_method,
+            post_filters=False,
+        )
 
     def _apply_single_change(
         self,
@@ -248,7 +985,7 @@ class DifferenceGenerator:
         seg: Segment,
         change_type: str,
         diff_id: int,
-    ) -> Difference | None:
+    ) -> Difference:
         """Create a Difference record. Actual mutation happens in _apply_changes."""
         descriptions = {
             "deletion": "オブジェクトを削除",
@@ -263,15 +1000,79 @@ class DifferenceGenerator:
             description=descriptions.get(change_type, ""),
         )
 
-    def _decide_change_type(self, seg: Segment) -> str:
+    def _decide_change_type(self, seg: Segment, rng: random.Random) -> str:
         """Choose change type, preferring colour/addition for large objects."""
         image_area_ratio = seg.area / max(seg.mask.size, 1)
         if image_area_ratio > 0.08:
             # Large object — inpainting quality degrades, avoid deletion
-            return random.choice(["color_change", "addition"])
-        return random.choice(["deletion", "color_change", "addition"])
+            return rng.choice(["color_change", "addition"])
+        return rng.choice(["deletion", "color_change", "addition"])
+
+    def fingerprint(self) -> str:
+        """Hash of the settings that affect output, for result cache keys."""
+        settings = {
+            "difficulty_config": self._difficulty_config,
+            "segment_area_ratio": [self._min_area_ratio, self._max_area_ratio],
+            "proxy_max_size": self._proxy_max_size,
+            "segmentation": type(self._seg).__name__,
+        }
+        payload = json.dumps(settings, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def new_seed() -> int:
+    """Draw a fresh 32-bit seed for a job that did not ask for one."""
+    return random.SystemRandom().randrange(2**32)
+
+
+def _for_variant(cb: ProgressCallback, index: int) -> ProgressCallback:
+    """Tag the events of one variant with its index."""
+    if cb is None:
+        return None
+    return lambda event: cb(replace(event, variant=index))
+
+
+def _pad_bbox(bbox: list[int], pad: int, width: int, height: int) -> list[int]:
+    """Grow bbox by pad pixels on each side, clipped to the image."""
+    x1, y1, x2, y2 = bbox
+    return [max(x1 - pad, 0), max(y1 - pad, 0), min(x2 + pad, width), min(y2 + pad, height)]
+
+
+def _intersects(a: list[int], b: list[int]) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _intersects_any(rois: list[list[int]], others: list[list[int]]) -> bool:
+    return any(_intersects(a, b) for a in rois for b in others)
+
+
+def _patch_reads(patch: EditPatch) -> list[list[int]]:
+    """ROIs a patch was rendered from."""
+    reads = [patch.bbox]
+    if "src_roi" in patch.params:
+        reads.append(patch.params["src_roi"])
+    return reads
+
+
+def _conflict_free_waves(rois: list[list[list[int]]]) -> list[list[int]]:
+    """Group items into waves whose ROIs are pairwise disjoint.
+
+    Args:
+        rois: For each item, the ROIs it reads or writes.
 
+    Returns:
+        Waves as lists of item indices. An item goes one wave after the latest
+        earlier item it overlaps, so overlapping items keep their order.
+    """
+    levels: list[int] = []
+    for i, item_rois in enumerate(rois):
+        level = 0
+        for j in range(i):
+            if _intersects_any(item_rois, rois[j]):
+                level = max(level, levels[j] + 1)
+        levels.append(level)
 
-def _notify(cb: ProgressCallback, percent: int, step: str) -> None:
-    if cb is not None:
-        cb(percent, step)
+    waves: list[list[int]] = [[] for _ in range(max(levels, default=-1) + 1)]
+    for i, level in enumerate(levels):
+        waves[level].append(i)
+    return waves
@@ -0,0 +1,72 @@
+"""Generation history written to SQLite by one background thread."""
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+
+from src import database
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    """Records finished jobs in generation_history without blocking them.
+
+    record() only queues the record; a writer thread saves whatever has
+    queued every flush_interval seconds, in one transaction. While
+    max_pending records wait (the database is locked for long), further
+    ones are dropped with a warning instead of blocking a job or growing
+    without bound: the history serves statistics, not correctness.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        expiry_hours: int = 24 * 30,
+        flush_interval: float = 1.0,
+        max_pending: int = 1000,
+    ) -> None:
+        self._database_path = database_path
+        self._expiry_hours = expiry_hours
+        self._flush_interval = flush_interval
+        self._pending: queue.Queue[dict] = queue.Queue(max_pending)
+        self._dropped = 0
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def record(self, record: dict) -> None:
+        """Queue a record with the fields of database.save_generations."""
+        try:
+            self._pending.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+            if self._dropped == 1 or self._dropped % 100 == 0:
+                logger.warning("History writer behind: %d records dropped", self._dropped)
+
+    def flush(self) -> None:
+        """Save every queued record now."""
+        records = []
+        while True:
+            try:
+                records.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        if not records:
+            return
+        try:
+            database.save_generations(self._database_path, records, self._expiry_hours)
+        except Exception:
+            logger.exception("Could not save %d generation records", len(records))
+
+    def close(self) -> None:
+        """Stop the writer thread after a last flush."""
+        self._stop.set()
+        self._writer.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._flush_interval):
+            self.flush()
@@ -19,20 +19,36 @@ class InpaintingService:
         self._base_radius = radius
         self._method = method
 
-    def inpaint(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    @property
+    def method(self) -> str:
+        return self._method
+
+    def inpaint(
+        self,
+        image: np.ndarray,
+        mask: np.ndarray,
+        reference_area: int | None = None,
+        method: str | None = None,
+        post_process: bool = True,
+    ) -> np.ndarray:
         """Inpaint the masked region of a BGR image.
 
         Args:
             image: BGR image (H, W, 3) uint8.
             mask: Binary mask (H, W). Non-zero pixels are inpainted.
+            reference_area: Pixel count of the full image when `image` is only
+                a crop of it; keeps the adaptive radius independent of the crop.
+            method: Overrides the configured method for this call.
+            post_process: Apply the smoothing filter to the inpainted region.
 
         Returns:
             Inpainted BGR image.
         """
         mask_u8 = self._prepare_mask(mask)
-        radius = self._adaptive_radius(mask_u8)
+        radius = self._adaptive_radius(mask_u8, reference_area)
+        method = method or self._method
 
-        if self._method == "auto":
+        if method == "auto":
             # Try both methods and pick the one with better quality
             result_ns = cv2.inpaint(image, mask_u8, radius, cv2.INPAINT_NS)
             result_telea = cv2.inpaint(image, mask_u8, radius, cv2.INPAINT_TELEA)
@@ -42,13 +58,14 @@ class InpaintingService:
             quality_telea = self._evaluate_quality(result_telea, mask_u8)
 
             result = result_ns if quality_ns > quality_telea else result_telea
-        elif self._method == "telea":
+        elif method == "telea":
             result = cv2.inpaint(image, mask_u8, radius, cv2.INPAINT_TELEA)
         else:
             result = cv2.inpaint(image, mask_u8, radius, cv2.INPAINT_NS)
 
         # Post-process to reduce artifacts
-        result = self._post_process(result, mask_u8)
+        if post_process:
+            result = self._post_process(result, mask_u8)
         return result
 
     def _prepare_mask(self, mask: np.ndarray) -> np.ndarray:
@@ -61,10 +78,10 @@ class InpaintingService:
         m = cv2.dilate(m, kernel, iterations=2)
         return m
 
-    def _adaptive_radius(self, mask_u8: np.ndarray) -> int:
+    def _adaptive_radius(self, mask_u8: np.ndarray, reference_area: int | None = None) -> int:
         """Choose inpaint radius based on mask size."""
         mask_pixels = np.count_nonzero(mask_u8)
-        total_pixels = mask_u8.shape[0] * mask_u8.shape[1]
+        total_pixels = reference_area or mask_u8.shape[0] * mask_u8.shape[1]
         ratio = mask_pixels / total_pixels
 
         if ratio < 0.01:
@@ -0,0 +1,214 @@
+"""Background deletion of expired outputs, uploads and database rows."""
+
+from __future__ import annotations
+
+import logging
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Callable
+
+from src.services.job_manager import CHECKPOINT_PREFIX
+from src.utils.file_manager import remove_path
+from src import database
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JanitorReport:
+    """What one cleanup cycle reclaimed."""
+
+    paths: int = 0
+    bytes: int = 0
+    # Of paths, removed for disk space before they expired
+    evicted: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+    # False when the time budget ended the cycle; the next one continues
+    complete: bool = True
+
+
+class Janitor:
+    """Deletes what was not used for retention_hours, a little at a time.
+
+    Every interval seconds a cycle removes job output directories and uploads
+    unused for retention_hours, checkpoint directories of batches no longer
+    queued or processing, and database rows of that age, oldest first.
+    Files of jobs still queued or processing are never removed. A cycle
+    stops after cycle_seconds and removes at most delete_rate paths per
+    second, so it never holds the disk or the database for long; what it
+    leaves is taken by the next cycle.
+
+    Above high_water of the output folder's disk used, the least recently
+    used outputs, uploads and stage cache entries go before they expire,
+    until usage is below low_water. Results are touched when served, so
+    their modification time is their last use.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        upload_folder: str,
+        output_folder: str,
+        retention_hours: float = 24,
+        interval: float = 300.0,
+        cycle_seconds: float = 5.0,
+        delete_rate: float = 50.0,
+        row_batch: int = 500,
+        high_water: float = 0.9,
+        low_water: float = 0.8,
+        cache_dir: str | None = None,
+        disk_usage: Callable[[str], tuple[int, int, int]] = shutil.disk_usage,
+    ) -> None:
+        self._database_path = database_path
+        self._upload_folder = Path(upload_folder)
+        self._output_folder = Path(output_folder)
+        self._cache_dir = Path(cache_dir) if cache_dir else None
+        self._retention_hours = retention_hours
+        self._interval = interval
+        self._cycle_seconds = cycle_seconds
+        self._delete_pause = 1.0 / delete_rate if delete_rate else 0.0
+        self._row_batch = row_batch
+        self._high_water = high_water
+        self._low_water = low_water
+        self._disk_usage = disk_usage
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.last_report: JanitorReport | None = None
+
+    def start(self) -> None:
+        """Run cycles on a daemon thread, the first one now."""
+        self._thread = threading.Thread(target=self._run, name="janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop after the current deletion."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run_once(self) -> JanitorReport:
+        """One bounded cleanup cycle."""
+        started = time.monotonic()
+        end = started + self._cycle_seconds
+        report = JanitorReport()
+
+        # Listed before the active jobs are read: a batch that starts in
+        # between creates its checkpoint after the listing, not in it
+        outputs = _entries(self._output_folder)
+        uploads = _entries(self._upload_folder)
+        active_jobs, active_batches, active_images = database.get_active_job_files(
+            self._database_path
+        )
+        active_uploads = {Path(image).name for image in active_images}
+
+        def in_use(path: Path) -> bool:
+            if path == self._cache_dir:
+                return True
+            if path.name.startswith(CHECKPOINT_PREFIX):
+                return path.name[len(CHECKPOINT_PREFIX):] in active_batches
+            return path.name in active_jobs
+
+        outputs = [(used, path) for used, path in outputs if not in_use(path)]
+        uploads = [(used, path) for used, path in uploads if path.name not in active_uploads]
+
+        excess = self._excess_bytes()
+        if excess > 0:
+            candidates = outputs + uploads
+            if self._cache_dir is not None:
+                candidates += [
+                    (used, path) for used, path in _entries(self._cache_dir)
+                    if path.suffix != ".tmp"
+                ]
+            for _, path in sorted(candidates):
+                if report.bytes >= excess or not self._remove(path, report, end):
+                    break
+                report.evicted += 1
+            logger.warning(
+                "Disk above %.0f%% full: evicted %d least recently used paths (%.1f MB)",
+                self._high_water * 100, report.evicted, report.bytes / 1e6,
+            )
+
+        hours = self._retention_hours
+        for cleanup in (
+            database.cleanup_expired,
+            partial(database.cleanup_old_job_status, hours=hours),
+            partial(database.cleanup_old_uploads, hours=hours),
+            partial(database.cleanup_old_cached_results, hours=hours),
+        ):
+            while report.complete:
+                deleted = cleanup(self._database_path, limit=self._row_batch)
+                report.rows += deleted
+                if deleted < self._row_batch:
+                    break
+                if time.monotonic() >= end:
+                    report.complete = False
+
+        cutoff = time.time() - hours * 3600
+        expired = sorted(
+            (used, path) for used, path in outputs + uploads
+            if used < cutoff or path.name.startswith(CHECKPOINT_PREFIX)
+        )
+        for _, path in expired:
+            if path.exists() and not self._remove(path, report, end):
+                break
+
+        report.seconds = time.monotonic() - started
+        return report
+
+    def _remove(self, path: Path, report: JanitorReport, end: float) -> bool:
+        """Remove path within the cycle's budget. Returns whether to go on."""
+        if time.monotonic() >= end or self._stop.is_set():
+            report.complete = False
+            return False
+        report.bytes += remove_path(path)
+        report.paths += 1
+        logger.debug("Removed %s", path)
+        if self._delete_pause:
+            self._stop.wait(self._delete_pause)
+        return True
+
+    def _excess_bytes(self) -> int:
+        """Bytes to free to get from above high_water down to low_water, else 0."""
+        try:
+            total, used, _ = self._disk_usage(str(self._output_folder))
+        except OSError:
+            return 0
+        if not total or used <= total * self._high_water:
+            return 0
+        return int(used - total * self._low_water)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                report = self.run_once()
+            except Exception:
+                logger.exception("Cleanup cycle failed")
+            else:
+                self.last_report = report
+                log = logger.info if report.paths or report.rows else logger.debug
+                log(
+                    "Cleanup reclaimed %.1f MB: %d paths (%d evicted for disk space), "
+                    "%d database rows in %.2fs%s",
+                    report.bytes / 1e6, report.paths, report.evicted, report.rows,
+                    report.seconds, "" if report.complete else " (continuing next cycle)",
+                )
+            self._stop.wait(self._interval)
+
+
+def _entries(folder: Path) -> list[tuple[float, Path]]:
+    """(modification time, path) of each entry directly in folder."""
+    entries = []
+    try:
+        for path in folder.iterdir():
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+    except OSError:
+        pass
+    return entries
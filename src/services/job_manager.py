@@ -1,25 +1,54 @@
-"""Asynchronous job management with ThreadPoolExecutor."""
+"""Asynchronous job management with worker threads consuming a durable queue."""
 
 from __future__ import annotations
 
 import gc
+import hashlib
 import json
 import logging
+import math
+import os
+import shutil
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import time
+from dataclasses import replace
 from pathlib import Path
 
+import cv2
 import numpy as np
 
+from src.exceptions import JobCancelledError, JobTimeoutError, ProcessingError, ValidationError
+from src.models.difference import GenerationResult
+from src.models.edit import EditState
 from src.models.job import JobStatus, JobState
-from src.services.difference_generator import DifferenceGenerator
+from src.models.progress import PREVIEW, PROGRESS, STAGE_END, STAGE_START, ProgressEvent
+from src.services.difference_generator import DifferenceGenerator, new_seed
 from src.services.answer_visualizer import AnswerVisualizer
 from src.services.a4_layout_composer import A4LayoutComposer
-from src.utils.image_io import load_image, save_image
+from src.services.history_writer import HistoryWriter
+from src.services.job_queue import BatchWatch, ClaimedBatch, JobQueue, new_worker_id
+from src.services.memory_budget import MemoryBudget
+from src.services.progress_tracker import (
+    SHARED_STAGES,
+    VARIANT_STAGES,
+    ProgressTracker,
+    StageDurations,
+)
+from src.services.status_store import TERMINAL_STATES, StatusStore
+from src.services.worker_pool import GenerationPool
+from src.utils.deadline import Deadline
+from src.utils.file_manager import file_sha256, touch
+from src.utils.image_io import get_image_dimensions, load_image, resize_for_processing, save_image
 from src import database
 
 logger = logging.getLogger(__name__)
 
+EDIT_STATE_FILE = "edit_state.npz"
+PREVIEW_FILE = "preview.jpg"
+PREVIEW_MAX_SIZE = 480
+# Directory under the output folder with a batch's stage checkpoints
+CHECKPOINT_PREFIX = "checkpoint_"
+
 
 class JobManager:
     """Manages background generation jobs."""
@@ -32,147 +61,536 @@ class JobManager:
         output_folder: str,
         database_path: str,
         max_workers: int = 2,
+        job_deadline: float | None = None,
+        stage_budgets: dict[str, float] | None = None,
+        stage_estimates: dict[str, float] | None = None,
+        status_flush_interval: float = 0.5,
+        generation_pool: GenerationPool | None = None,
+        max_queued: int = 8,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 3,
+        poll_interval: float = 1.0,
+        stale_seconds: float = 600.0,
+        time_limit: float | None = None,
+        abandon_seconds: float | None = None,
+        memory_budget: MemoryBudget | None = None,
+        history_retention_hours: int = 24 * 30,
     ) -> None:
+        """Initialize the manager and start max_workers queue consumers.
+
+        With max_workers=0 jobs are only queued, for other processes (e.g.
+        scripts/run_worker.py) to process. Otherwise jobs left processing by
+        dead workers, or without a status update for stale_seconds, are
+        queued again first; they resume from their last checkpointed stage.
+
+        A job running for time_limit seconds fails; one whose status nobody
+        has polled (see poll_status) for abandon_seconds is cancelled. None
+        disables either.
+
+        With memory_budget, a consumer only claims a batch whose estimated
+        peak memory fits next to the batches already running, so small
+        images run max_workers at a time and large ones alone.
+
+        Every processed job is recorded in generation_history (kept for
+        history_retention_hours) with its stage timings, input size and
+        outcome, off the job's thread.
+        """
         self._generator = generator
+        # Worker processes for generation; None generates on the job thread
+        self._generation_pool = generation_pool
         self._answer_visualizer = answer_visualizer
         self._a4_composer = a4_composer
         self._output_folder = output_folder
         self._database_path = database_path
-        self._executor = ThreadPoolExecutor(max_workers=max_workers)
-        self._jobs: dict[str, JobStatus] = {}  # Memory cache for performance
-        self._lock = threading.Lock()
-
-    def submit(self, job_id: str, image_path: str, difficulty: str) -> JobStatus:
+        # Batches wait in the database, where any worker can claim them
+        self._queue = JobQueue(
+            database_path, max(max_workers, 1), max_queued, lease_seconds, max_attempts
+        )
+        self._worker_id = new_worker_id()
+        self._lease_seconds = lease_seconds
+        # Seconds an idle consumer waits before looking for other workers' jobs
+        self._poll_interval = poll_interval
+        self._work_available = threading.Event()
+        self._stopping = threading.Event()
+        # Seconds from submission; queue wait counts against it
+        self._job_deadline = job_deadline
+        self._stage_budgets = stage_budgets or {}
+        # Seconds from claim after which a job fails, however far it got
+        self._time_limit = time_limit
+        self._abandon_seconds = abandon_seconds
+        # job_id -> monotonic time this process last recorded a poll of it
+        self._polls_recorded: dict[str, float] = {}
+        self._poll_lock = threading.Lock()
+        self._memory_budget = memory_budget
+        # Expected seconds per stage for progress and ETA, refined as jobs run
+        self._stage_durations = StageDurations(stage_estimates or {})
+        # Statuses live in memory and reach the database write-behind
+        self._statuses = StatusStore(database_path, status_flush_interval)
+        self._history = HistoryWriter(database_path, history_retention_hours)
+        self._reroll_lock = threading.Lock()
+
+        if max_workers > 0:
+            released = self._queue.reconcile(stale_seconds)
+            if released:
+                logger.warning("Queued %d interrupted jobs again.", released)
+
+        # Daemon threads: a job cut off at exit is queued again once its lease expires
+        self._consumers = [
+            threading.Thread(target=self._consume, name=f"job-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for consumer in self._consumers:
+            consumer.start()
+        if self._consumers:
+            threading.Thread(target=self._renew_leases, name="job-leases", daemon=True).start()
+
+    def submit(
+        self,
+        job_id: str,
+        image_path: str,
+        difficulty: str,
+        seed: int | None = None,
+        client: str = "",
+    ) -> JobStatus:
         """Submit a new generation job to the background pool."""
-        status = JobStatus(job_id=job_id, status=JobState.QUEUED, current_step="待機中")
-        with self._lock:
-            self._jobs[job_id] = status
+        seeds = None if seed is None else [seed]
+        return self.submit_many([job_id], image_path, [difficulty], seeds, client)[0]
 
-        # Persist to database for cross-worker visibility
-        database.save_job_status(
-            self._database_path,
-            job_id=job_id,
-            status=JobState.QUEUED.value,
-            progress=0,
-            current_step="待機中",
-        )
+    def submit_many(
+        self,
+        job_ids: list[str],
+        image_path: str,
+        difficulties: list[str],
+        seeds: list[int] | None = None,
+        client: str = "",
+        image_hash: str | None = None,
+        idempotency_key: str | None = None,
+    ) -> list[JobStatus]:
+        """Submit several puzzle variants of one image as a single background task.
+
+        Each variant gets its own job (and output directory), but segmentation
+        and saliency run only once for all of them.
+
+        Results are cached by (image hash, difficulty, seed, generator settings).
+        A variant that was generated before completes immediately and points at
+        the stored output directory.
+
+        Batches from one client (e.g. an IP address) queue behind each other,
+        not behind other clients' batches.
+
+        A request identical to a batch that is still queued or running (same
+        image content, difficulties and seeds, or no seeds for either) joins
+        it instead: its statuses are returned under that batch's job ids. A
+        client repeating a request with the same idempotency_key gets the
+        jobs of the first one, whatever became of them.
+
+        Args:
+            image_hash: SHA-256 of the image, if known (see register_upload).
+            idempotency_key: Client-chosen key of this request.
+
+        Raises:
+            ResourceExhaustedError: The queue is full; nothing was submitted.
+        """
+        if image_hash is None:
+            image_hash = file_sha256(image_path)
+        if idempotency_key is None:
+            return self._submit(job_ids, image_path, difficulties, seeds, client, image_hash)
+
+        # A different request under the same key is not a repeat
+        request_key = self._request_key(image_hash, difficulties, seeds)
+        key = hashlib.sha256(f"{client}:{idempotency_key}:{request_key}".encode("utf-8")).hexdigest()
+        bound = database.claim_idempotency_key(self._database_path, key, job_ids)
+        if bound != job_ids:
+            logger.info("Repeated request; returning jobs %s.", ", ".join(bound))
+            # The first request may still be storing them
+            return [self.get_status(job_id) or JobStatus(job_id=job_id) for job_id in bound]
+        try:
+            statuses = self._submit(job_ids, image_path, difficulties, seeds, client, image_hash)
+        except Exception:
+            # Nothing was submitted under the key; a retry may use it
+            database.delete_idempotency_key(self._database_path, key)
+            raise
+        submitted = [status.job_id for status in statuses]
+        if submitted != job_ids:
+            # Joined an identical batch: job_ids were never stored, its jobs were
+            database.rebind_idempotency_key(self._database_path, key, submitted)
+        return statuses
+
+    def register_upload(self, file_id: str, image_path: str) -> str:
+        """Hash an uploaded image once, for submit_many. Returns the hash."""
+        image_hash = file_sha256(image_path)
+        database.save_upload(self._database_path, file_id, image_hash)
+        return image_hash
+
+    def upload_hash(self, file_id: str) -> str | None:
+        """Hash recorded by register_upload, if any."""
+        return database.get_upload_hash(self._database_path, file_id)
+
+    def _submit(
+        self,
+        job_ids: list[str],
+        image_path: str,
+        difficulties: list[str],
+        seeds: list[int] | None,
+        client: str,
+        image_hash: str,
+    ) -> list[JobStatus]:
+        seeded = seeds is not None
+        if seeds is None:
+            seeds = [new_seed() for _ in job_ids]
+        cache_keys = [
+            self._cache_key(image_hash, difficulty, seed)
+            for difficulty, seed in zip(difficulties, seeds)
+        ]
+
+        statuses = []
+        pending: list[tuple[str, str, int, str]] = []
+        for job_id, difficulty, seed, cache_key in zip(job_ids, difficulties, seeds, cache_keys):
+            cached_path = self._lookup_cached_result(cache_key)
+            if cached_path is not None:
+                logger.info("Job %s served from result cache (%s).", job_id, cached_path)
+                status = JobStatus(
+                    job_id=job_id,
+                    status=JobState.COMPLETED,
+                    progress=100,
+                    current_step="完了",
+                    result_path=cached_path,
+                )
+            else:
+                status = JobStatus(job_id=job_id, status=JobState.QUEUED, current_step="待機中")
+                pending.append((job_id, difficulty, seed, cache_key))
+            statuses.append(status)
+
+        if pending:
+            width, height = get_image_dimensions(image_path)
+            # Rejects before any status is stored when the queue is full
+            batch_id = self._queue.push(
+                pending,
+                image_path,
+                client,
+                self._expected_seconds(len(pending)),
+                megapixels=width * height / 1e6,
+                dedupe_key=self._request_key(
+                    image_hash,
+                    [difficulty for _, difficulty, _, _ in pending],
+                    [seed for _, _, seed, _ in pending] if seeded else None,
+                ),
+            )
+            self._work_available.set()
+
+            holders = self._queue.job_ids(batch_id)
+            if holders != [job_id for job_id, _, _, _ in pending]:
+                logger.info("Duplicate request joined queued jobs %s.", ", ".join(holders))
+                attached = iter(holders)
+                statuses = [
+                    status if status.status == JobState.COMPLETED
+                    else self.get_status(next(attached)) or status
+                    for status in statuses
+                ]
 
-        self._executor.submit(self._process, job_id, image_path, difficulty)
-        return status
+        # Persist to database for cross-worker visibility
+        self._statuses.add([status for status in statuses if status.status == JobState.COMPLETED])
+        return statuses
 
     def get_status(self, job_id: str) -> JobStatus | None:
         """Get current status of a job (thread-safe).
 
         First checks memory cache, then falls back to database.
         This ensures status survives worker restarts.
-        """
-        # Try memory cache first (fast path)
-        with self._lock:
-            if job_id in self._jobs:
-                return self._jobs[job_id]
-
-        # Fall back to database (survives worker restarts)
-        db_status = database.get_job_status(self._database_path, job_id)
-        if db_status is None:
-            return None
 
-        # Reconstruct JobStatus from database record
-        status = JobStatus(
-            job_id=db_status["job_id"],
-            status=JobState(db_status["status"]),
-            progress=db_status["progress"],
-            current_step=db_status["current_step"],
-            error=db_status["error"],
-            result_path=db_status["result_path"],
-        )
+        Queued jobs get their queue position and the seconds until they are
+        expected to be done.
+        """
+        status = self._statuses.get(job_id)
+        if status is not None and status.status == JobState.QUEUED:
+            return self._with_queue_position(status)
+        return status
 
-        # Cache it for future lookups
-        with self._lock:
-            self._jobs[job_id] = status
+    def poll_status(self, job_id: str) -> JobStatus | None:
+        """get_status() for a client following the job.
 
+        Polls keep an unfinished job from being cancelled as abandoned.
+        """
+        status = self.get_status(job_id)
+        if status is not None and status.status not in TERMINAL_STATES and self._abandon_seconds:
+            self._record_poll(job_id)
         return status
 
-    def _process(self, job_id: str, image_path: str, difficulty: str) -> None:
-        """Background processing function."""
-        try:
-            self._update(job_id, status=JobState.PROCESSING, progress=5, current_step="画像を読み込み中...")
+    def wait_for_update(self, version: int, timeout: float) -> int:
+        """Block until a job status this process holds changes, or timeout.
 
-            image = load_image(image_path)
+        version is the value last returned (0 at first); the current one is
+        returned. Jobs processed by other processes only change in the
+        database, so followers re-read after the timeout either way.
+        """
+        return self._statuses.wait(version, timeout)
 
-            def on_progress(percent: int, step: str) -> None:
-                self._update(job_id, progress=percent, current_step=step)
+    def cancel(self, job_id: str, client: str | None = None) -> JobStatus | None:
+        """Cancel a job and the other variants submitted with it.
 
-            result = self._generator.generate(image, difficulty, progress=on_progress)
+        Queued jobs are cancelled at once. A job being processed, here or by
+        another process, stops at its worker's next check between stages or
+        edits; its status stays processing until then. Returns None for an
+        unknown job.
 
-            # Save outputs
-            out_dir = Path(self._output_folder) / job_id
-            out_dir.mkdir(parents=True, exist_ok=True)
+        When identical requests of other clients joined the batch (see
+        submit_many), client only leaves it and the jobs go on for them.
+        Without client the batch is cancelled for everyone.
 
-            save_image(result.original_image, out_dir / "original.png")
-            save_image(result.modified_image, out_dir / "modified.png")
-
-            # Generate and save answer images
-            self._update(job_id, progress=92, current_step="答え画像を生成中...")
-            original_with_answers, modified_with_answers = self._answer_visualizer.create_answer_overlay(
-                result.original_image,
-                result.modified_image,
-                result.differences,
-            )
-            save_image(original_with_answers, out_dir / "original_with_answers.png")
-            save_image(modified_with_answers, out_dir / "modified_with_answers.png")
-
-            # Generate and save A4 layout
-            self._update(job_id, progress=96, current_step="A4レイアウトを生成中...")
-            a4_layout = self._a4_composer.compose_side_by_side(
-                result.original_image,
-                result.modified_image,
-                left_title="元の画像",
-                right_title="間違い探し",
-                title="間違い探しパズル",
+        Raises:
+            ProcessingError: The job has already finished.
+        """
+        status = self._statuses.get(job_id)
+        if status is None:
+            return None
+        if status.status in TERMINAL_STATES:
+            raise ProcessingError("ジョブは既に終了しています")
+        if database.cancel_batch(
+            self._database_path, job_id, "キャンセルされました", client
+        ) is None:
+            return None
+        logger.info("Cancel of job %s requested.", job_id)
+        return self.get_status(job_id)
+
+    def shutdown(self) -> None:
+        """Finish running jobs, then write the statuses still in memory.
+
+        Queued jobs stay in the database for the next worker.
+        """
+        self._stopping.set()
+        self._work_available.set()
+        for consumer in self._consumers:
+            consumer.join()
+        self._generator.close()
+        self._statuses.close()
+        self._history.close()
+
+    def reroll(self, job_id: str, diff_id: int, seed: int | None = None) -> JobStatus:
+        """Replace one difference of a completed job, synchronously.
+
+        Only the edits are redone and the original image is not re-encoded.
+        Outputs go to a new revision directory, so results shared through the
+        result cache and images already in the browser stay untouched.
+        """
+        status = self.get_status(job_id)
+        if status is None or status.status != JobState.COMPLETED:
+            raise ValidationError("ジョブが完了していません")
+
+        with self._reroll_lock:
+            out_dir = Path(status.result_path)
+            state_path = out_dir / EDIT_STATE_FILE
+            if not state_path.exists():
+                raise ValidationError("この結果は差し替えに対応していません")
+
+            with open(out_dir / "metadata.json", encoding="utf-8") as f:
+                metadata = json.load(f)
+            image = load_image(out_dir / "original.png")
+            result = self._generator.reroll(image, EditState.load(state_path), diff_id, seed)
+
+            revision = metadata.get("revision", 0) + 1
+            for key in ("differences", "total_differences"):
+                metadata.pop(key, None)
+            metadata["revision"] = revision
+            metadata["rerolls"] = metadata.get("rerolls", []) + [result.metadata["reroll"]]
+            metadata.setdefault("processing_times", {})["reroll"] = (
+                result.metadata["processing_times"]["reroll"]
             )
-            save_image(a4_layout, out_dir / "a4_layout.png")
-
-            # Also create A4 layout with answers
-            a4_layout_with_answers = self._a4_composer.compose_side_by_side(
-                original_with_answers,
-                modified_with_answers,
-                left_title="元の画像（答え）",
-                right_title="間違い探し（答え）",
-                title="間違い探しパズル - 答え",
+            result.metadata = metadata
+
+            new_dir = Path(self._output_folder) / f"{job_id}-r{revision}"
+            new_dir.mkdir(parents=True, exist_ok=True)
+            _link_or_copy(out_dir / "original.png", new_dir / "original.png")
+            self._write_outputs(new_dir, result, write_original=False)
+            self._update(job_id, result_path=str(new_dir))
+
+            # Earlier revisions belong to this job alone; the first output may be shared
+            if out_dir.name.startswith(f"{job_id}-r"):
+                shutil.rmtree(out_dir, ignore_errors=True)
+
+        logger.info("Job %s rerolled difference %d (revision %d).", job_id, diff_id, revision)
+        return self.get_status(job_id)
+
+    def _consume(self) -> None:
+        """Claim and process queued batches until shutdown."""
+        while not self._stopping.is_set():
+            self._work_available.clear()
+            try:
+                batch = self._claim()
+            except Exception:
+                logger.exception("Could not claim a queued job")
+                batch = None
+            if batch is None:
+                self._work_available.wait(self._poll_interval)
+                continue
+            try:
+                self._process_claimed(batch)
+            finally:
+                if self._memory_budget is not None:
+                    self._memory_budget.release(batch.batch_id)
+                    # Freed memory may admit a batch another consumer passed over
+                    self._work_available.set()
+
+    def _claim(self) -> ClaimedBatch | None:
+        """Claim the next batch, if the memory budget admits it."""
+        budget = self._memory_budget
+        if budget is None:
+            return self._queue.claim(self._worker_id)
+
+        with budget.admission:
+            batch = self._queue.claim(
+                self._worker_id,
+                fits=lambda queued: budget.fits(
+                    budget.estimate(queued.megapixels, len(queued.job_ids))
+                ),
             )
-            save_image(a4_layout_with_answers, out_dir / "a4_layout_with_answers.png")
-
-            metadata = result.get_metadata_with_differences()
-            with open(out_dir / "metadata.json", "w", encoding="utf-8") as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=2)
-
-            self._update(
-                job_id,
-                status=JobState.COMPLETED,
-                progress=100,
-                current_step="完了",
-                result_path=str(out_dir),
+            if batch is not None:
+                budget.acquire(
+                    batch.batch_id, budget.estimate(batch.megapixels, len(batch.variants))
+                )
+        return batch
+
+    def _process_claimed(self, batch: ClaimedBatch) -> None:
+        logger.info(
+            "Worker %s claimed jobs %s.",
+            self._worker_id, ", ".join(job_id for job_id, _, _, _ in batch.variants),
+        )
+        deadline_seconds = self._job_deadline
+        if deadline_seconds is not None:
+            # The deadline counts from submission, possibly on another worker
+            deadline_seconds -= time.time() - batch.submitted_at
+        # Per batch, as the checkpointed stages are shared by its variants
+        checkpoint_dir = Path(self._output_folder) / f"{CHECKPOINT_PREFIX}{batch.batch_id}"
+        if checkpoint_dir.exists():
+            logger.info("Resuming batch %s from its checkpoints.", batch.batch_id)
+        deadline = Deadline(
+            deadline_seconds,
+            self._stage_budgets,
+            limit=self._time_limit,
+            cancelled=BatchWatch(self._database_path, batch.batch_id, self._abandon_seconds),
+        )
+        self._process(batch.image_path, batch.variants, deadline, checkpoint_dir, batch.batch_id)
+
+    def _renew_leases(self) -> None:
+        while not self._stopping.wait(self._lease_seconds / 3):
+            try:
+                self._queue.renew(self._worker_id)
+            except Exception:
+                logger.exception("Could not renew job leases")
+
+    def _process(
+        self,
+        image_path: str,
+        variants: list[tuple[str, str, int, str]],
+        deadline: Deadline | None = None,
+        checkpoint_dir: Path | None = None,
+        batch_id: str = "",
+    ) -> None:
+        """Background processing function.
+
+        Args:
+            image_path: Uploaded image.
+            variants: (job_id, difficulty, seed, cache_key) per puzzle variant.
+            deadline: Time budget counted from submission.
+            checkpoint_dir: Where stage outputs are saved so that a run after
+                a crash can resume; removed once the jobs finish or fail.
+            batch_id: The queued batch, recorded as the history's session.
+        """
+        job_ids = [job_id for job_id, _, _, _ in variants]
+        difficulties = [difficulty for _, difficulty, _, _ in variants]
+        seeds = [seed for _, _, seed, _ in variants]
+        tracker = ProgressTracker(self._stage_durations, len(job_ids))
+        running = list(job_ids)  # variants not yet completed
+        outputs: dict[str, tuple[Path, GenerationResult]] = {}
+        size = None
+
+        def on_event(event: ProgressEvent) -> None:
+            tracker.handle(event)
+            if event.kind == PREVIEW:
+                job_id = job_ids[event.variant or 0]
+                self._update(job_id, preview_path=str(self._save_preview(job_id, event.preview)))
+                return
+            for job_id in running:
+                self._update(job_id, **tracker.status())
+
+        try:
+            for job_id in job_ids:
+                self._update(job_id, status=JobState.PROCESSING)
+
+            on_event(ProgressEvent(STAGE_START, "decode"))
+            t0 = time.perf_counter()
+            image = load_image(image_path)
+            size = image.shape[:2]
+            decode_seconds = time.perf_counter() - t0
+            on_event(ProgressEvent(STAGE_END, "decode", seconds=decode_seconds))
+
+            runner = self._generation_pool or self._generator
+            results = runner.generate_many(
+                image, difficulties, progress=on_event, seeds=seeds, deadline=deadline,
+                checkpoint_dir=checkpoint_dir,
             )
-            logger.info("Job %s completed successfully.", job_id)
+
+            for i, ((job_id, _, _, cache_key), result) in enumerate(zip(variants, results)):
+                if deadline is not None:
+                    deadline.check()
+                result.metadata.setdefault("processing_times", {})["decode"] = round(decode_seconds, 2)
+                out_dir = self._save_outputs(job_id, result, on_event, variant=i)
+                outputs[job_id] = (out_dir, result)
+                # Degraded results are not what this seed normally produces
+                if not result.metadata.get("error") and not result.metadata.get("degradations"):
+                    database.save_cached_result(self._database_path, cache_key, str(out_dir))
+                self._update(
+                    job_id,
+                    status=JobState.COMPLETED,
+                    progress=100,
+                    current_step="完了",
+                    stage="",
+                    eta_seconds=0.0,
+                    result_path=str(out_dir),
+                )
+                running.remove(job_id)
+                logger.info("Job %s completed successfully.", job_id)
+
+        except JobCancelledError as e:
+            timed_out = isinstance(e, JobTimeoutError)
+            logger.warning("Jobs %s stopped: %s", ", ".join(running), e)
+            for job_id in running:
+                self._update(
+                    job_id,
+                    status=JobState.FAILED if timed_out else JobState.CANCELLED,
+                    error=str(e),
+                    current_step="エラー" if timed_out else "キャンセル",
+                    stage="",
+                    eta_seconds=None,
+                )
 
         except Exception as e:
-            logger.exception("Job %s failed: %s", job_id, e)
-            self._update(
-                job_id,
-                status=JobState.FAILED,
-                error=str(e),
-                current_step="エラー",
-            )
+            logger.exception("Jobs %s failed: %s", ", ".join(job_ids), e)
+            for job_id in job_ids:
+                status = self.get_status(job_id)
+                if status is not None and status.status == JobState.COMPLETED:
+                    continue
+                self._update(
+                    job_id,
+                    status=JobState.FAILED,
+                    error=str(e),
+                    current_step="エラー",
+                    eta_seconds=None,
+                )
         finally:
+            # Only a crash, which skips this, leaves checkpoints to resume from
+            if checkpoint_dir is not None:
+                shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+            try:
+                self._record_history(batch_id, image_path, variants, size, tracker, outputs)
+            except Exception:
+                logger.exception("Could not record the history of jobs %s", ", ".join(job_ids))
+
             # Aggressive memory cleanup for 4GB hosting environment
             # Explicitly delete local variables to free memory immediately
             try:
                 del image
-                del result
-                del original_with_answers
-                del modified_with_answers
-                del a4_layout
-                del a4_layout_with_answers
+                del results
             except (NameError, UnboundLocalError):
                 # Variables may not be defined if error occurred early
                 pass
@@ -184,41 +602,214 @@ class JobManager:
             if hasattr(np, 'clear_memo'):
                 np.clear_memo()  # Clear numpy memo cache if available
 
+    def _record_history(
+        self,
+        batch_id: str,
+        image_path: str,
+        variants: list[tuple[str, str, int, str]],
+        size: tuple[int, int] | None,
+        tracker: ProgressTracker,
+        outputs: dict[str, tuple[Path, GenerationResult]],
+    ) -> None:
+        """Queue a generation_history record for each finished variant of a batch.
+
+        Stage timings are the stages that computed (not cache hits); the
+        shared stages count towards every variant's processing_time but are
+        recorded as stage timings once, with the first variant.
+        """
+        height, width = size or (None, None)
+        shared = tracker.measured(None)
+        for i, (job_id, difficulty, seed, _) in enumerate(variants):
+            status = self.get_status(job_id)
+            if status is None or status.status not in TERMINAL_STATES:
+                continue
+            own = tracker.measured(i)
+            times = {**shared, **own}
+            out_dir, result = outputs.get(job_id, (None, None))
+            metadata = {"seed": seed, "variants": len(variants), "processing_times": times}
+            if result is not None:
+                metadata["cached_stages"] = result.metadata.get("cached_stages", [])
+                metadata["degradations"] = result.metadata.get("degradations", [])
+            self._history.record({
+                "job_id": job_id,
+                "session_id": batch_id,
+                "original_filename": Path(image_path).name,
+                "original_path": image_path,
+                "output_path": str(out_dir) if out_dir is not None else "",
+                "difficulty": difficulty,
+                "num_differences": len(result.differences) if result is not None else 0,
+                "processing_time": round(sum(times.values()), 2),
+                "metadata": metadata,
+                "status": status.status.value,
+                "error": status.error,
+                "width": width,
+                "height": height,
+                "stage_timings": times if i == 0 else own,
+            })
+
+    def _record_poll(self, job_id: str) -> None:
+        """Write the poll time, at most a few times per abandon_seconds."""
+        now = time.monotonic()
+        interval = self._abandon_seconds / 4
+        with self._poll_lock:
+            if now - self._polls_recorded.get(job_id, -math.inf) < interval:
+                return
+            self._polls_recorded = {
+                other: at for other, at in self._polls_recorded.items()
+                if now - at < self._abandon_seconds
+            }
+            self._polls_recorded[job_id] = now
+        database.record_poll(self._database_path, job_id, time.time())
+
+    def _with_queue_position(self, status: JobStatus) -> JobStatus:
+        position = self._queue.position(status.job_id)
+        if position is None:
+            return status
+        place, eta_seconds = position
+        return replace(status, queue_position=place, eta_seconds=round(eta_seconds, 1))
+
+    def _expected_seconds(self, variants: int) -> float:
+        """Measured seconds a batch of this many variants is expected to take."""
+        shared = sum(self._stage_durations.estimate(stage) for stage in SHARED_STAGES)
+        per_variant = sum(self._stage_durations.estimate(stage) for stage in VARIANT_STAGES)
+        return shared + variants * per_variant
+
+    def _request_key(
+        self, image_hash: str, difficulties: list[str], seeds: list[int] | None
+    ) -> str:
+        """Identifies what a request asks for; random seeds count as one value."""
+        raw = json.dumps([image_hash, difficulties, seeds, self._generator.fingerprint()])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _cache_key(self, image_hash: str, difficulty: str, seed: int) -> str:
+        raw = f"{image_hash}:{difficulty}:{seed}:{self._generator.fingerprint()}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup_cached_result(self, cache_key: str) -> str | None:
+        """Return a cached output directory if it still exists on disk."""
+        cached_path = database.get_cached_result(self._database_path, cache_key)
+        if cached_path is None:
+            return None
+        if not (Path(cached_path) / "metadata.json").exists():
+            # Output was cleaned up; drop the stale entry
+            database.delete_cached_result(self._database_path, cache_key)
+            return None
+        # A reused result is as recent as a new one for cleanup
+        touch(cached_path)
+        return cached_path
+
+    def _save_outputs(
+        self,
+        job_id: str,
+        result: GenerationResult,
+        on_event=None,
+        variant: int | None = None,
+    ) -> Path:
+        """Encode all output images and metadata for one job.
+
+        on_event, if given, receives the "encode" stage events of variant.
+        """
+        out_dir = Path(self._output_folder) / job_id
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        on_step = None
+        if on_event is not None:
+            on_event(ProgressEvent(STAGE_START, "encode", variant))
+
+            def on_step(done: int, total: int, step: str) -> None:
+                on_event(ProgressEvent(PROGRESS, "encode", variant, done=done, total=total, message=step))
+
+        seconds = self._write_outputs(out_dir, result, on_step=on_step)
+        if on_event is not None:
+            on_event(ProgressEvent(STAGE_END, "encode", variant, seconds=seconds))
+        return out_dir
+
+    def _save_preview(self, job_id: str, image: np.ndarray) -> Path:
+        """Write a small JPEG of an intermediate result into the job's directory."""
+        path = Path(self._output_folder) / job_id / PREVIEW_FILE
+        preview, _ = resize_for_processing(image, PREVIEW_MAX_SIZE)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(path), preview, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        return path
+
+    def _write_outputs(
+        self,
+        out_dir: Path,
+        result: GenerationResult,
+        on_step=None,
+        write_original: bool = True,
+    ) -> float:
+        """Encode output images, edit state and metadata into out_dir.
+
+        Args:
+            on_step: Optional callback(done, total, step_name).
+
+        Returns:
+            Seconds spent.
+        """
+        if on_step is None:
+            on_step = lambda done, total, step: None
+        t0 = time.perf_counter()
+
+        if write_original:
+            save_image(result.original_image, out_dir / "original.png")
+        save_image(result.modified_image, out_dir / "modified.png")
+
+        # Generate and save answer images
+        on_step(1, 3, "答え画像を生成中...")
+        original_with_answers, modified_with_answers = self._answer_visualizer.create_answer_overlay(
+            result.original_image,
+            result.modified_image,
+            result.differences,
+        )
+        save_image(original_with_answers, out_dir / "original_with_answers.png")
+        save_image(modified_with_answers, out_dir / "modified_with_answers.png")
+
+        # Generate and save A4 layout
+        on_step(2, 3, "A4レイアウトを生成中...")
+        a4_layout = self._a4_composer.compose_side_by_side(
+            result.original_image,
+            result.modified_image,
+            left_title="元の画像",
+            right_title="間違い探し",
+            title="間違い探しパズル",
+        )
+        save_image(a4_layout, out_dir / "a4_layout.png")
+
+        # Also create A4 layout with answers
+        a4_layout_with_answers = self._a4_composer.compose_side_by_side(
+            original_with_answers,
+            modified_with_answers,
+            left_title="元の画像（答え）",
+            right_title="間違い探し（答え）",
+            title="間違い探しパズル - 答え",
+        )
+        save_image(a4_layout_with_answers, out_dir / "a4_layout_with_answers.png")
+
+        if result.edit_state is not None:
+            result.edit_state.save(out_dir / EDIT_STATE_FILE)
+
+        seconds = time.perf_counter() - t0
+        times = result.metadata.get("processing_times")
+        if times is not None:
+            times["encode"] = round(seconds, 2)
+        metadata = result.get_metadata_with_differences()
+        with open(out_dir / "metadata.json", "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        return seconds
+
     def _update(self, job_id: str, **kwargs) -> None:
         """Thread-safe status update.
 
-        Updates both memory cache and database for persistence across worker restarts.
+        The database copy follows write-behind; completed and failed states
+        are written before this returns.
         """
-        with self._lock:
-            job = self._jobs.get(job_id)
-            if job is None:
-                # Might happen if worker restarted, try to load from DB
-                db_status = database.get_job_status(self._database_path, job_id)
-                if db_status:
-                    job = JobStatus(
-                        job_id=db_status["job_id"],
-                        status=JobState(db_status["status"]),
-                        progress=db_status["progress"],
-                        current_step=db_status["current_step"],
-                        error=db_status["error"],
-                        result_path=db_status["result_path"],
-                    )
-                    self._jobs[job_id] = job
-                else:
-                    # Job not in memory or database, nothing to update
-                    return
-
-            # Update job object
-            for key, value in kwargs.items():
-                setattr(job, key, value)
-
-        # Persist to database (outside lock to avoid holding it too long)
-        database.save_job_status(
-            self._database_path,
-            job_id=job_id,
-            status=job.status.value,
-            progress=job.progress,
-            current_step=job.current_step,
-            error=job.error,
-            result_path=job.result_path,
-        )
+        self._statuses.update(job_id, **kwargs)
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    """Hard-link an output that never changes, copying where links are unsupported."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
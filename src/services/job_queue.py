@@ -0,0 +1,320 @@
+"""Durable queue of generation batches shared by every worker through SQLite."""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import math
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+from src.exceptions import ResourceExhaustedError
+from src import database
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueuedBatch:
+    """One submitted batch of job variants waiting for, or holding, a worker."""
+
+    batch_id: str
+    job_ids: list[str]
+    client: str
+    cost: float  # expected seconds of processing
+    enqueued_at: float
+    started_at: float | None = None
+    megapixels: float | None = None  # input size; None if unknown
+
+
+@dataclass
+class ClaimedBatch:
+    """A batch a worker holds the lease of."""
+
+    batch_id: str
+    image_path: str
+    variants: list[tuple[str, str, int, str]]  # (job_id, difficulty, seed, cache_key)
+    submitted_at: float
+    megapixels: float | None = None
+
+
+class JobQueue:
+    """Pending batches in the job_status table, picked for fairness and short waits.
+
+    Any process with the database can push batches and claim them, so a
+    queued job survives the worker that accepted it and idle workers serve
+    each other's backlog. A claim is a lease: the claimer renews it while
+    processing, and a batch whose lease runs out (its worker died) goes back
+    to the queue. Delivery is therefore at least once.
+
+    The next batch is the one whose client has the fewest batches running or
+    queued ahead of it; among those, the one with the least expected seconds
+    left after subtracting the seconds it has already waited. Short batches
+    thus overtake long ones, but a long batch's turn comes once it has waited
+    as long as it will run.
+
+    The queue holds at most max_depth batches; push() rejects more with a
+    ResourceExhaustedError instead of letting waits grow without bound.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        workers: int,
+        max_depth: int,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 3,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """Initialize the queue.
+
+        Args:
+            database_path: SQLite database holding job_status.
+            workers: Batches processed in parallel, for wait estimates.
+            max_depth: Queued batches beyond which push() rejects.
+            lease_seconds: How long a claim lasts without renewal.
+            max_attempts: Claims of a batch before it fails instead of requeuing.
+            clock: Unix time, replaceable for tests.
+        """
+        self._database_path = database_path
+        self._workers = workers
+        self._max_depth = max_depth
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._clock = clock
+
+    def push(
+        self,
+        variants: list[tuple[str, str, int, str]],
+        image_path: str,
+        client: str,
+        cost: float,
+        current_step: str = "待機中",
+        megapixels: float | None = None,
+        dedupe_key: str | None = None,
+    ) -> str:
+        """Queue a batch of (job_id, difficulty, seed, cache_key). Returns its id.
+
+        While a batch pushed with the same dedupe_key is queued or running,
+        nothing is queued and that batch's id is returned instead.
+        """
+        batch_id = uuid.uuid4().hex
+        submitted_at = self._clock()
+        jobs = [
+            {
+                "job_id": job_id,
+                "current_step": current_step,
+                "batch_id": batch_id,
+                "client": client,
+                "image_path": image_path,
+                "difficulty": difficulty,
+                "seed": seed,
+                "cache_key": cache_key,
+                "cost": cost,
+                "megapixels": megapixels,
+                "dedupe_key": dedupe_key,
+                "submitted_at": submitted_at,
+            }
+            for job_id, difficulty, seed, cache_key in variants
+        ]
+        holder = database.enqueue_jobs(self._database_path, jobs, self._max_depth)
+        if holder is None:
+            _, running = self._snapshot()
+            raise ResourceExhaustedError(
+                "サーバーが混雑しています。しばらくしてから再度お試しください",
+                retry_after=_next_slot(self._worker_free_times(running)),
+            )
+        return holder
+
+    def job_ids(self, batch_id: str) -> list[str]:
+        """Jobs of a batch, in the order they were pushed."""
+        return database.get_batch_job_ids(self._database_path, batch_id)
+
+    def claim(
+        self, worker: str, fits: Callable[[QueuedBatch], bool] | None = None
+    ) -> ClaimedBatch | None:
+        """Take the highest-priority batch for worker, if any is queued.
+
+        With fits, the batch must also fit (e.g. in memory). Later batches do
+        not overtake one that does not, so it is not starved by smaller ones.
+        """
+        now = self._clock()
+        database.requeue_expired(
+            self._database_path, now, self._max_attempts, "処理が繰り返し中断されたため中止しました"
+        )
+        queued, running = self._snapshot()
+        for batch in self._ordered(queued, running):
+            if fits is not None and not fits(batch):
+                return None
+            rows = database.claim_batch(
+                self._database_path, batch.batch_id, worker, now, now + self._lease_seconds
+            )
+            if rows:
+                return ClaimedBatch(
+                    batch_id=batch.batch_id,
+                    image_path=rows[0]["image_path"],
+                    variants=[
+                        (row["job_id"], row["difficulty"], row["seed"], row["cache_key"])
+                        for row in rows
+                    ],
+                    submitted_at=rows[0]["submitted_at"],
+                    megapixels=rows[0]["megapixels"],
+                )
+            # Another worker claimed it first; try the next one
+        return None
+
+    def reconcile(self, stale_seconds: float) -> int:
+        """Release the jobs of workers that are gone, at startup.
+
+        Ends the leases of batches held by dead processes on this host and
+        of batches whose status has not changed for stale_seconds (a hung
+        worker may keep renewing), so the next claim queues them again
+        instead of waiting for the lease. Returns the number of jobs released.
+        """
+        dead = [
+            worker for worker in database.get_claiming_workers(self._database_path)
+            if not _worker_alive(worker)
+        ]
+        released = database.expire_leases(self._database_path, dead)
+        updated_before = datetime.fromtimestamp(
+            self._clock() - stale_seconds, timezone.utc
+        ).isoformat()
+        expired, _ = database.expire_stale_jobs(
+            self._database_path, updated_before, "サーバーの再起動により処理が中断されました"
+        )
+        return released + expired
+
+    def renew(self, worker: str) -> None:
+        """Extend the leases of every batch worker holds."""
+        database.renew_leases(self._database_path, worker, self._clock() + self._lease_seconds)
+
+    def position(self, job_id: str) -> tuple[int, float] | None:
+        """(1-based queue position, seconds until done) of a queued job, else None.
+
+        The estimate plays the current order out over the workers, using the
+        expected seconds left of the running batches.
+        """
+        queued, running = self._snapshot()
+        free = self._worker_free_times(running)
+        for position, batch in enumerate(self._ordered(queued, running), start=1):
+            start = heapq.heappop(free)
+            heapq.heappush(free, start + batch.cost)
+            if job_id in batch.job_ids:
+                return position, start + batch.cost
+        return None
+
+    def __len__(self) -> int:
+        return len(self._snapshot()[0])
+
+    def _snapshot(self) -> tuple[list[QueuedBatch], list[QueuedBatch]]:
+        """(queued, running) batches, each oldest first."""
+        batches: dict[str, QueuedBatch] = {}
+        for row in database.get_active_jobs(self._database_path):
+            batch = batches.get(row["batch_id"])
+            if batch is None:
+                batch = batches[row["batch_id"]] = QueuedBatch(
+                    batch_id=row["batch_id"],
+                    job_ids=[],
+                    client=row["client"],
+                    cost=row["cost"],
+                    enqueued_at=row["submitted_at"],
+                    started_at=row["started_at"] if row["status"] == "processing" else None,
+                    megapixels=row["megapixels"],
+                )
+            batch.job_ids.append(row["job_id"])
+        queued = [b for b in batches.values() if b.started_at is None]
+        running = [b for b in batches.values() if b.started_at is not None]
+        return queued, running
+
+    def _ordered(self, queued: list[QueuedBatch], running: list[QueuedBatch]) -> list[QueuedBatch]:
+        now = self._clock()
+        active: dict[str, int] = {}
+        for batch in running:
+            active[batch.client] = active.get(batch.client, 0) + 1
+
+        keys = {}
+        for index, batch in enumerate(queued):
+            ahead = active.get(batch.client, 0)
+            active[batch.client] = ahead + 1
+            keys[batch.batch_id] = (ahead, batch.cost - (now - batch.enqueued_at), index)
+        return sorted(queued, key=lambda b: keys[b.batch_id])
+
+    def _worker_free_times(self, running: list[QueuedBatch]) -> list[float]:
+        """Seconds until each worker is expected to be free, as a heap."""
+        now = self._clock()
+        free = [max(b.cost - (now - b.started_at), 0.0) for b in running]
+        free += [0.0] * max(self._workers - len(free), 0)
+        heapq.heapify(free)
+        return free
+
+
+class BatchWatch:
+    """Why a claimed batch should stop: cancelled, abandoned, or None.
+
+    Called between steps of the batch's generation, possibly in a worker
+    process (it pickles); reads the database at most every interval seconds.
+    A batch is abandoned when no client has polled any of its jobs for
+    abandon_seconds.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        batch_id: str,
+        abandon_seconds: float | None = None,
+        interval: float = 1.0,
+    ) -> None:
+        self._database_path = database_path
+        self._batch_id = batch_id
+        self._abandon_seconds = abandon_seconds
+        self._interval = interval
+        self._checked_at = -math.inf
+        self._reason: str | None = None
+
+    def __call__(self) -> str | None:
+        now = time.monotonic()
+        if self._reason is None and now - self._checked_at >= self._interval:
+            self._checked_at = now
+            cancelled, polled_at = database.get_batch_signals(self._database_path, self._batch_id)
+            if cancelled:
+                self._reason = "キャンセルされました"
+            elif (
+                self._abandon_seconds
+                and polled_at is not None
+                and time.time() - polled_at > self._abandon_seconds
+            ):
+                self._reason = "進捗の確認が途絶えたため中止しました"
+        return self._reason
+
+
+def new_worker_id() -> str:
+    """A claimer name unique to this queue consumer: host:pid:random."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _worker_alive(worker: str) -> bool:
+    """False only for a worker id of a process on this host that has exited."""
+    try:
+        host, pid, _ = worker.rsplit(":", 2)
+        pid = int(pid)
+    except ValueError:
+        return True
+    if host != socket.gethostname() or pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+
+def _next_slot(free: list[float]) -> float:
+    """Seconds until the queue is expected to have room again."""
+    return max(free[0] if free else 0.0, 1.0)
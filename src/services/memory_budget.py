@@ -0,0 +1,142 @@
+"""Admission of jobs by their estimated peak memory against a budget."""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Mapping
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1024 * 1024) if hasattr(os, "sysconf") else 0.0
+
+
+@dataclass(frozen=True)
+class MemoryModel:
+    """Peak memory of a batch above the idle process, linear in its pixels.
+
+    The first variant costs base_mb + mb_per_megapixel per megapixel; each
+    further variant adds mb_per_variant_megapixel per megapixel (segmentation
+    and saliency are shared, the edited images are not).
+    """
+
+    base_mb: float
+    mb_per_megapixel: float
+    mb_per_variant_megapixel: float = 0.0
+
+    @classmethod
+    def from_config(cls, settings: Mapping[str, float]) -> MemoryModel:
+        return cls(**settings)
+
+    def estimate(self, megapixels: float, variants: int = 1) -> float:
+        """Expected peak MB of a batch of variants of one image."""
+        return (
+            self.base_mb
+            + self.mb_per_megapixel * megapixels
+            + self.mb_per_variant_megapixel * megapixels * max(variants - 1, 0)
+        )
+
+    @classmethod
+    def fit(cls, runs: list[tuple[float, int, float]]) -> MemoryModel:
+        """Least-squares model of (megapixels, variants, measured peak MB) runs.
+
+        Runs with a single variant leave mb_per_variant_megapixel at 0.
+        Coefficients are clipped at 0, as memory never shrinks with size.
+        """
+        features = np.array(
+            [[1.0, mp, mp * max(variants - 1, 0)] for mp, variants, _ in runs]
+        )
+        peaks = np.array([peak for _, _, peak in runs])
+        if not features[:, 2].any():
+            features = features[:, :2]
+        coefficients, *_ = np.linalg.lstsq(features, peaks, rcond=None)
+        coefficients = [max(float(c), 0.0) for c in coefficients] + [0.0]
+        return cls(*coefficients[:3])
+
+
+def process_rss_mb() -> float | None:
+    """Resident memory of this process and its children (worker processes), in MB.
+
+    None where /proc is unavailable.
+    """
+    pids = [os.getpid()] + [child.pid for child in multiprocessing.active_children()]
+    total = 0.0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * _PAGE_MB
+        except (OSError, ValueError, IndexError):
+            if pid == os.getpid():
+                return None
+    return total
+
+
+class MemoryBudget:
+    """Decides whether one more job fits in memory_budget_mb.
+
+    The projected memory is the larger of the measured RSS and the idle
+    baseline plus the estimates of the admitted jobs (a running job may not
+    have reached its peak yet), plus the candidate's estimate. One job is
+    always admitted when none is running, however large, so a job that can
+    never fit runs alone instead of waiting forever.
+
+    Callers that check fits() and then acquire() hold admission, so two
+    threads cannot both take the same headroom.
+    """
+
+    def __init__(
+        self,
+        budget_mb: float,
+        model: MemoryModel,
+        rss: Callable[[], float | None] = process_rss_mb,
+    ) -> None:
+        self._budget_mb = budget_mb
+        self._model = model
+        self._rss = rss
+        self._reserved: dict[str, float] = {}
+        self._baseline_mb: float | None = None
+        self._lock = threading.Lock()
+        self.admission = threading.Lock()
+
+    def estimate(self, megapixels: float | None, variants: int = 1) -> float:
+        """Estimated peak MB of a batch; unknown sizes count as the whole budget."""
+        if megapixels is None:
+            return self._budget_mb
+        return self._model.estimate(megapixels, variants)
+
+    def fits(self, estimate_mb: float) -> bool:
+        """Whether a job of estimate_mb can start now."""
+        rss = self._rss()
+        with self._lock:
+            if not self._reserved:
+                # Idle: whatever is resident now is the process itself
+                if rss is not None:
+                    self._baseline_mb = rss
+                return True
+            planned = (self._baseline_mb or 0.0) + sum(self._reserved.values())
+        projected = max(rss or 0.0, planned) + estimate_mb
+        if projected > self._budget_mb:
+            logger.debug(
+                "Job of ~%.0f MB waits: %.0f MB projected, budget %.0f MB",
+                estimate_mb, projected, self._budget_mb,
+            )
+            return False
+        return True
+
+    def acquire(self, key: str, estimate_mb: float) -> None:
+        with self._lock:
+            self._reserved[key] = estimate_mb
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._reserved.pop(key, None)
+
+    @property
+    def reserved_mb(self) -> float:
+        with self._lock:
+            return sum(self._reserved.values())
@@ -9,6 +9,11 @@ import numpy as np
 
 from src.models.segment import Segment
 
+BLEND_MODES = ("alpha", "seamless")
+
+# Padding (px) around the object for the blend ROI
+_ROI_PAD = 4
+
 
 class ObjectDuplicator:
     """Copies a segmented object to another location with intelligent placement."""
@@ -17,35 +22,122 @@ class ObjectDuplicator:
         self,
         image: np.ndarray,
         segment: Segment,
+        blend_mode: str = "alpha",
+        rng: random.Random | None = None,
     ) -> tuple[np.ndarray, list[int] | None]:
         """Duplicate the segment's object to a new location.
 
         Args:
             image: BGR image (H, W, 3) uint8.
             segment: The Segment to duplicate.
+            blend_mode: "alpha" (feathered alpha + bilateral edge filter) or
+                "seamless" (Poisson blending via cv2.seamlessClone on a tight ROI).
+            rng: Random source for placement (module RNG if None).
 
         Returns:
             (modified_image, new_bbox) or (original_image, None) on failure.
         """
-        placement = self._find_placement(image, segment)
-        if placement is None:
+        if blend_mode not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode: {blend_mode}")
+
+        new_bbox = self.find_placement(image, segment, rng)
+        if new_bbox is None:
             return image, None
 
+        src_roi, dst_roi = self.patch_rois(image.shape, segment.bbox, new_bbox)
+        sx1, sy1, sx2, sy2 = src_roi
+        dx1, dy1, dx2, dy2 = dst_roi
+
+        result = image.copy()
+        result[dy1:dy2, dx1:dx2] = self.render(
+            image[sy1:sy2, sx1:sx2],
+            image[dy1:dy2, dx1:dx2],
+            segment.mask[sy1:sy2, sx1:sx2],
+            blend_mode,
+        )
+        return result, new_bbox
+
+    def find_placement(
+        self,
+        image: np.ndarray,
+        segment: Segment,
+        rng: random.Random | None = None,
+    ) -> list[int] | None:
+        """Pick a destination bbox for the copy, or None if nothing fits."""
+        placement = self._find_placement(image, segment, rng=rng)
+        if placement is None:
+            return None
         dx, dy = placement
         x1, y1, x2, y2 = segment.bbox
-        obj_h, obj_w = y2 - y1, x2 - x1
+        return [x1 + dx, y1 + dy, x2 + dx, y2 + dy]
+
+    @staticmethod
+    def patch_rois(
+        image_shape: tuple[int, ...],
+        src_bbox: list[int],
+        dst_bbox: list[int],
+        pad: int = _ROI_PAD,
+    ) -> tuple[list[int], list[int]]:
+        """Padded source and destination ROIs of identical size.
+
+        The padding is the same on each side for both ROIs, limited by
+        whichever box is closer to the image border.
+
+        Returns:
+            (src_roi, dst_roi) as [x1, y1, x2, y2].
+        """
+        h, w = image_shape[:2]
+        sx1, sy1, sx2, sy2 = src_bbox
+        dx1, dy1, dx2, dy2 = dst_bbox
+
+        pad_l = min(pad, sx1, dx1)
+        pad_t = min(pad, sy1, dy1)
+        pad_r = min(pad, w - sx2, w - dx2)
+        pad_b = min(pad, h - sy2, h - dy2)
+
+        src_roi = [sx1 - pad_l, sy1 - pad_t, sx2 + pad_r, sy2 + pad_b]
+        dst_roi = [dx1 - pad_l, dy1 - pad_t, dx2 + pad_r, dy2 + pad_b]
+        return src_roi, dst_roi
 
-        new_x1, new_y1 = x1 + dx, y1 + dy
-        new_x2, new_y2 = new_x1 + obj_w, new_y1 + obj_h
+    def render(
+        self,
+        src: np.ndarray,
+        dst: np.ndarray,
+        roi_mask: np.ndarray,
+        blend_mode: str = "alpha",
+        post_process: bool = True,
+    ) -> np.ndarray:
+        """Blend the object from the source ROI into the destination ROI.
+
+        Only the two ROI crops are touched, so the cost scales with the object.
+
+        Args:
+            src: Source ROI pixels (contains the object).
+            dst: Destination ROI pixels, same shape as src.
+            roi_mask: Object mask cropped to the source ROI.
+            blend_mode: "alpha" or "seamless".
+            post_process: Smooth the object edge after an alpha blend.
+
+        Returns:
+            New destination ROI pixels.
+        """
+        if blend_mode == "seamless":
+            return self._blend_seamless(src, dst, roi_mask.astype(bool))
+
+        ys, xs = np.nonzero(roi_mask)
+        if len(xs) == 0:
+            return dst.copy()
+        left, top = int(xs.min()), int(ys.min())
+        obj_w, obj_h = int(xs.max()) + 1 - left, int(ys.max()) + 1 - top
 
         # Extract object pixels and its local mask
-        local_mask = segment.mask[y1:y2, x1:x2].astype(bool)
-        obj_pixels = image[y1:y2, x1:x2].copy()
+        local_mask = roi_mask[top:top + obj_h, left:left + obj_w].astype(bool)
+        obj_pixels = src[top:top + obj_h, left:left + obj_w]
 
-        result = image.copy()
+        result = dst.copy()
 
         # Paste with advanced alpha blending
-        target_region = result[new_y1:new_y2, new_x1:new_x2].copy()
+        target_region = result[top:top + obj_h, left:left + obj_w].copy()
 
         # Create feathered mask with distance transform for better blending
         mask_u8 = local_mask.astype(np.uint8) * 255
@@ -64,24 +156,65 @@ class ObjectDuplicator:
         # Blend with alpha
         blended = (adapted_obj.astype(np.float32) * alpha +
                    target_region.astype(np.float32) * (1 - alpha))
-        result[new_y1:new_y2, new_x1:new_x2] = blended.astype(np.uint8)
+        result[top:top + obj_h, left:left + obj_w] = blended.astype(np.uint8)
+
+        if not post_process:
+            return result
 
         # Post-process to reduce artifacts
-        result = self._post_process_addition(result, new_x1, new_y1, new_x2, new_y2, local_mask)
+        return self._post_process_addition(
+            result, left, top, left + obj_w, top + obj_h, local_mask
+        )
 
-        new_bbox = [new_x1, new_y1, new_x2, new_y2]
-        return result, new_bbox
+    def _blend_seamless(
+        self,
+        src: np.ndarray,
+        dst: np.ndarray,
+        roi_mask: np.ndarray,
+    ) -> np.ndarray:
+        """Poisson-blend the masked object from src into dst.
+
+        Args:
+            src: Source ROI pixels.
+            dst: Destination ROI pixels, same shape as src.
+            roi_mask: Boolean object mask in ROI coordinates.
+
+        Returns:
+            Blended destination ROI pixels.
+        """
+        mask_u8 = roi_mask.astype(np.uint8) * 255
+        # The solver needs a zero boundary around the mask
+        mask_u8[0, :] = 0
+        mask_u8[-1, :] = 0
+        mask_u8[:, 0] = 0
+        mask_u8[:, -1] = 0
+
+        if np.count_nonzero(mask_u8) == 0:
+            return dst.copy()
+
+        # seamlessClone centres the mask's bounding rect on `center`
+        ys, xs = np.nonzero(mask_u8)
+        mx1, mx2 = int(xs.min()), int(xs.max()) + 1
+        my1, my2 = int(ys.min()), int(ys.max()) + 1
+        center = (mx1 + (mx2 - mx1) // 2, my1 + (my2 - my1) // 2)
+
+        return cv2.seamlessClone(
+            np.ascontiguousarray(src), np.ascontiguousarray(dst), mask_u8, center,
+            cv2.NORMAL_CLONE,
+        )
 
     def _find_placement(
         self,
         image: np.ndarray,
         segment: Segment,
         max_attempts: int = 30,
+        rng: random.Random | None = None,
     ) -> tuple[int, int] | None:
         """Find a non-overlapping placement with similar background.
 
         Returns None if no valid placement is found.
         """
+        rng = rng or random
         h, w = image.shape[:2]
         x1, y1, x2, y2 = segment.bbox
         obj_w, obj_h = x2 - x1, y2 - y1
@@ -96,8 +229,8 @@ class ObjectDuplicator:
 
         for _ in range(max_attempts):
             # Try random offset
-            dx = random.randint(-w // 2, w // 2)
-            dy = random.randint(-h // 2, h // 2)
+            dx = rng.randint(-w // 2, w // 2)
+            dy = rng.randint(-h // 2, h // 2)
 
             # Skip if too close to original
             if abs(dx) < obj_w + margin and abs(dy) < obj_h + margin:
@@ -0,0 +1,373 @@
+"""Stage graph for the generation pipeline, with content-keyed caching."""
+
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+
+from src.models.progress import STAGE_END, STAGE_START, ProgressCallback, ProgressEvent
+from src.utils.file_manager import touch
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the layout of cached values changes, so old disk entries are ignored
+_CACHE_FORMAT = 1
+
+
+@dataclass(frozen=True)
+class Stage:
+    """One named step of the pipeline.
+
+    fn is called with the values of inputs, in order, followed by the context
+    entries as keyword arguments. An input is either another stage's name or
+    a run parameter. Context entries (progress callbacks, deadlines) are
+    passed through without being part of the cache key.
+    """
+
+    name: str
+    fn: Callable[..., Any]
+    inputs: tuple[str, ...]
+    context: tuple[str, ...] = ()
+    version: int = 1  # bump when fn changes what it returns
+    count: Callable[[Any], int] | None = None  # item count reported when it ends
+    checkpoint: bool = False  # save the output to the run's checkpoint store
+
+
+class StageCache:
+    """Stage outputs by content key: an in-memory LRU, optionally backed by disk.
+
+    The memory tier is bounded by the approximate size of the cached arrays;
+    max_bytes=0 disables it. The disk tier, when a directory is given, keeps
+    every entry as a pickle and is not pruned here; reads touch the file, so
+    the janitor can evict the least recently used under disk pressure.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str | Path | None = None) -> None:
+        self._max_bytes = max_bytes
+        self._disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if self._disk_dir is not None:
+            self._disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        """Return (hit, value)."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True, self._entries[key][0]
+
+        path = self._disk_path(key)
+        if path is None or not path.exists():
+            return False, None
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except Exception as e:
+            logger.warning("Ignoring unreadable stage cache entry %s: %s", path.name, e)
+            return False, None
+        touch(path)
+        self._remember(key, value)
+        return True, value
+
+    def put(self, key: str, value: Any) -> None:
+        self._remember(key, value)
+
+        path = self._disk_path(key)
+        if path is None:
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self._disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning("Could not write stage cache entry %s: %s", path.name, e)
+
+    def clear(self) -> None:
+        """Drop the in-memory entries."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, key: str, value: Any) -> None:
+        size = _approx_nbytes(value)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def _disk_path(self, key: str) -> Path | None:
+        if self._disk_dir is None:
+            return None
+        return self._disk_dir / f"{key}.pkl"
+
+
+class Pipeline:
+    """A DAG of stages whose outputs are cached under content keys.
+
+    A stage's key hashes its name, version and the keys of its inputs; a
+    parameter's key hashes its value. Changing a parameter therefore changes
+    the keys of exactly the stages downstream of it, and only those are
+    recomputed.
+    """
+
+    def __init__(self, stages: list[Stage], cache: StageCache | None = None) -> None:
+        self._stages: dict[str, Stage] = {}
+        names = {stage.name for stage in stages}
+        for stage in stages:
+            if stage.name in self._stages:
+                raise ValueError(f"Duplicate stage: {stage.name}")
+            # Stages come after the stages they read, which also rules out cycles
+            late = [name for name in stage.inputs if name in names and name not in self._stages]
+            if late:
+                raise ValueError(f"Stage {stage.name} reads {', '.join(late)} before it is defined")
+            self._stages[stage.name] = stage
+        self._cache = cache
+
+    @property
+    def stages(self) -> list[str]:
+        return list(self._stages)
+
+    def run(
+        self,
+        params: dict[str, Any],
+        context: dict[str, Any] | None = None,
+        store: Callable[[], bool] | None = None,
+        listener: ProgressCallback = None,
+        checkpoint: StageCache | None = None,
+        check: Callable[[], None] | None = None,
+    ) -> PipelineRun:
+        """Start a run over the given parameters. Stages execute on demand.
+
+        Args:
+            params: Values for every input that is not a stage.
+            context: Values for the stages' context entries.
+            store: Called after a stage computes; its output is only cached
+                when this returns True (e.g. not once a deadline has passed).
+            listener: Receives STAGE_START and STAGE_END events.
+            checkpoint: Store for the outputs of checkpoint stages, read
+                like the cache. A run interrupted by a crash and started
+                again with the same store resumes after the stages it saved.
+            check: Called before each stage computes; raises to stop the run
+                (e.g. once the job was cancelled).
+        """
+        return PipelineRun(
+            self, params, context or {}, store, listener, memo={},
+            checkpoint=checkpoint, check=check,
+        )
+
+
+class PipelineRun:
+    """Values of one pipeline run, computed lazily.
+
+    Every stage that run.get() reaches is timed in timings: the seconds it
+    took to compute, or 0.0 when its output came from the cache (those
+    stages are listed in cached).
+    """
+
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        params: dict[str, Any],
+        context: dict[str, Any],
+        store: Callable[[], bool] | None,
+        listener: ProgressCallback,
+        memo: dict[str, tuple[Any, float, bool]],
+        param_keys: dict[str, str] | None = None,
+        checkpoint: StageCache | None = None,
+        check: Callable[[], None] | None = None,
+    ) -> None:
+        self._pipeline = pipeline
+        self._params = params
+        self._context = context
+        self._store = store
+        self._listener = listener
+        self._checkpoint = checkpoint
+        self._check = check
+        # content key -> (value, seconds, from_cache), shared with derived runs
+        self._memo = memo
+        self._keys: dict[str, str] = dict(param_keys or {})
+        self.timings: dict[str, float] = {}
+        self.cached: list[str] = []
+
+    def derive(
+        self,
+        params: dict[str, Any],
+        context: dict[str, Any] | None = None,
+        listener: ProgressCallback = None,
+    ) -> PipelineRun:
+        """A run with some parameters changed that reuses this run's outputs.
+
+        The listener, when given, replaces this run's for the derived run.
+        """
+        return PipelineRun(
+            self._pipeline,
+            {**self._params, **params},
+            {**self._context, **(context or {})},
+            self._store,
+            listener or self._listener,
+            self._memo,
+            # Unchanged parameters keep their keys; hashing an image is not free
+            {
+                name: key for name, key in self._keys.items()
+                if name not in params and name not in self._pipeline._stages
+            },
+            self._checkpoint,
+            self._check,
+        )
+
+    def key(self, name: str) -> str:
+        """Content key of a stage output or parameter."""
+        if name not in self._keys:
+            stage = self._pipeline._stages.get(name)
+            if stage is None:
+                if name not in self._params:
+                    raise KeyError(f"No stage or parameter named {name}")
+                self._keys[name] = content_key(self._params[name])
+            else:
+                self._keys[name] = content_key(
+                    (_CACHE_FORMAT, stage.name, stage.version, [self.key(i) for i in stage.inputs])
+                )
+        return self._keys[name]
+
+    def get(self, name: str) -> Any:
+        """Value of a stage output or parameter, computing upstream stages as needed."""
+        stage = self._pipeline._stages.get(name)
+        if stage is None:
+            return self._params[name]
+
+        key = self.key(name)
+        if key not in self._memo:
+            self._memo[key] = self._compute(stage, key)
+        value, seconds, from_cache = self._memo[key]
+        # Reused outputs still report the upstream stages they came from
+        for input_name in stage.inputs:
+            if (
+                input_name in self._pipeline._stages
+                and input_name not in self.timings
+                and self.key(input_name) in self._memo
+            ):
+                self.get(input_name)
+        if name not in self.timings:
+            self.timings[name] = seconds
+            if from_cache:
+                self.cached.append(name)
+        return value
+
+    def _compute(self, stage: Stage, key: str) -> tuple[Any, float, bool]:
+        tiers = [self._pipeline._cache]
+        if stage.checkpoint:
+            tiers.append(self._checkpoint)
+        tiers = [tier for tier in tiers if tier is not None]
+        for tier in tiers:
+            hit, value = tier.get(key)
+            if hit:
+                logger.debug(
+                    "Stage %s served from %s", stage.name,
+                    "cache" if tier is self._pipeline._cache else "checkpoint",
+                )
+                # A cached output must survive a crash too, and the reverse
+                for other in tiers:
+                    if other is not tier:
+                        other.put(key, value)
+                self._emit(STAGE_END, stage, value, 0.0, cached=True)
+                return value, 0.0, True
+
+        args = [self.get(name) for name in stage.inputs]
+        kwargs = {name: self._context.get(name) for name in stage.context}
+        if self._check is not None:
+            self._check()
+        self._emit(STAGE_START, stage)
+        t0 = time.perf_counter()
+        value = stage.fn(*args, **kwargs)
+        seconds = time.perf_counter() - t0
+        self._emit(STAGE_END, stage, value, seconds)
+
+        if tiers and (self._store is None or self._store()):
+            for tier in tiers:
+                tier.put(key, value)
+        return value, seconds, False
+
+    def _emit(
+        self,
+        kind: str,
+        stage: Stage,
+        value: Any = None,
+        seconds: float | None = None,
+        cached: bool = False,
+    ) -> None:
+        if self._listener is None:
+            return
+        total = stage.count(value) if kind == STAGE_END and stage.count else None
+        self._listener(ProgressEvent(
+            kind, stage.name, seconds=seconds, cached=cached, total=total
+        ))
+
+
+def content_key(value: Any) -> str:
+    """Stable hash of a value built from arrays, dataclasses and plain containers."""
+    h = hashlib.sha256()
+    _feed(h, value)
+    return h.hexdigest()
+
+
+def _feed(h, value: Any) -> None:
+    if isinstance(value, np.ndarray):
+        h.update(f"ndarray{value.dtype.str}{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).data)
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        h.update(type(value).__name__.encode())
+        for f in dataclasses.fields(value):
+            _feed(h, f.name)
+            _feed(h, getattr(value, f.name))
+    elif isinstance(value, dict):
+        h.update(b"{")
+        for k in sorted(value, key=repr):
+            _feed(h, k)
+            _feed(h, value[k])
+        h.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        h.update(b"[")
+        for item in value:
+            _feed(h, item)
+        h.update(b"]")
+    elif isinstance(value, (str, int, float, bool, type(None), np.generic)):
+        h.update(f"{type(value).__name__}:{value!r};".encode())
+    else:
+        raise TypeError(f"Cannot derive a content key from {type(value).__name__}")
+
+
+def _approx_nbytes(value: Any) -> int:
+    """Rough memory footprint, dominated by the numpy arrays it holds."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return 64 + sum(_approx_nbytes(k) + _approx_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(_approx_nbytes(item) for item in value)
+    if hasattr(value, "__dict__"):
+        return 64 + sum(_approx_nbytes(v) for v in vars(value).values())
+    return 64
@@ -0,0 +1,149 @@
+"""Progress percentage and ETA for a job from its stage events."""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable
+
+from src.models.progress import PROGRESS, STAGE_END, STAGE_START, ProgressEvent
+
+# Stages run once per uploaded image, then once per puzzle variant
+SHARED_STAGES = ("decode", "proxy", "segment", "saliency", "quality")
+VARIANT_STAGES = ("select", "edit", "render", "encode")
+
+STAGE_LABELS = {
+    "decode": "画像を読み込み中...",
+    "proxy": "画像を準備中...",
+    "segment": "セグメンテーション中...",
+    "saliency": "顕著性を解析中...",
+    "quality": "オブジェクトを評価中...",
+    "select": "変更するオブジェクトを選択中...",
+    "edit": "変更を適用中...",
+    "render": "高解像度で描画中...",
+    "encode": "画像を保存中...",
+}
+
+# Share of a stage assumed done while it runs without reporting counts
+_MAX_UNCOUNTED_FRACTION = 0.9
+
+
+class StageDurations:
+    """Expected seconds per stage, learned from the stages that finish.
+
+    Starts from configured estimates and moves each one towards measured
+    durations with an exponential moving average. Shared by every job of a
+    JobManager.
+    """
+
+    def __init__(self, initial: dict[str, float], smoothing: float = 0.3) -> None:
+        self._seconds = dict(initial)
+        self._smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def estimate(self, stage: str) -> float:
+        with self._lock:
+            return self._seconds.get(stage, 0.0)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            previous = self._seconds.get(stage)
+            if previous is None:
+                self._seconds[stage] = seconds
+            else:
+                self._seconds[stage] = previous + self._smoothing * (seconds - previous)
+
+
+class ProgressTracker:
+    """Turns the events of one batch of variants into status fields.
+
+    Progress and ETA are weighted by the expected duration of each stage,
+    so a long segmentation moves the bar as much as it takes time.
+    """
+
+    def __init__(
+        self,
+        durations: StageDurations,
+        variants: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._durations = durations
+        self._variants = variants
+        self._clock = clock
+        self._pending = [(stage, None) for stage in SHARED_STAGES] + [
+            (stage, i) for i in range(variants) for stage in VARIANT_STAGES
+        ]
+        self._done: set[tuple[str, int | None]] = set()
+        # (stage, variant) -> seconds, of stages computed rather than cached
+        self._measured: dict[tuple[str, int | None], float] = {}
+        # (stage, variant) -> (started_at, fraction reported by counts)
+        self._running: dict[tuple[str, int | None], tuple[float, float | None]] = {}
+        self._stage = ""
+        self._step = ""
+        self._step_variant: int | None = None
+        self._percent = 0
+
+    def handle(self, event: ProgressEvent) -> None:
+        key = (event.stage, event.variant)
+        if key in self._pending:
+            # Earlier stages that never reported were reused from a previous run
+            for earlier in self._pending[:self._pending.index(key)]:
+                if earlier[1] in (None, event.variant) and earlier not in self._running:
+                    self._done.add(earlier)
+
+        if event.kind == STAGE_START:
+            self._running[key] = (self._clock(), None)
+            self._stage = event.stage
+            self._step = event.message or STAGE_LABELS.get(event.stage, event.stage)
+            self._step_variant = event.variant
+        elif event.kind == PROGRESS:
+            started, _ = self._running.get(key, (self._clock(), None))
+            fraction = event.done / event.total if event.total else None
+            self._running[key] = (started, fraction)
+            self._step = event.message or self._step
+            self._step_variant = event.variant
+        elif event.kind == STAGE_END:
+            self._running.pop(key, None)
+            self._done.add(key)
+            if not event.cached and event.seconds is not None:
+                self._durations.observe(event.stage, event.seconds)
+                self._measured[key] = event.seconds
+
+    def measured(self, variant: int | None) -> dict[str, float]:
+        """Seconds of the stages of variant (None: the shared ones) that computed."""
+        return {
+            stage: seconds
+            for (stage, stage_variant), seconds in self._measured.items()
+            if stage_variant == variant
+        }
+
+    def status(self) -> dict:
+        """progress (percent), eta_seconds, stage and current_step for JobStatus."""
+        total = 0.0
+        remaining = 0.0
+        now = self._clock()
+        for key in self._pending:
+            expected = self._durations.estimate(key[0])
+            total += expected
+            if key in self._done:
+                continue
+            if key in self._running:
+                started, fraction = self._running[key]
+                if fraction is None:
+                    fraction = min((now - started) / expected, _MAX_UNCOUNTED_FRACTION) if expected else 0.0
+                remaining += expected * (1.0 - fraction)
+            else:
+                remaining += expected
+
+        step = self._step
+        if self._variants > 1 and self._step_variant is not None:
+            step = f"[{self._step_variant + 1}/{self._variants}] {step}"
+        percent = 0 if total <= 0 else int(100 * (total - remaining) / total)
+        # Estimates move as stages are measured; the bar should not go back
+        self._percent = min(max(percent, self._percent), 99)
+        return {
+            "progress": self._percent,
+            "eta_seconds": round(remaining, 1),
+            "stage": self._stage,
+            "current_step": step,
+        }
@@ -2,12 +2,64 @@
 
 from __future__ import annotations
 
+from dataclasses import dataclass
+from typing import Iterable
+
 import cv2
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
 
 from src.models.segment import Segment
 
+# SSIM constants, as in Wang et al. (2004) and skimage's defaults for uint8
+_SSIM_WIN = 7
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+
+def structural_similarity(a: np.ndarray, b: np.ndarray, win_size: int = _SSIM_WIN) -> float | None:
+    """Mean SSIM of two grayscale uint8 images, computed only where they differ.
+
+    Matches skimage.metrics.structural_similarity with its defaults (uniform
+    window, sample covariance, border of win_size // 2 excluded from the mean).
+    Windows that contain no changed pixel have an SSIM of exactly 1, so the
+    local statistics are only computed, in float32 with box filters, over the
+    bounding box of the changed pixels grown by the window radius.
+
+    Returns:
+        Mean SSIM, or None if an image side is shorter than the window.
+    """
+    h, w = a.shape[:2]
+    if h < win_size or w < win_size:
+        return None
+    pad = win_size // 2
+    valid = (h - 2 * pad) * (w - 2 * pad)
+
+    # Window centres (in the valid area) whose window sees a changed pixel
+    ys, xs = np.nonzero(a != b)
+    if len(ys) == 0:
+        return 1.0
+    by1, by2 = max(int(ys.min()) - pad, pad), min(int(ys.max()) + pad + 1, h - pad)
+    bx1, bx2 = max(int(xs.min()) - pad, pad), min(int(xs.max()) + pad + 1, w - pad)
+
+    # Crop with a window-radius margin so the box filters need no border
+    x = a[by1 - pad:by2 + pad, bx1 - pad:bx2 + pad].astype(np.float32)
+    y = b[by1 - pad:by2 + pad, bx1 - pad:bx2 + pad].astype(np.float32)
+
+    def mean(img: np.ndarray) -> np.ndarray:
+        return cv2.boxFilter(img, cv2.CV_32F, (win_size, win_size), borderType=cv2.BORDER_REFLECT)
+
+    cov_norm = win_size * win_size / (win_size * win_size - 1.0)
+    ux, uy = mean(x), mean(y)
+    vx = cov_norm * (mean(x * x) - ux * ux)
+    vy = cov_norm * (mean(y * y) - uy * uy)
+    vxy = cov_norm * (mean(x * y) - ux * uy)
+
+    s = ((2 * ux * uy + _SSIM_C1) * (2 * vxy + _SSIM_C2)) / (
+        (ux * ux + uy * uy + _SSIM_C1) * (vx + vy + _SSIM_C2)
+    )
+    band = s[pad:-pad, pad:-pad]
+    return float((band.sum(dtype=np.float64) + (valid - band.size)) / valid)
+
 
 class QualityEvaluator:
     """Evaluates the quality of segments and image modifications."""
@@ -37,17 +89,48 @@ class QualityEvaluator:
         """Evaluate the quality of a segment.
 
         Args:
-            image: Original BGR image.
+            image: Original BGR image (unused; the checks only look at the mask).
             segment: Segment to evaluate.
 
         Returns:
             Tuple of (is_acceptable, quality_score, reason).
         """
+        return self._segment_quality(segment)
+
+    def evaluate_segments(
+        self,
+        segments: Iterable[Segment],
+        needed: int | None = None,
+        results: dict[int, tuple[bool, float, str]] | None = None,
+    ) -> dict[int, tuple[bool, float, str]]:
+        """Evaluate segments in order, stopping once enough of them pass.
+
+        Args:
+            segments: Candidates, best first (e.g. in saliency order).
+            needed: Stop after this many acceptable segments. None evaluates all.
+            results: Earlier results by segment id. Reused, and extended in place.
+
+        Returns:
+            Results by segment id for every segment evaluated so far.
+        """
+        results = {} if results is None else results
+        passed = 0
+        for segment in segments:
+            if needed is not None and passed >= needed:
+                break
+            if segment.id not in results:
+                results[segment.id] = self._segment_quality(segment)
+            if results[segment.id][0]:
+                passed += 1
+        return results
+
+    def _segment_quality(self, segment: Segment) -> tuple[bool, float, str]:
+        """Mask checks on the bbox crop, all shape metrics from one contour."""
         x1, y1, x2, y2 = segment.bbox
         mask = segment.mask[y1:y2, x1:x2]
+        edge_score, complexity, has_valid_contour = self._contour_metrics(mask)
 
         # Check 1: Edge smoothness
-        edge_score = self._evaluate_edge_smoothness(mask)
         if edge_score < self._min_edge_smoothness:
             return False, edge_score, f"エッジが荒い (score: {edge_score:.2f})"
 
@@ -57,12 +140,11 @@ class QualityEvaluator:
             return False, completeness, f"マスクが不完全 (score: {completeness:.2f})"
 
         # Check 3: Shape complexity (avoid overly complex shapes)
-        complexity = self._evaluate_shape_complexity(mask)
         if complexity > 0.8:  # Too complex
             return False, 1.0 - complexity, "形状が複雑すぎる"
 
         # Check 4: Contour quality
-        if not self._has_valid_contour(mask):
+        if not has_valid_contour:
             return False, 0.0, "有効な輪郭がない"
 
         # Calculate overall quality score
@@ -88,16 +170,20 @@ class QualityEvaluator:
         Returns:
             Tuple of (is_acceptable, quality_score, reason).
         """
+        orig_gray = cv2.cvtColor(original_region, cv2.COLOR_BGR2GRAY)
+        mod_gray = cv2.cvtColor(modified_region, cv2.COLOR_BGR2GRAY)
+        # Morphology shared by the artifact and continuity checks
+        bands = _MaskBands.from_mask(mask)
+
         # Check 1: SSIM score (structural similarity)
         # We want high similarity in non-modified areas
         mask_inv = ~mask.astype(bool)
         if np.count_nonzero(mask_inv) > 100:
             # Check similarity in surrounding area
-            orig_gray = cv2.cvtColor(original_region, cv2.COLOR_BGR2GRAY)
-            mod_gray = cv2.cvtColor(modified_region, cv2.COLOR_BGR2GRAY)
-
-            # Compute SSIM on entire region
-            score, _ = ssim(orig_gray, mod_gray, full=True)
+            # SSIM over the entire region (unchanged windows count as 1)
+            score = structural_similarity(orig_gray, mod_gray)
+            if score is None:
+                score = 1.0  # Thinner than the SSIM window, nothing to compare
 
             # For modifications, we expect some difference
             # But surrounding areas should be very similar
@@ -111,7 +197,7 @@ class QualityEvaluator:
                     return False, score, "構造が変わりすぎている"
 
         # Check 2: Edge artifacts
-        artifact_score = self._detect_edge_artifacts(original_region, modified_region, mask)
+        artifact_score = self._detect_edge_artifacts(orig_gray, mod_gray, bands)
         if artifact_score > 0.3:  # Too many artifacts
             return False, 1.0 - artifact_score, f"エッジにアーティファクト (score: {artifact_score:.2f})"
 
@@ -123,27 +209,33 @@ class QualityEvaluator:
 
         # Check 4: Continuity (for additions)
         if modification_type == "addition":
-            continuity_score = self._evaluate_addition_continuity(modified_region, mask)
+            continuity_score = self._evaluate_addition_continuity(modified_region, bands)
             if continuity_score < 0.6:
                 return False, continuity_score, "追加が不自然"
 
         return True, 0.9, "合格"
 
-    def _evaluate_edge_smoothness(self, mask: np.ndarray) -> float:
-        """Evaluate how smooth the edges of a mask are.
+    def _contour_metrics(self, mask: np.ndarray) -> tuple[float, float, bool]:
+        """Shape metrics of the largest external contour of a mask.
 
         Args:
             mask: Binary mask.
 
         Returns:
-            Smoothness score (0-1, higher is smoother).
+            (edge_smoothness, complexity, has_valid_contour):
+            smoothness 0-1 (higher is smoother), complexity 0-1 (higher is
+            more complex), and whether the contour encloses over 100 pixels.
+
+        Smoothness uses the full chain (CHAIN_APPROX_NONE) and the others its
+        CHAIN_APPROX_SIMPLE form, as the separate findContours calls did:
+        approxPolyDP's vertex count depends on which points the chain keeps.
         """
         mask_u8 = mask.astype(np.uint8) * 255
 
         # Find contours
         contours, _ = cv2.findContours(mask_u8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
         if not contours:
-            return 0.0
+            return 0.0, 1.0, False
 
         # Get the largest contour
         contour = max(contours, key=cv2.contourArea)
@@ -151,7 +243,16 @@ class QualityEvaluator:
         # Calculate perimeter and area
         perimeter = cv2.arcLength(contour, True)
         area = cv2.contourArea(contour)
+        simple = _compress_chain(contour)
+
+        return (
+            self._edge_smoothness(contour, perimeter, area),
+            self._shape_complexity(simple, cv2.arcLength(simple, True)),
+            cv2.contourArea(simple) > 100,  # Minimum 100 pixels
+        )
 
+    def _edge_smoothness(self, contour: np.ndarray, perimeter: float, area: float) -> float:
+        """Evaluate how smooth the edges of a contour are (0-1, higher is smoother)."""
         if area == 0:
             return 0.0
 
@@ -203,26 +304,9 @@ class QualityEvaluator:
         else:
             return 1.0
 
-    def _evaluate_shape_complexity(self, mask: np.ndarray) -> float:
-        """Evaluate the complexity of a shape.
-
-        Args:
-            mask: Binary mask.
-
-        Returns:
-            Complexity score (0-1, higher is more complex).
-        """
-        mask_u8 = mask.astype(np.uint8) * 255
-
-        # Find contours
-        contours, _ = cv2.findContours(mask_u8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours:
-            return 1.0
-
-        contour = max(contours, key=cv2.contourArea)
-
+    def _shape_complexity(self, contour: np.ndarray, perimeter: float) -> float:
+        """Evaluate the complexity of a contour (0-1, higher is more complex)."""
         # Number of vertices in simplified contour
-        perimeter = cv2.arcLength(contour, True)
         epsilon = 0.01 * perimeter
         approx = cv2.approxPolyDP(contour, epsilon, True)
 
@@ -237,63 +321,42 @@ class QualityEvaluator:
         else:
             return min(1.0, 0.5 + (num_vertices - 12) * 0.05)
 
-    def _has_valid_contour(self, mask: np.ndarray) -> bool:
-        """Check if mask has a valid contour.
-
-        Args:
-            mask: Binary mask.
-
-        Returns:
-            True if valid contour exists.
-        """
-        mask_u8 = mask.astype(np.uint8) * 255
-
-        contours, _ = cv2.findContours(mask_u8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours:
-            return False
-
-        # Check if largest contour has reasonable area
-        contour = max(contours, key=cv2.contourArea)
-        area = cv2.contourArea(contour)
-
-        return area > 100  # Minimum 100 pixels
-
     def _detect_edge_artifacts(
         self,
-        original: np.ndarray,
-        modified: np.ndarray,
-        mask: np.ndarray,
+        orig_gray: np.ndarray,
+        mod_gray: np.ndarray,
+        bands: _MaskBands,
     ) -> float:
         """Detect artifacts around edges of modification.
 
         Args:
-            original: Original region.
-            modified: Modified region.
-            mask: Binary mask.
+            orig_gray: Original region, grayscale.
+            mod_gray: Modified region, grayscale.
+            bands: Morphology of the modification mask.
 
         Returns:
             Artifact score (0-1, higher means more artifacts).
         """
-        # Create edge region (border of mask)
-        mask_u8 = mask.astype(np.uint8) * 255
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        dilated = cv2.dilate(mask_u8, kernel, iterations=2)
-        eroded = cv2.erode(mask_u8, kernel, iterations=2)
-        edge_region = (dilated > 0) & (eroded == 0)
-
-        if np.count_nonzero(edge_region) == 0:
+        # Edge region (border of mask)
+        bx, by, bw, bh = cv2.boundingRect(bands.edge)
+        if bw == 0:
             return 0.0
 
-        # Calculate gradient magnitude in edge region
-        orig_gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
-        mod_gray = cv2.cvtColor(modified, cv2.COLOR_BGR2GRAY)
+        # Gradients only over the edge band's bbox, plus the 1px Sobel support.
+        # Where the crop meets the region border, Sobel's reflection matches
+        # the full-region result.
+        h, w = bands.edge.shape
+        y1, y2 = max(by - 1, 0), min(by + bh + 1, h)
+        x1, x2 = max(bx - 1, 0), min(bx + bw + 1, w)
+        band = bands.edge[y1:y2, x1:x2] > 0
 
-        orig_grad = cv2.Sobel(orig_gray, cv2.CV_64F, 1, 1, ksize=3)
-        mod_grad = cv2.Sobel(mod_gray, cv2.CV_64F, 1, 1, ksize=3)
+        # |d2/dxdy| of uint8 is at most 510, so CV_16S is exact
+        orig_grad = cv2.Sobel(orig_gray[y1:y2, x1:x2], cv2.CV_16S, 1, 1, ksize=3)
+        mod_grad = cv2.Sobel(mod_gray[y1:y2, x1:x2], cv2.CV_16S, 1, 1, ksize=3)
 
         # Compare gradients in edge region
-        orig_edge_grad = np.abs(orig_grad[edge_region]).mean()
-        mod_edge_grad = np.abs(mod_grad[edge_region]).mean()
+        orig_edge_grad = np.abs(orig_grad[band]).mean()
+        mod_edge_grad = np.abs(mod_grad[band]).mean()
 
         # High increase in gradient = artifacts
         if orig_edge_grad < 1.0:
@@ -352,37 +415,24 @@ class QualityEvaluator:
     def _evaluate_addition_continuity(
         self,
         image: np.ndarray,
-        mask: np.ndarray,
+        bands: _MaskBands,
     ) -> float:
         """Evaluate continuity of added object with surroundings.
 
         Args:
             image: Image region with added object.
-            mask: Binary mask of added object.
+            bands: Morphology of the added object's mask.
 
         Returns:
             Continuity score (0-1).
         """
-        mask_u8 = mask.astype(np.uint8) * 255
-
-        # Get border region
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        dilated = cv2.dilate(mask_u8, kernel, iterations=2)
-        border = (dilated > 0) & (mask_u8 == 0)
-
-        if np.count_nonzero(border) == 0:
+        # Border region and object must both be non-empty
+        if cv2.countNonZero(bands.outer) == 0 or cv2.countNonZero(bands.mask) == 0:
             return 1.0
 
-        # Calculate color difference at border
-        object_pixels = image[mask.astype(bool)]
-        border_pixels = image[border]
-
-        if len(object_pixels) == 0 or len(border_pixels) == 0:
-            return 1.0
-
-        # Mean color difference
-        object_color = np.mean(object_pixels, axis=0)
-        border_color = np.mean(border_pixels, axis=0)
+        # Mean color difference at border
+        object_color = np.array(cv2.mean(image, mask=bands.mask)[:3])
+        border_color = np.array(cv2.mean(image, mask=bands.outer)[:3])
 
         color_diff = np.linalg.norm(object_color - border_color)
 
@@ -390,3 +440,37 @@ class QualityEvaluator:
         continuity = 1.0 - min(1.0, color_diff / 150.0)
 
         return continuity
+
+
+def _compress_chain(contour: np.ndarray) -> np.ndarray:
+    """CHAIN_APPROX_SIMPLE form of a CHAIN_APPROX_NONE contour.
+
+    Keeps the points where the step to the next point changes, i.e. the
+    ends of horizontal, vertical and diagonal runs, in the same order.
+    """
+    if len(contour) < 2:
+        return contour
+    points = contour[:, 0, :]
+    steps = np.diff(points, axis=0, append=points[:1])
+    return contour[np.any(steps != np.roll(steps, 1, axis=0), axis=1)]
+
+
+@dataclass
+class _MaskBands:
+    """Bands around a modification mask, computed once per check."""
+
+    mask: np.ndarray  # uint8 0/255
+    outer: np.ndarray  # uint8 0/255: dilated minus mask
+    edge: np.ndarray  # uint8 0/255: dilated minus eroded
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> _MaskBands:
+        mask_u8 = mask.astype(np.uint8) * 255
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        dilated = cv2.dilate(mask_u8, kernel, iterations=2)
+        eroded = cv2.erode(mask_u8, kernel, iterations=2)
+        return cls(
+            mask=mask_u8,
+            outer=cv2.subtract(dilated, mask_u8),
+            edge=cv2.subtract(dilated, eroded),
+        )
@@ -70,6 +70,7 @@ class SegmentationService:
         image: np.ndarray,
         min_area_ratio: float = 0.002,
         max_area_ratio: float = 0.15,
+        imgsz: int | None = None,
     ) -> list[Segment]:
         """Run FastSAM segmentation on a BGR image.
 
@@ -77,6 +78,7 @@ class SegmentationService:
             image: BGR image (H, W, 3) uint8.
             min_area_ratio: Minimum segment area as fraction of image area.
             max_area_ratio: Maximum segment area as fraction of image area.
+            imgsz: Model input size for this call (configured size if None).
 
         Returns:
             List of Segment objects, sorted by area (descending).
@@ -95,7 +97,7 @@ class SegmentationService:
             rgb,
             device="cpu",
             retina_masks=True,
-            imgsz=self._imgsz,
+            imgsz=imgsz or self._imgsz,
             conf=self._conf,
             iou=self._iou,
             verbose=False,
@@ -0,0 +1,142 @@
+"""Job statuses in memory, written behind to SQLite by one background thread."""
+
+from __future__ import annotations
+
+import logging
+import threading
+
+from src.models.job import JobState, JobStatus
+from src import database
+
+logger = logging.getLogger(__name__)
+
+# States after which a job's status no longer changes
+TERMINAL_STATES = (JobState.COMPLETED, JobState.FAILED, JobState.CANCELLED)
+
+
+class StatusStore:
+    """Statuses of the jobs this process updates, persisted write-behind.
+
+    Updates change memory at once and mark the job dirty. A writer thread
+    saves dirty jobs every flush_interval seconds, all in one transaction,
+    so a job that reported ten progress steps meanwhile costs one row write
+    and the job's own thread never waits for SQLite. Terminal states are
+    the exception: they are written before update() returns, so a finished
+    job is durable and visible to other processes once it reports done.
+
+    Only jobs this process is updating are held in memory, until they reach
+    a terminal state. Any other job is read from the database, where the
+    worker processing it writes.
+
+    Every update bumps version and wakes wait(), so followers of a job
+    processed here hear of a change at once rather than at their next poll.
+    """
+
+    def __init__(self, database_path: str, flush_interval: float = 0.5) -> None:
+        self._database_path = database_path
+        self._flush_interval = flush_interval
+        self._jobs: dict[str, JobStatus] = {}
+        # job_id -> latest unsaved row; newer updates replace older ones
+        self._dirty: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.version = 0
+        # Held from taking dirty rows until they are written, so an older
+        # row can never land after a newer synchronous one
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="status-writer", daemon=True)
+        self._writer.start()
+
+    def add(self, statuses: list[JobStatus]) -> None:
+        """Write new jobs to the database before returning."""
+        self._save([_row(status) for status in statuses])
+
+    def get(self, job_id: str) -> JobStatus | None:
+        """Current status: memory for jobs updated here, else the database."""
+        with self._lock:
+            if job_id in self._jobs:
+                return self._jobs[job_id]
+
+        db_status = database.get_job_status(self._database_path, job_id)
+        if db_status is None:
+            return None
+        return JobStatus.from_dict(db_status)
+
+    def update(self, job_id: str, **fields) -> None:
+        """Change fields of a job's status; terminal states are written at once."""
+        with self._lock:
+            loaded = job_id in self._jobs
+        if not loaded:
+            status = self.get(job_id)
+            if status is None:
+                # Job not in memory or database, nothing to update
+                return
+            with self._lock:
+                self._jobs.setdefault(job_id, status)
+
+        with self._lock:
+            job = self._jobs[job_id]
+            for key, value in fields.items():
+                setattr(job, key, value)
+            self._dirty[job_id] = _row(job)
+            terminal = job.status in TERMINAL_STATES
+            self.version += 1
+            self._changed.notify_all()
+        if terminal and self._write([job_id]):
+            with self._lock:
+                # The database has the final state; stop holding the job
+                if job_id not in self._dirty:
+                    self._jobs.pop(job_id, None)
+
+    def wait(self, version: int, timeout: float) -> int:
+        """Block until an update after version, or timeout. Returns the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def flush(self) -> None:
+        """Write every dirty status now."""
+        with self._write_lock:
+            with self._lock:
+                rows = list(self._dirty.values())
+                self._dirty.clear()
+            self._save(rows)
+
+    def close(self) -> None:
+        """Stop the writer thread after a last flush."""
+        self._stop.set()
+        self._writer.join()
+        self.flush()
+
+    def _write(self, job_ids: list[str]) -> bool:
+        with self._write_lock:
+            with self._lock:
+                rows = [_row(self._jobs[job_id]) for job_id in job_ids]
+                for job_id in job_ids:
+                    self._dirty.pop(job_id, None)
+            return self._save(rows)
+
+    def _save(self, rows: list[dict]) -> bool:
+        if not rows:
+            return True
+        try:
+            database.save_job_statuses(self._database_path, rows)
+        except Exception:
+            logger.exception("Could not save %d job statuses", len(rows))
+            # Retried by the writer unless a newer row is already waiting
+            with self._lock:
+                for row in rows:
+                    if row["job_id"] in self._jobs:
+                        self._dirty.setdefault(row["job_id"], row)
+            return False
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._flush_interval):
+            self.flush()
+
+
+def _row(job: JobStatus) -> dict:
+    """A snapshot of job for save_job_statuses."""
+    return job.to_dict()
@@ -0,0 +1,266 @@
+"""Generation in worker processes, for throughput that scales with cores."""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Mapping
+
+import numpy as np
+
+from src.models.difference import GenerationResult
+from src.models.progress import ProgressCallback, ProgressEvent
+from src.services.color_changer import ColorChanger
+from src.services.difference_generator import DifferenceGenerator
+from src.services.inpainting import InpaintingService
+from src.services.object_duplicator import ObjectDuplicator
+from src.services.pipeline import StageCache
+from src.services.saliency import SaliencyService
+from src.services.segmentation import SegmentationService
+from src.utils import shared_arrays
+from src.utils.deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+# Config keys build_generator reads; only these are sent to worker processes
+GENERATOR_SETTINGS = (
+    "MODEL_FOLDER",
+    "FASTSAM_MODEL",
+    "FASTSAM_CONF",
+    "FASTSAM_IOU",
+    "PROCESSING_IMAGE_SIZE",
+    "INPAINT_RADIUS",
+    "INPAINT_METHOD",
+    "DIFFICULTY_CONFIG",
+    "SEGMENT_MIN_AREA_RATIO",
+    "SEGMENT_MAX_AREA_RATIO",
+    "EDIT_WORKERS",
+    "PROXY_MAX_SIZE",
+    "FALLBACK_PROXY_SIZE",
+    "FALLBACK_IMGSZ",
+    "STAGE_CACHE_MB",
+    "STAGE_CACHE_DIR",
+)
+
+# Seconds to wait for a worker's last events after its result arrived
+_EVENT_FLUSH_TIMEOUT = 5.0
+
+
+def build_generator(config: Mapping[str, Any], preload_model: bool = True) -> DifferenceGenerator:
+    """Create the generator and its services from application config.
+
+    Args:
+        config: Application config (at least the GENERATOR_SETTINGS keys).
+        preload_model: Load FastSAM now rather than on the first request.
+    """
+    model_path = os.path.join(config["MODEL_FOLDER"], config["FASTSAM_MODEL"])
+
+    segmentation = SegmentationService(
+        model_path=model_path,
+        conf=config["FASTSAM_CONF"],
+        iou=config["FASTSAM_IOU"],
+        imgsz=config["PROCESSING_IMAGE_SIZE"],
+    )
+
+    # Pre-load FastSAM model at startup to avoid first-request timeout
+    # This takes ~30-60 seconds but prevents WORKER TIMEOUT on first request
+    # Only pre-load if model file exists (skips on first deployment)
+    if preload_model:
+        if Path(model_path).exists():
+            logging.info("Pre-loading FastSAM model at startup...")
+            segmentation._ensure_model()
+            logging.info("FastSAM model pre-loaded successfully")
+        else:
+            logging.warning(
+                "FastSAM model not found at startup. Model will be loaded on first request. "
+                "Consider downloading model before deployment: python scripts/download_model.py"
+            )
+
+    stage_cache = None
+    if config["STAGE_CACHE_MB"]:
+        stage_cache = StageCache(
+            max_bytes=config["STAGE_CACHE_MB"] * 1024 * 1024,
+            disk_dir=config["STAGE_CACHE_DIR"],
+        )
+
+    return DifferenceGenerator(
+        segmentation=segmentation,
+        saliency=SaliencyService(),
+        inpainting=InpaintingService(
+            radius=config["INPAINT_RADIUS"],
+            method=config["INPAINT_METHOD"],
+        ),
+        color_changer=ColorChanger(),
+        object_duplicator=ObjectDuplicator(),
+        difficulty_config=config["DIFFICULTY_CONFIG"],
+        segment_min_area_ratio=config["SEGMENT_MIN_AREA_RATIO"],
+        segment_max_area_ratio=config["SEGMENT_MAX_AREA_RATIO"],
+        edit_workers=config["EDIT_WORKERS"],
+        proxy_max_size=config["PROXY_MAX_SIZE"],
+        fallback_proxy_size=config["FALLBACK_PROXY_SIZE"],
+        fallback_imgsz=config["FALLBACK_IMGSZ"],
+        stage_cache=stage_cache,
+    )
+
+
+class GenerationPool:
+    """Runs DifferenceGenerator.generate_many in a pool of worker processes.
+
+    Each worker builds its own generator (and loads the model) once, when it
+    starts. The input image and every large array of the results travel
+    through shared memory; progress events come back over a queue and are
+    passed to the caller's callback on a parent thread, so JobManager
+    consumes them exactly as it does in-process.
+    """
+
+    def __init__(
+        self,
+        config: Mapping[str, Any],
+        max_workers: int,
+        builder: Callable[[Mapping[str, Any]], DifferenceGenerator] = build_generator,
+    ) -> None:
+        """Initialize the pool. Worker processes start with the first job.
+
+        Args:
+            config: Application config (see GENERATOR_SETTINGS).
+            max_workers: Worker processes, i.e. jobs generated in parallel.
+            builder: Module-level function creating a worker's generator.
+        """
+        self._config = {key: config[key] for key in GENERATOR_SETTINGS if key in config}
+        self._max_workers = max_workers
+        self._builder = builder
+        # fork would copy the parent's threads and open SQLite handles
+        self._context = multiprocessing.get_context("spawn")
+        self._events = self._context.Queue()
+        self._listeners: dict[str, tuple[ProgressCallback, threading.Event]] = {}
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        threading.Thread(
+            target=self._drain_events, name="generation-events", daemon=True
+        ).start()
+
+    def generate_many(
+        self,
+        image: np.ndarray,
+        difficulties: list[str],
+        progress: ProgressCallback = None,
+        seeds: list[int] | None = None,
+        deadline: Deadline | None = None,
+        checkpoint_dir: str | Path | None = None,
+    ) -> list[GenerationResult]:
+        """Same contract as DifferenceGenerator.generate_many, run in a worker."""
+        batch = uuid.uuid4().hex
+        flushed = threading.Event()
+        with self._lock:
+            self._listeners[batch] = (progress, flushed)
+        try:
+            with shared_arrays.SharedArray(image) as shared:
+                executor = self._executor
+                future = executor.submit(
+                    _generate_in_worker,
+                    shared.handle, difficulties, seeds, deadline, checkpoint_dir, batch,
+                )
+                try:
+                    payload = future.result()
+                except BrokenProcessPool:
+                    # A worker died (e.g. out of memory); later jobs get a fresh pool
+                    self._replace_executor(executor)
+                    raise
+            if not flushed.wait(_EVENT_FLUSH_TIMEOUT):
+                logger.warning("Progress events of batch %s were not flushed", batch)
+        finally:
+            with self._lock:
+                del self._listeners[batch]
+
+        results = shared_arrays.loads(payload)
+        for result in results:
+            result.original_image = image
+        return results
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._events.put((None, None))
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self._max_workers,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(self._builder, self._config, self._events),
+        )
+
+    def _replace_executor(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is broken:
+                logger.error("Generation worker died; restarting the process pool")
+                self._executor = self._new_executor()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _drain_events(self) -> None:
+        """Deliver worker events to the callbacks registered per batch."""
+        while True:
+            batch, payload = self._events.get()
+            if batch is None:
+                return
+            with self._lock:
+                listener = self._listeners.get(batch)
+            if payload is None:
+                if listener is not None:
+                    listener[1].set()
+                continue
+            # Always load: it frees the shared blocks of a preview
+            event = shared_arrays.loads(payload)
+            if listener is None or listener[0] is None:
+                continue
+            try:
+                listener[0](event)
+            except Exception:
+                logger.exception("Progress callback failed for batch %s", batch)
+
+
+# Worker process state, set once by _init_worker
+_generator: DifferenceGenerator | None = None
+_events = None
+
+
+def _init_worker(builder, config: dict, events) -> None:
+    global _generator, _events
+    _generator = builder(config)
+    _events = events
+    atexit.register(_generator.close)
+    logger.info("Generation worker %d ready", os.getpid())
+
+
+def _generate_in_worker(
+    handle: tuple,
+    difficulties: list[str],
+    seeds: list[int] | None,
+    deadline: Deadline | None,
+    checkpoint_dir: str | Path | None,
+    batch: str,
+) -> bytes:
+    image = shared_arrays.attach(handle)
+
+    def on_event(event: ProgressEvent) -> None:
+        _events.put((batch, shared_arrays.dumps(event)))
+
+    try:
+        results = _generator.generate_many(
+            image, difficulties, progress=on_event, seeds=seeds, deadline=deadline,
+            checkpoint_dir=checkpoint_dir,
+        )
+    finally:
+        # Marks the end of this batch's events
+        _events.put((batch, None))
+
+    # The parent still has the original image
+    for result in results:
+        result.original_image = None
+    return shared_arrays.dumps(results)
@@ -1,18 +1,33 @@
 /**
- * Processing page: polls job status and updates the progress bar with detailed steps.
+ * Processing page: follows the job status and updates the progress bar with detailed steps.
+ * Status changes are pushed over Server-Sent Events; polling is the fallback.
  */
 (function () {
     "use strict";
 
     var POLL_INTERVAL = 500; // ms - Faster polling for better responsiveness
-    var ESTIMATED_TIME = 15; // seconds (increased for new steps)
+    var MAX_STREAM_ERRORS = 3; // failed stream (re)connections in a row before polling
+
+    // Pipeline stage (JobStatus.stage) -> step shown on the page
+    var STAGE_STEPS = {
+        decode: "step-load",
+        proxy: "step-segment",
+        segment: "step-segment",
+        saliency: "step-saliency",
+        quality: "step-modify",
+        select: "step-modify",
+        edit: "step-modify",
+        render: "step-modify",
+        encode: "step-finalize"
+    };
+    var STEP_ORDER = ["step-load", "step-segment", "step-saliency", "step-modify", "step-finalize"];
 
     var progressFill = document.getElementById("progressFill");
     var progressText = document.getElementById("progressText");
     var stepText = document.getElementById("stepText");
     var estimatedTime = document.getElementById("estimatedTime");
-
-    var startTime = Date.now();
+    var previewImage = document.getElementById("previewImage");
+    var cancelBtn = document.getElementById("cancelBtn");
 
     var jobId = sessionStorage.getItem("job_id");
 
@@ -24,99 +39,149 @@
         return;
     }
 
-    var timer = setInterval(pollStatus, POLL_INTERVAL);
-    pollStatus(); // immediate first call
+    var timer = null;
+    var source = null;
+    var streamErrors = 0;
 
-    function pollStatus() {
-        fetch("/api/status/" + encodeURIComponent(jobId))
-            .then(function (res) { return res.json(); })
-            .then(function (data) {
-                var progress = data.progress || 0;
-                var step = data.current_step || data.step || "";
+    if (window.EventSource) {
+        listen();
+    } else {
+        startPolling();
+    }
 
-                progressFill.style.width = progress + "%";
-                progressText.textContent = Math.round(progress) + "%";
+    if (cancelBtn) {
+        cancelBtn.addEventListener("click", cancelJob);
+    }
 
-                // Show specific message based on status
-                if (data.status === "queued") {
-                    stepText.textContent = "処理開始を待機中...";
+    function cancelJob() {
+        cancelBtn.disabled = true;
+        fetch("/api/jobs/" + encodeURIComponent(jobId), { method: "DELETE" })
+            .then(function (res) {
+                if (res.ok) {
+                    // A running job stops at its next step; nothing left to show here
+                    stop();
+                    window.location.href = "/";
                 } else {
-                    stepText.textContent = step || "処理中...";
+                    // Already finished: the next poll shows the result or error
+                    cancelBtn.disabled = false;
                 }
+            })
+            .catch(function () {
+                cancelBtn.disabled = false;
+            });
+    }
 
-                // Update step visualization
-                updateSteps(progress, step);
-
-                // Update estimated time with adaptive calculation
-                var elapsed = (Date.now() - startTime) / 1000;
-                if (progress > 5 && progress < 100) {
-                    var estimatedTotal = elapsed / (progress / 100);
-                    var remaining = Math.max(0, estimatedTotal - elapsed);
-                    if (remaining > 0 && data.status !== "completed") {
-                        estimatedTime.textContent = "残り約 " + Math.ceil(remaining) + " 秒";
-                    }
-                } else if (data.status !== "completed") {
-                    estimatedTime.textContent = "推定 " + ESTIMATED_TIME + " 秒";
-                }
+    function listen() {
+        source = new EventSource("/api/status/" + encodeURIComponent(jobId) + "/stream");
+        source.onmessage = function (event) {
+            streamErrors = 0;
+            render(JSON.parse(event.data));
+        };
+        source.onerror = function () {
+            // The server ends a stream after a while and the browser reconnects;
+            // a stream that cannot be opened (or is closed) falls back to polling
+            streamErrors++;
+            if (source.readyState === EventSource.CLOSED || streamErrors >= MAX_STREAM_ERRORS) {
+                source.close();
+                source = null;
+                startPolling();
+            }
+        };
+    }
 
-                if (data.status === "completed") {
-                    clearInterval(timer);
-                    progressFill.style.width = "100%";
-                    progressText.textContent = "100%";
-                    stepText.textContent = "完了！リダイレクトしています...";
-                    estimatedTime.textContent = "";
-                    markStepComplete("step-finalize");
-                    setTimeout(function () {
-                        window.location.href = "/result/" + encodeURIComponent(jobId);
-                    }, 500);
-                } else if (data.status === "failed") {
-                    clearInterval(timer);
-                    stepText.textContent = "エラーが発生しました: " + (data.error || "不明なエラー");
-                    progressFill.style.background = "#dc2626";
-                    estimatedTime.textContent = "";
-                }
-            })
+    function startPolling() {
+        timer = setInterval(pollStatus, POLL_INTERVAL);
+        pollStatus(); // immediate first call
+    }
+
+    function stop() {
+        clearInterval(timer);
+        if (source) {
+            source.close();
+            source = null;
+        }
+    }
+
+    function pollStatus() {
+        fetch("/api/status/" + encodeURIComponent(jobId))
+            .then(function (res) { return res.json(); })
+            .then(render)
             .catch(function () {
                 // Transient network error — keep polling
                 stepText.textContent = "接続を再試行しています...";
             });
     }
 
-    function updateSteps(progress, stepText) {
-        // Map progress to steps based on job_manager progress updates
-        // 5%: Image load
-        // 40%: Segmentation complete
-        // 50%: Saliency complete
-        // 55-92%: Changes being applied
-        // 92-96%: Generating answer images
-        // 96-100%: Generating A4 layout & completion
-
-        if (progress >= 5 && progress < 40) {
-            markStepInProgress("step-load");
-        } else if (progress >= 40) {
-            markStepComplete("step-load");
+    function render(data) {
+        var progress = data.progress || 0;
+        var step = data.current_step || data.step || "";
+
+        progressFill.style.width = progress + "%";
+        progressText.textContent = Math.round(progress) + "%";
+
+        // Show specific message based on status
+        if (data.status === "queued") {
+            stepText.textContent = data.queue_position
+                ? "処理待ち: " + data.queue_position + "番目"
+                : "処理開始を待機中...";
+        } else {
+            stepText.textContent = step || "処理中...";
         }
 
-        if (progress >= 10 && progress < 50) {
-            markStepInProgress("step-segment");
-        } else if (progress >= 50) {
-            markStepComplete("step-segment");
+        // Update step visualization
+        updateSteps(data.stage);
+
+        // Remaining time from the server's measured stage durations
+        if ((data.status === "processing" || data.status === "queued") && data.eta_seconds != null) {
+            estimatedTime.textContent = "残り約 " + Math.max(1, Math.ceil(data.eta_seconds)) + " 秒";
+        } else {
+            estimatedTime.textContent = "";
         }
 
-        if (progress >= 50 && progress < 55) {
-            markStepInProgress("step-saliency");
-        } else if (progress >= 55) {
-            markStepComplete("step-saliency");
+        if (data.preview_url && previewImage && previewImage.getAttribute("src") !== data.preview_url) {
+            previewImage.src = data.preview_url;
+            previewImage.hidden = false;
         }
 
-        if (progress >= 55 && progress < 92) {
-            markStepInProgress("step-modify");
-        } else if (progress >= 92) {
-            markStepComplete("step-modify");
+        if (data.status === "completed") {
+            stop();
+            progressFill.style.width = "100%";
+            progressText.textContent = "100%";
+            stepText.textContent = "完了！リダイレクトしています...";
+            estimatedTime.textContent = "";
+            STEP_ORDER.forEach(markStepComplete);
+            setTimeout(function () {
+                window.location.href = "/result/" + encodeURIComponent(jobId);
+            }, 500);
+        } else if (data.status === "failed") {
+            stop();
+            stepText.textContent = "エラーが発生しました: " + (data.error || "不明なエラー");
+            progressFill.style.background = "#dc2626";
+            estimatedTime.textContent = "";
+            if (cancelBtn) {
+                cancelBtn.hidden = true;
+            }
+        } else if (data.status === "cancelled") {
+            stop();
+            stepText.textContent = data.error || "キャンセルされました";
+            estimatedTime.textContent = "";
+            if (cancelBtn) {
+                cancelBtn.hidden = true;
+            }
         }
+    }
 
-        if (progress >= 92 && progress < 100) {
-            markStepInProgress("step-finalize");
+    function updateSteps(stage) {
+        var current = STEP_ORDER.indexOf(STAGE_STEPS[stage]);
+        if (current < 0) {
+            return;
+        }
+        for (var i = 0; i < STEP_ORDER.length; i++) {
+            if (i < current) {
+                markStepComplete(STEP_ORDER[i]);
+            } else if (i === current) {
+                markStepInProgress(STEP_ORDER[i]);
+            }
         }
     }
 
@@ -0,0 +1,107 @@
+"""Per-job deadline that pipeline stages consult to choose cheaper options or stop."""
+
+from __future__ import annotations
+
+import logging
+import math
+import time
+from typing import Callable
+
+from src.exceptions import JobCancelledError, JobTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """Wall-clock budget for one job, counted from submission.
+
+    Before a stage starts it asks tight() with the stages still to run. When
+    the time left is below their combined budgets the stage falls back to a
+    cheaper option and records it with degrade(), so the total latency is
+    bounded by configuration rather than by the image.
+
+    Between stages and between edits the job also calls check(), which stops
+    it once it has been cancelled or has run past its hard time limit.
+    """
+
+    def __init__(
+        self,
+        seconds: float | None,
+        stage_budgets: dict[str, float] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        limit: float | None = None,
+        cancelled: Callable[[], str | None] | None = None,
+    ) -> None:
+        """Initialize the deadline.
+
+        Args:
+            seconds: Time allowed for the whole job. None never expires.
+            stage_budgets: Expected seconds per stage name.
+            clock: Monotonic clock, replaceable for tests.
+            limit: Seconds from now after which check() fails the job. None
+                never does.
+            cancelled: Returns why the job should stop, or None to go on.
+                Must be picklable when the job runs in a worker process.
+        """
+        self._clock = clock
+        self._seconds = seconds
+        self._expires_at = None if seconds is None else clock() + seconds
+        self._limit = limit
+        self._limit_at = None if limit is None else clock() + limit
+        self._cancelled = cancelled
+        self._budgets = dict(stage_budgets or {})
+        self._degradations: list[str] = []
+
+    @property
+    def seconds(self) -> float | None:
+        return self._seconds
+
+    @property
+    def degradations(self) -> list[str]:
+        """Cheaper options taken so far, in the order they were applied."""
+        return list(self._degradations)
+
+    def remaining(self) -> float:
+        """Seconds left, never negative. Infinite without a deadline."""
+        if self._expires_at is None:
+            return math.inf
+        return max(self._expires_at - self._clock(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def budget(self, *stages: str) -> float:
+        """Combined budget of the given stages, in seconds."""
+        return sum(self._budgets.get(stage, 0.0) for stage in stages)
+
+    def tight(self, *stages: str, repeat: int = 1) -> bool:
+        """Whether the time left is below the budgets of the given stages.
+
+        Args:
+            stages: Names of the stages still to run.
+            repeat: How many times those stages run (e.g. once per variant).
+        """
+        return self.remaining() < self.budget(*stages) * repeat
+
+    def check(self) -> None:
+        """Stop the job if it was cancelled or ran past its time limit.
+
+        Raises:
+            JobTimeoutError: The hard time limit has passed.
+            JobCancelledError: The job was cancelled; the message says why.
+        """
+        if self._limit_at is not None and self._clock() >= self._limit_at:
+            raise JobTimeoutError(f"処理時間の上限（{self._limit:.0f}秒）を超えたため中止しました")
+        if self._cancelled is not None:
+            reason = self._cancelled()
+            if reason:
+                raise JobCancelledError(reason)
+
+    def degrade(self, name: str) -> None:
+        """Record that a cheaper option was taken."""
+        if name not in self._degradations:
+            logger.info(
+                "Deadline pressure (%.1fs left): %s", self.remaining(), name
+            )
+            self._degradations.append(name)
@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+import hashlib
+import os
 import shutil
 import logging
 from datetime import datetime, timedelta, timezone
@@ -55,6 +57,42 @@ def cleanup_expired_files(
     return removed
 
 
+def path_size(path: str | Path) -> int:
+    """Bytes of a file, or of all files under a directory."""
+    path = Path(path)
+    try:
+        if not path.is_dir():
+            return path.stat().st_size
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    except OSError:
+        return 0
+
+
+def remove_path(path: str | Path) -> int:
+    """Delete a file or directory tree. Returns the bytes freed (0 on failure)."""
+    path = Path(path)
+    size = path_size(path)
+    try:
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        logger.warning("Failed to remove %s: %s", path, e)
+        return 0
+    return size
+
+
+def touch(path: str | Path) -> None:
+    """Mark a file or directory as used now; cleanup goes by modification time."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
 def get_output_dir(base_dir: str | Path, job_id: str) -> Path:
     """Get (and create) the output directory for a job.
 
@@ -67,3 +105,12 @@ def get_output_dir(base_dir: str | Path, job_id: str) -> Path:
         logger.error(f"Failed to create output directory {out}: {e}")
         raise
     return out
+
+
+def file_sha256(path: str | Path, chunk_size: int = 1024 * 1024) -> str:
+    """Return the hex SHA-256 digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -64,6 +64,55 @@ def scale_up_result(
     return cv2.resize(processed, (w, h), interpolation=cv2.INTER_LANCZOS4)
 
 
+def scale_bbox(bbox: list[int], scale: float, width: int, height: int) -> list[int]:
+    """Map a bbox from a resized image (see resize_for_processing) back to the
+    original resolution, rounding outwards and clipping to width x height."""
+    x1, y1, x2, y2 = bbox
+    return [
+        max(int(np.floor(x1 / scale)), 0),
+        max(int(np.floor(y1 / scale)), 0),
+        min(int(np.ceil(x2 / scale)), width),
+        min(int(np.ceil(y2 / scale)), height),
+    ]
+
+
+def upscale_mask(mask: np.ndarray, scale: float, roi: list[int]) -> np.ndarray:
+    """Upscale a low-resolution mask, but only inside an original-resolution ROI.
+
+    Args:
+        mask: Boolean mask of the resized image.
+        scale: Factor returned by resize_for_processing.
+        roi: Region [x1, y1, x2, y2] in original-resolution coordinates.
+
+    Returns:
+        Boolean mask of shape (y2 - y1, x2 - x1).
+    """
+    x1, y1, x2, y2 = roi
+    # Source crop with a 1px margin for interpolation
+    sx1 = max(int(np.floor(x1 * scale)) - 1, 0)
+    sy1 = max(int(np.floor(y1 * scale)) - 1, 0)
+    sx2 = min(int(np.ceil(x2 * scale)) + 1, mask.shape[1])
+    sy2 = min(int(np.ceil(y2 * scale)) + 1, mask.shape[0])
+    crop = mask[sy1:sy2, sx1:sx2].astype(np.float32)
+
+    # Map destination pixel centres into the crop (pixel-centre convention)
+    matrix = np.array(
+        [
+            [scale, 0.0, (x1 + 0.5) * scale - 0.5 - sx1],
+            [0.0, scale, (y1 + 0.5) * scale - 0.5 - sy1],
+        ],
+        dtype=np.float64,
+    )
+    up = cv2.warpAffine(
+        crop,
+        matrix,
+        (x2 - x1, y2 - y1),
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+    return up > 0.5
+
+
 def get_image_dimensions(path: str | Path) -> tuple[int, int]:
     """Return (width, height) of the image at path without fully loading it."""
     with Image.open(path) as img:
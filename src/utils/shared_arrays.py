@@ -0,0 +1,99 @@
+"""Hand numpy arrays between processes through shared memory instead of pickles."""
+
+from __future__ import annotations
+
+import io
+import pickle
+import weakref
+from multiprocessing import shared_memory
+from typing import Any
+
+import numpy as np
+
+# Smaller arrays are cheaper to pickle than to give their own block
+MIN_SHARED_BYTES = 64 * 1024
+
+
+class SharedArray:
+    """A copy of an array in a shared memory block, for the duration of a with block.
+
+    The receiving process calls attach() with the handle; the block's name is
+    removed when the with block exits, its memory once no process maps it.
+    """
+
+    def __init__(self, array: np.ndarray) -> None:
+        self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self._shm.buf)
+        view[...] = array
+        del view
+        self.handle = (self._shm.name, array.shape, array.dtype.str)
+
+    def __enter__(self) -> SharedArray:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._shm.close()
+        self._shm.unlink()
+
+
+def attach(handle: tuple[str, tuple[int, ...], str]) -> np.ndarray:
+    """The array behind a SharedArray handle, viewed in place (see _view)."""
+    name, shape, dtype = handle
+    return _view(shared_memory.SharedMemory(name=name), shape, dtype)
+
+
+def dumps(obj: Any) -> bytes:
+    """Pickle obj with its large arrays moved to shared memory blocks.
+
+    The blocks belong to whoever calls loads() on the result; the returned
+    bytes must be loaded exactly once.
+    """
+    buf = io.BytesIO()
+    _SharingPickler(buf).dump(obj)
+    return buf.getvalue()
+
+
+def loads(data: bytes) -> Any:
+    """Rebuild an object written by dumps(); its arrays view the shared blocks.
+
+    A block is freed once the arrays viewing it are collected.
+    """
+    return pickle.loads(data)
+
+
+class _SharingPickler(pickle.Pickler):
+    def __init__(self, file) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def reducer_override(self, obj: Any):
+        if (
+            isinstance(obj, np.ndarray)
+            and obj.nbytes >= MIN_SHARED_BYTES
+            and not obj.dtype.hasobject
+        ):
+            shm = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+            np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)[...] = obj
+            shm.close()
+            return _take_shared, (shm.name, obj.shape, obj.dtype.str)
+        return NotImplemented
+
+
+def _take_shared(name: str, shape: tuple[int, ...], dtype: str) -> np.ndarray:
+    shm = shared_memory.SharedMemory(name=name)
+    # Only the name goes; the mapping stays valid for the view
+    shm.unlink()
+    return _view(shm, shape, dtype)
+
+
+def _view(shm: shared_memory.SharedMemory, shape: tuple[int, ...], dtype: str) -> np.ndarray:
+    """An array over shm's memory that keeps the block mapped while it lives.
+
+    numpy keeps no hold on the mapping, so shm is closed only once this
+    array is collected; views of it reference it as their base and keep it
+    alive. Nothing is copied; in-place writes are safe, as the sender never
+    reads the block back.
+    """
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    # At exit the mapping simply goes with the process
+    weakref.finalize(array, shm.close).atexit = False
+    return array
@@ -88,6 +88,68 @@ def validate_difficulty(value: str) -> str:
     return normalised
 
 
+def validate_variants(data: dict, max_variants: int) -> list[str]:
+    """Resolve the difficulty of each requested puzzle variant.
+
+    Accepts either "difficulties" (a list, e.g. ["easy", "hard"]) or
+    "difficulty" plus an optional "variants" count. Returns one normalised
+    difficulty per variant.
+    """
+    if "difficulties" in data:
+        values = data["difficulties"]
+        if not isinstance(values, list) or not values:
+            raise ValidationError("difficulties は難易度のリストで指定してください")
+        difficulties = [validate_difficulty(str(v)) for v in values]
+    else:
+        difficulty = validate_difficulty(str(data.get("difficulty", "medium")))
+        count = data.get("variants", 1)
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            raise ValidationError("variants は1以上の整数で指定してください")
+        difficulties = [difficulty] * count
+
+    if len(difficulties) > max_variants:
+        raise ValidationError(f"一度に生成できるのは最大{max_variants}種類までです")
+    return difficulties
+
+
+def validate_seed(value) -> int | None:
+    """Validate an optional generation seed. Returns None when not given."""
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value < 2**32:
+        raise ValidationError("seed は0以上 2^32 未満の整数で指定してください")
+    return value
+
+
+def validate_idempotency_key(value: str | None) -> str | None:
+    """Validate an optional Idempotency-Key header. Returns None when not given."""
+    if value is None:
+        return None
+    if not 0 < len(value) <= 255:
+        raise ValidationError("Idempotency-Key は1〜255文字で指定してください")
+    return value
+
+
+def validate_stats_window(value: str | None, max_hours: float) -> float:
+    """Validate the hours of history a stats request covers (default 24)."""
+    if value is None:
+        return min(24.0, max_hours)
+    try:
+        hours = float(value)
+    except ValueError:
+        hours = 0.0
+    if not 0 < hours <= max_hours:
+        raise ValidationError(f"hours は0より大きく{max_hours:g}以下で指定してください")
+    return hours
+
+
+def validate_diff_id(value) -> int:
+    """Validate the id of a difference to reroll."""
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValidationError("diff_id は1以上の整数で指定してください")
+    return value
+
+
 def _get_extension(filename: str) -> str:
     if "." not in filename:
         return ""
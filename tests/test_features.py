@@ -7,6 +7,12 @@ all implemented features are working correctly.
 
 import sys
 import os
+import random
+import socket
+import subprocess
+import tempfile
+import threading
+import time
 from pathlib import Path
 import numpy as np
 import cv2
@@ -21,9 +27,27 @@ from src.services.a4_layout_composer import A4LayoutComposer
 from src.services.inpainting import InpaintingService
 from src.services.color_changer import ColorChanger
 from src.services.object_duplicator import ObjectDuplicator
-from src.services.quality_evaluator import QualityEvaluator
+from src.services.quality_evaluator import QualityEvaluator, _MaskBands, structural_similarity
+from src.services.difference_generator import DifferenceGenerator
+from src.services.pipeline import Pipeline, Stage, StageCache
+from src.services.progress_tracker import ProgressTracker, StageDurations
+from src.services.history_writer import HistoryWriter
+from src.services.janitor import Janitor
+from src.services.job_manager import CHECKPOINT_PREFIX, JobManager
+from src.services.job_queue import BatchWatch, JobQueue
+from src.services.memory_budget import MemoryBudget, MemoryModel
+from src.services.status_store import StatusStore
+from src.models.job import JobState, JobStatus
+from src import database
+from src.exceptions import JobCancelledError, JobTimeoutError, ResourceExhaustedError
+from src.models.progress import PROGRESS, STAGE_END, STAGE_START, ProgressEvent
 from src.models.difference import Difference
+from src.config import Config
+from src.models.edit import EditLog, EditState
 from src.models.segment import Segment
+from src.utils.deadline import Deadline
+from src.utils.image_io import resize_for_processing, scale_bbox, upscale_mask
+from src.utils import shared_arrays
 
 
 def test_answer_visualizer():
@@ -196,6 +220,51 @@ def test_object_duplicator():
     return True
 
 
+def test_object_duplicator_seamless():
+    """Test ObjectDuplicator seamless-clone blend mode."""
+    print("Testing ObjectDuplicator (seamless)...")
+
+    # Textured background so the Poisson blend has gradients to work with
+    image = np.ones((400, 400, 3), dtype=np.uint8) * 150
+    image[:, :, 1] = np.tile(np.linspace(100, 200, 400, dtype=np.uint8), (400, 1))
+    cv2.circle(image, (100, 100), 30, (50, 50, 200), -1)
+
+    mask = np.zeros((400, 400), dtype=np.uint8)
+    cv2.circle(mask, (100, 100), 30, 255, -1)
+
+    segment = Segment(
+        id=1,
+        mask=mask,
+        bbox=[70, 70, 131, 131],
+        area=int(np.pi * 30 * 30),
+        confidence=0.95,
+    )
+
+    duplicator = ObjectDuplicator()
+    result, new_bbox = duplicator.duplicate(image, segment, blend_mode="seamless")
+
+    assert result.shape == image.shape, "Result shape should match input"
+    if new_bbox is not None:
+        x1, y1, x2, y2 = new_bbox
+        assert not np.array_equal(result[y1:y2, x1:x2], image[y1:y2, x1:x2]), \
+            "Destination region should be modified"
+        # Pixels far from the destination ROI must be untouched
+        outside = np.ones(image.shape[:2], dtype=bool)
+        outside[max(y1 - 8, 0):y2 + 8, max(x1 - 8, 0):x2 + 8] = False
+        assert np.array_equal(result[outside], image[outside]), \
+            "Seamless clone should only touch the destination ROI"
+
+    try:
+        duplicator.duplicate(image, segment, blend_mode="unknown")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Unknown blend mode should raise ValueError")
+
+    print("✅ ObjectDuplicator seamless test passed")
+    return True
+
+
 def test_quality_evaluator():
     """Test QualityEvaluator class."""
     print("Testing QualityEvaluator...")
@@ -249,6 +318,1013 @@ def test_quality_evaluator():
     return True
 
 
+def test_fast_ssim():
+    """Test the ROI SSIM against skimage."""
+    print("Testing fast SSIM...")
+
+    from skimage.metrics import structural_similarity as skimage_ssim
+
+    rng = np.random.default_rng(0)
+    for h, w in [(7, 7), (40, 90), (150, 120)]:
+        original = cv2.GaussianBlur(rng.integers(0, 256, (h, w), dtype=np.uint8), (5, 5), 1.0)
+        modified = original.copy()
+        cv2.circle(modified, (w // 3, h // 2), max(h, w) // 4, 30, -1)
+
+        expected = skimage_ssim(original, modified)
+        score = structural_similarity(original, modified)
+        assert abs(score - expected) < 1e-4, f"SSIM {score} differs from skimage {expected}"
+
+    assert structural_similarity(original, original) == 1.0, "Identical regions score 1"
+    assert structural_similarity(original[:5], modified[:5]) is None, "Too thin for the window"
+
+    print("✅ Fast SSIM test passed")
+    return True
+
+
+def test_edge_artifact_parity():
+    """Test band-restricted artifact checks against full-region references."""
+    print("Testing edge artifact parity...")
+
+    evaluator = QualityEvaluator()
+    rng = np.random.default_rng(1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+    for h, w in [(40, 60), (120, 90), (200, 200)]:
+        original = cv2.GaussianBlur(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), (7, 7), 2)
+        modified = original.copy()
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.ellipse(mask, (w // 2, h // 2), (w // 3, h // 3), 0, 0, 360, 255, -1)
+        modified[mask > 0] = rng.integers(0, 256, 3)
+
+        # Reference: the previous full-region CV_64F computation
+        dilated = cv2.dilate(mask, kernel, iterations=2)
+        eroded = cv2.erode(mask, kernel, iterations=2)
+        edge = (dilated > 0) & (eroded == 0)
+        grads = [
+            np.abs(cv2.Sobel(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), cv2.CV_64F, 1, 1, ksize=3))[edge].mean()
+            for img in (original, modified)
+        ]
+        orig_grad = max(grads[0], 1.0)
+        expected_artifacts = min(1.0, max(0.0, (grads[1] - orig_grad) / orig_grad / 2.0))
+        border = (dilated > 0) & (mask == 0)
+        color_diff = np.linalg.norm(
+            modified[mask > 0].mean(axis=0) - modified[border].mean(axis=0)
+        )
+        expected_continuity = 1.0 - min(1.0, color_diff / 150.0)
+
+        bands = _MaskBands.from_mask(mask > 0)
+        artifacts = evaluator._detect_edge_artifacts(
+            cv2.cvtColor(original, cv2.COLOR_BGR2GRAY),
+            cv2.cvtColor(modified, cv2.COLOR_BGR2GRAY),
+            bands,
+        )
+        continuity = evaluator._evaluate_addition_continuity(modified, bands)
+        assert abs(artifacts - expected_artifacts) < 1e-9, "Artifact score should be unchanged"
+        assert abs(continuity - expected_continuity) < 1e-9, "Continuity should be unchanged"
+
+    print("✅ Edge artifact parity test passed")
+    return True
+
+
+def test_contour_metrics_parity():
+    """Test single-contour segment metrics against one findContours call per metric."""
+    print("Testing contour metrics parity...")
+
+    evaluator = QualityEvaluator()
+    rng = np.random.default_rng(2)
+
+    def largest(mask, method):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, method)
+        return max(contours, key=cv2.contourArea) if contours else None
+
+    for _ in range(300):
+        h, w = (int(v) for v in rng.integers(8, 120, 2))
+        mask = np.zeros((h, w), dtype=np.uint8)
+        for _ in range(int(rng.integers(1, 4))):
+            center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+            axes = (int(rng.integers(1, 40)), int(rng.integers(1, 40)))
+            cv2.ellipse(mask, center, axes, float(rng.uniform(0, 180)), 0, 360, 255, -1)
+        if rng.random() < 0.5:
+            mask |= (rng.random((h, w)) < 0.2).astype(np.uint8) * 255
+
+        # Reference: smoothness on the NONE chain, the rest on the SIMPLE chain
+        full = largest(mask, cv2.CHAIN_APPROX_NONE)
+        simple = largest(mask, cv2.CHAIN_APPROX_SIMPLE)
+        if full is None:
+            expected = (0.0, 1.0, False)
+        else:
+            perimeter = cv2.arcLength(full, True)
+            expected = (
+                evaluator._edge_smoothness(full, perimeter, cv2.contourArea(full)),
+                evaluator._shape_complexity(simple, cv2.arcLength(simple, True)),
+                cv2.contourArea(simple) > 100,
+            )
+        assert evaluator._contour_metrics(mask > 0) == expected, "Segment metrics should be unchanged"
+
+    print("✅ Contour metrics parity test passed")
+    return True
+
+
+def test_batch_segment_quality():
+    """Test batch segment evaluation with early stop."""
+    print("Testing batch segment quality...")
+
+    evaluator = QualityEvaluator()
+    image = np.zeros((300, 300, 3), dtype=np.uint8)
+
+    segments = []
+    for i in range(6):
+        mask = np.zeros((300, 300), dtype=np.uint8)
+        if i % 2 == 0:
+            cv2.circle(mask, (50 + 40 * i, 150), 18, 255, -1)  # clean blob, passes
+        else:
+            mask[100:200:3, 30 * i:30 * i + 20] = 255  # striped, fails
+        ys, xs = np.nonzero(mask)
+        bbox = [int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1]
+        segments.append(Segment(id=i, mask=mask > 0, bbox=bbox, area=int(np.count_nonzero(mask))))
+
+    # Same verdicts as the single-segment API
+    results = evaluator.evaluate_segments(segments)
+    for seg in segments:
+        assert results[seg.id] == evaluator.evaluate_segment_quality(image, seg)
+    assert [results[i][0] for i in range(6)] == [True, False] * 3, "Blobs pass, stripes fail"
+
+    # Stops once enough pass, reusing earlier results
+    partial = evaluator.evaluate_segments(segments, needed=2)
+    assert sorted(partial) == [0, 1, 2], "Should stop after the second pass"
+    partial = evaluator.evaluate_segments(segments, needed=3, results=partial)
+    assert sorted(partial) == [0, 1, 2, 3, 4], "Should resume with cached results"
+
+    # Selection evaluates what it needs without touching the quality stage's output
+    generator = DifferenceGenerator(
+        None, None, InpaintingService(), ColorChanger(), ObjectDuplicator(), Config.DIFFICULTY_CONFIG
+    )
+    cached = evaluator.evaluate_segments(segments, needed=1)
+    selected, _ = generator._stage_select(
+        segments, cached, {"num_changes": 3, "max_saliency": 1.0}, seed=1
+    )
+    assert sorted(seg.id for seg in selected) == [0, 2, 4], "Selection should evaluate further"
+    assert sorted(cached) == [0], "Cached quality results should stay as stored"
+
+    print("✅ Batch segment quality test passed")
+    return True
+
+
+def test_edit_log():
+    """Test EditLog patch commit, read and materialize."""
+    print("Testing EditLog...")
+
+    base = np.ones((100, 100, 3), dtype=np.uint8) * 50
+    log = EditLog(base)
+
+    # Candidate change in ROI [10, 10, 40, 40]
+    roi = [10, 10, 40, 40]
+    before = log.read(roi)
+    after = before.copy()
+    after[5:15, 5:15] = 200
+    patch = log.make_patch(roi, before, after, "color_change", 0, [15, 15, 25, 25])
+    assert patch.mask.sum() == 100, "Only changed pixels should be in the patch mask"
+
+    # Rejected patches leave no trace
+    assert np.array_equal(log.materialize(), base), "Uncommitted patch must not apply"
+
+    log.commit(patch)
+
+    # Overlapping reads see the committed patch
+    overlap = log.read([20, 20, 60, 60])
+    assert (overlap[0:5, 0:5] == 200).all(), "Read should include committed pixels"
+    assert (overlap[10:, 10:] == 50).all(), "Read should keep base pixels elsewhere"
+
+    result = log.materialize()
+    assert (result[15:25, 15:25] == 200).all(), "Materialized image should include the patch"
+    assert np.count_nonzero(np.any(result != base, axis=2)) == 100, "Only patched pixels change"
+    assert (base == 50).all(), "Base image must never be modified"
+
+    print("✅ EditLog test passed")
+    return True
+
+
+def test_proxy_mask_upscale():
+    """Test full-resolution mask reconstruction from a proxy mask."""
+    print("Testing proxy mask upscaling...")
+
+    full = np.zeros((1500, 2000), dtype=np.uint8)
+    cv2.circle(full, (1000, 700), 200, 255, -1)
+
+    proxy, scale = resize_for_processing(full, max_size=800)
+    assert scale < 1.0, "Image should have been downscaled"
+    proxy_mask = proxy > 127
+
+    ys, xs = np.nonzero(proxy_mask)
+    proxy_bbox = [int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1]
+    bbox = scale_bbox(proxy_bbox, scale, 2000, 1500)
+    assert bbox[0] <= 800 and bbox[1] <= 500, f"Scaled bbox should cover the object, got {bbox}"
+    assert bbox[2] >= 1200 and bbox[3] >= 900, f"Scaled bbox should cover the object, got {bbox}"
+
+    roi = [750, 450, 1250, 950]
+    up = upscale_mask(proxy_mask, scale, roi)
+    ref = full[450:950, 750:1250] > 0
+    assert up.shape == ref.shape, "Upscaled mask should match the ROI size"
+    mismatch = np.count_nonzero(up != ref) / np.count_nonzero(ref)
+    assert mismatch < 0.02, f"Upscaled mask should match the original, mismatch={mismatch:.3f}"
+
+    print("✅ Proxy mask upscaling test passed")
+    return True
+
+
+def test_seeded_changes():
+    """Test that a seeded RNG makes changes reproducible."""
+    print("Testing seeded changes...")
+
+    image = np.ones((200, 200, 3), dtype=np.uint8) * 100
+    cv2.rectangle(image, (30, 30), (70, 70), (50, 100, 200), -1)
+    mask = np.zeros((200, 200), dtype=np.uint8)
+    cv2.rectangle(mask, (30, 30), (70, 70), 255, -1)
+    segment = Segment(id=0, mask=mask > 0, bbox=[30, 30, 71, 71], area=41 * 41)
+
+    changer = ColorChanger()
+    first, shift_a = changer.change_hue(image, mask, rng=random.Random(7))
+    second, shift_b = changer.change_hue(image, mask, rng=random.Random(7))
+    assert shift_a == shift_b, "Same seed should pick the same hue shift"
+    assert np.array_equal(first, second), "Same seed should give identical pixels"
+
+    duplicator = ObjectDuplicator()
+    _, bbox_a = duplicator.duplicate(image, segment, rng=random.Random(7))
+    _, bbox_b = duplicator.duplicate(image, segment, rng=random.Random(7))
+    assert bbox_a == bbox_b, "Same seed should pick the same placement"
+
+    print("✅ Seeded changes test passed")
+    return True
+
+
+def test_reroll():
+    """Test replacing one difference from a saved EditState."""
+    print("Testing reroll...")
+
+    image = np.ones((200, 200, 3), dtype=np.uint8) * 120
+    segments = []
+    for i, (x, y) in enumerate([(10, 10), (140, 10), (10, 140), (140, 140)]):
+        cv2.rectangle(image, (x, y), (x + 39, y + 39), (40 + 50 * i, 100, 200), -1)
+        mask = np.zeros((200, 200), dtype=bool)
+        mask[y:y + 40, x:x + 40] = True
+        segments.append(Segment(id=i, mask=mask, bbox=[x, y, x + 40, y + 40], area=1600))
+
+    # Puzzle with a single colour change on segment 0
+    changer = ColorChanger()
+    log = EditLog(image)
+    roi = [8, 8, 52, 52]
+    before = log.read(roi)
+    params = {"hue_shift": 90, "sat_factor": 1.0, "val_factor": 1.0}
+    after, _ = changer.change_hue(before, segments[0].mask[8:52, 8:52], **params)
+    log.commit(log.make_patch(
+        roi, before, after, "color_change", 0, segments[0].bbox, params, diff_id=1
+    ))
+    patches = log.patches
+    state = EditState(
+        difficulty="easy",
+        seed=1,
+        scale=1.0,
+        proxy_shape=(200, 200),
+        segments=segments,
+        quality={seg.id: (True, 1.0, "OK") for seg in segments},
+        proxy_patches=patches,
+        patches=patches,
+    )
+
+    # Round trip through disk
+    with tempfile.TemporaryDirectory() as tmp:
+        state.save(Path(tmp) / "state.npz")
+        state = EditState.load(Path(tmp) / "state.npz")
+    assert len(state.segments) == 4, "Segments should survive a round trip"
+    assert np.array_equal(state.segments[3].mask, segments[3].mask), "Masks should round trip"
+    assert state.patches is state.proxy_patches, "Unscaled state should share its patch list"
+    assert state.patches[0].diff_id == 1, "Patches should keep their difference id"
+
+    generator = DifferenceGenerator(
+        None, None, InpaintingService(), changer, ObjectDuplicator(), Config.DIFFICULTY_CONFIG
+    )
+    result = generator.reroll(image, state, diff_id=1, seed=3)
+
+    assert len(result.differences) == 1, "Reroll should keep the number of differences"
+    assert result.differences[0].id == 1, "Rerolled difference should keep its id"
+    new_patch = result.edit_state.patches[0]
+    assert new_patch.segment_id != 0, "Reroll should pick a different segment"
+    assert new_patch.diff_id == 1, "New patch should make the rerolled difference"
+    assert np.array_equal(result.modified_image[10:50, 10:50], image[10:50, 10:50]), \
+        "Old change should be undone"
+    assert np.any(result.modified_image != image), "New change should be applied"
+
+    print("✅ Reroll test passed")
+    return True
+
+
+def test_addition_quality_region():
+    """Test that an addition is quality-checked where the copy lands, not at its source."""
+    print("Testing addition quality region...")
+
+    image = np.full((200, 200, 3), 150, dtype=np.uint8)
+    image[:, :, 0] = np.linspace(100, 200, 200, dtype=np.uint8)
+    cv2.circle(image, (40, 40), 20, (30, 60, 200), -1)
+    mask = np.zeros((200, 200), dtype=bool)
+    mask[cv2.circle(np.zeros((200, 200), np.uint8), (40, 40), 20, 1, -1) > 0] = True
+    seg = Segment(id=0, mask=mask, bbox=[20, 20, 61, 61], area=int(mask.sum()))
+
+    generator = DifferenceGenerator(
+        None, None, InpaintingService(), ColorChanger(), ObjectDuplicator(), Config.DIFFICULTY_CONFIG
+    )
+    made, checked = [], []
+    make_patch = generator._make_patch
+    evaluate = generator._quality.evaluate_modification_quality
+    generator._make_patch = lambda *args: made.append(make_patch(*args)) or made[-1]
+    generator._quality.evaluate_modification_quality = (
+        lambda *args: checked.append(args) or evaluate(*args)
+    )
+    generator._attempt_change(
+        EditLog(image), seg, "addition", generator._edit_settings("easy"), random.Random(3)
+    )
+
+    patch, (original, modified, _, change_type) = made[0], checked[0]
+    assert change_type == "addition"
+    x1, y1, x2, y2 = patch.target_bbox
+    assert x1 >= 61 or y1 >= 61 or x2 <= 20 or y2 <= 20, "Copy should land away from its source"
+    assert np.array_equal(original, image[y1:y2, x1:x2]), "Pixels under the copy should be the reference"
+    assert np.array_equal(modified, patch.crop(patch.target_bbox)), "The copy should be scored"
+    assert np.any(modified != original), "The scored region should show the copy"
+
+    print("✅ Addition quality region test passed")
+    return True
+
+
+def test_deadline():
+    """Test Deadline budgets and degradation records."""
+    print("Testing Deadline...")
+
+    now = [0.0]
+    deadline = Deadline(100, {"segmentation": 60, "changes": 30}, clock=lambda: now[0])
+    assert not deadline.tight("segmentation", "changes"), "90s of work fits in 100s"
+
+    now[0] = 20.0
+    assert deadline.remaining() == 80.0
+    assert deadline.tight("segmentation", "changes"), "90s of work does not fit in 80s"
+    assert not deadline.tight("changes", repeat=2), "Two 30s stages fit in 80s"
+
+    deadline.degrade("fewer_retries")
+    deadline.degrade("fewer_retries")
+    assert deadline.degradations == ["fewer_retries"], "Degradations are recorded once"
+
+    now[0] = 150.0
+    assert deadline.expired and deadline.remaining() == 0.0
+
+    unlimited = Deadline(None, {"segmentation": 60})
+    assert not unlimited.tight("segmentation") and not unlimited.expired
+
+    print("✅ Deadline test passed")
+    return True
+
+
+def test_stage_pipeline():
+    """Test that changing a parameter recomputes only the downstream stages."""
+    print("Testing stage pipeline...")
+
+    calls = []
+
+    def stage(name, fn):
+        def run(*args):
+            calls.append(name)
+            return fn(*args)
+        return run
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = StageCache(max_bytes=1024 * 1024, disk_dir=tmp)
+        pipeline = Pipeline([
+            Stage("blur", stage("blur", lambda img: cv2.blur(img, (3, 3))), ("image",)),
+            Stage("mean", stage("mean", lambda img: float(img.mean())), ("blur",)),
+            Stage("scaled", stage("scaled", lambda mean, k: mean * k), ("mean", "factor")),
+        ], cache)
+        image = np.arange(64 * 64, dtype=np.uint8).reshape(64, 64)
+
+        first = pipeline.run({"image": image, "factor": 2})
+        value = first.get("scaled")
+        assert calls == ["blur", "mean", "scaled"], f"First run computes every stage: {calls}"
+        assert list(first.timings) == ["blur", "mean", "scaled"], "Every stage should be timed"
+
+        calls.clear()
+        second = pipeline.run({"image": image.copy(), "factor": 3})
+        assert np.isclose(second.get("scaled"), value * 1.5), "Downstream stage should use the new factor"
+        assert calls == ["scaled"], f"Only the stage reading the factor should rerun: {calls}"
+        assert second.cached == ["mean"], "Reused output should be reported as cached"
+
+        calls.clear()
+        derived = second.derive({"factor": 4})
+        derived.get("scaled")
+        assert calls == ["scaled"], "A derived run reuses its parent's outputs"
+
+        # The disk tier survives a fresh in-memory cache
+        calls.clear()
+        cache.clear()
+        pipeline.run({"image": image, "factor": 2}).get("scaled")
+        assert calls == [], f"Disk cache should serve every stage: {calls}"
+
+    print("✅ Stage pipeline test passed")
+    return True
+
+
+def test_progress_tracker():
+    """Test progress and ETA computed from stage events."""
+    print("Testing ProgressTracker...")
+
+    now = [0.0]
+    durations = StageDurations({
+        "decode": 1, "proxy": 0, "segment": 10, "saliency": 1,
+        "quality": 0, "select": 0, "edit": 4, "render": 2, "encode": 2,
+    })
+    tracker = ProgressTracker(durations, variants=1, clock=lambda: now[0])
+    assert tracker.status()["eta_seconds"] == 20, "ETA should start at the sum of estimates"
+
+    tracker.handle(ProgressEvent(STAGE_START, "segment"))
+    now[0] = 5.0
+    status = tracker.status()
+    assert status["stage"] == "segment", "Current stage should be reported"
+    assert status["eta_seconds"] == 14, "Half of segmentation should be left, decode was skipped"
+
+    tracker.handle(ProgressEvent(STAGE_END, "segment", seconds=20.0))
+    assert durations.estimate("segment") == 13, "Measured duration should move the estimate"
+
+    tracker.handle(ProgressEvent(STAGE_START, "edit", variant=0))
+    tracker.handle(ProgressEvent(PROGRESS, "edit", variant=0, done=3, total=4, message="3/4"))
+    status = tracker.status()
+    assert status["current_step"] == "3/4", "Step text should come from the event"
+    assert status["eta_seconds"] == 1 + 2 + 2, "Counts should give the fraction of the edit stage"
+
+    before = status["progress"]
+    tracker.handle(ProgressEvent(STAGE_END, "edit", variant=0, seconds=40.0))
+    assert tracker.status()["progress"] >= before, "Progress should never go back"
+
+    print("✅ ProgressTracker test passed")
+    return True
+
+
+def test_shared_arrays():
+    """Test handing arrays over through shared memory"""
+    print("\n=== Testing shared array handoff ===")
+
+    from multiprocessing import shared_memory
+
+    image = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    with shared_arrays.SharedArray(image) as shared:
+        name = shared.handle[0]
+        attached = shared_arrays.attach(shared.handle)
+        assert np.array_equal(attached, image), "Attached array should match"
+        assert not attached.flags.owndata, "Attached array should view the block"
+    crop = attached[10:20, 10:20]
+    del attached
+    assert np.array_equal(crop, image[10:20, 10:20]), "Views should keep the block mapped"
+    try:
+        shared_memory.SharedMemory(name=name)
+        assert False, "Block should be removed after the with block"
+    except FileNotFoundError:
+        pass
+
+    mask = np.ones((10, 10), dtype=bool)
+    diff = Difference(id=1, type="deletion", bbox=[0, 0, 10, 10], saliency_score=0.5)
+    payload = shared_arrays.dumps({"image": image, "mask": mask, "diffs": [diff]})
+    assert len(payload) < image.nbytes // 10, "Large arrays should not be pickled inline"
+    restored = shared_arrays.loads(payload)
+    assert np.array_equal(restored["image"], image), "Large array should round-trip"
+    assert not restored["image"].flags.owndata, "Large array should not be copied out"
+    restored["image"][0, 0] = 0  # The block is this process's alone now
+    assert np.array_equal(restored["mask"], mask), "Small array should round-trip"
+    assert restored["diffs"][0] == diff, "Other objects should round-trip"
+
+    print("✅ Shared array test passed")
+    return True
+
+
+def test_job_queue():
+    """Test queue ordering, positions, claiming and admission control"""
+    print("\n=== Testing JobQueue ===")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+        now = [1000.0]
+        queue = JobQueue(db_path, workers=1, max_depth=3, lease_seconds=60, clock=lambda: now[0])
+
+        def push(job_id, client, cost):
+            queue.push([(job_id, "easy", 1, f"key_{job_id}")], "/tmp/image.png", client, cost)
+
+        push("a1", "alice", 30.0)
+        push("a2", "alice", 10.0)
+        push("b1", "bob", 20.0)
+        try:
+            push("c1", "carol", 10.0)
+            assert False, "Full queue should reject"
+        except ResourceExhaustedError as e:
+            assert e.retry_after >= 1.0, "Rejection should say when to retry"
+        assert database.get_job_status(db_path, "c1") is None, "Rejected jobs should not be stored"
+
+        # Each client's first batch before anyone's second; shorter first among them
+        assert queue.position("b1") == (1, 20.0), "Shorter first batch should lead"
+        assert queue.position("a1") == (2, 50.0), "ETA should add up the batches ahead"
+        assert queue.position("a2") == (3, 60.0), "Second batch of a client should wait"
+
+        now[0] += 25.0
+        claimed = queue.claim("worker-1")
+        assert claimed.variants == [("b1", "easy", 1, "key_b1")], f"Unexpected claim: {claimed}"
+        assert claimed.image_path == "/tmp/image.png"
+        assert queue.position("b1") is None, "Claimed batches have no position"
+        row = database.get_job_status(db_path, "b1")
+        assert row["status"] == "processing" and row["claimed_by"] == "worker-1"
+
+        # a1 has waited 25 of its 30 s, so it goes before bob's new 10 s batch
+        push("b2", "bob", 10.0)
+        database.save_job_status(db_path, "b1", "completed", progress=100)
+        order = []
+        for _ in range(3):
+            job_id = queue.claim("worker-2").variants[0][0]
+            database.save_job_status(db_path, job_id, "completed", progress=100)
+            order.append(job_id)
+        assert order == ["a1", "a2", "b2"], f"Unexpected order: {order}"
+        assert queue.claim("worker-2") is None and len(queue) == 0
+
+        # A worker that stops renewing loses its batch to the queue
+        push("d1", "dave", 5.0)
+        queue.claim("worker-3")
+        now[0] += 30.0
+        queue.renew("worker-3")
+        database.requeue_expired(db_path, now[0], 3, "error")
+        assert database.get_job_status(db_path, "d1")["status"] == "processing", "Renewed lease should hold"
+        database.renew_leases(db_path, "worker-3", 0.0)
+        assert queue.claim("worker-4").variants[0][0] == "d1", "Expired lease should be requeued"
+        assert database.get_job_status(db_path, "d1")["attempts"] == 2
+
+    print("✅ JobQueue test passed")
+    return True
+
+
+def test_status_store():
+    """Test write-behind job status persistence"""
+    print("\n=== Testing StatusStore ===")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+        store = StatusStore(db_path, flush_interval=3600)
+
+        store.add([JobStatus(job_id="job_a"), JobStatus(job_id="job_b")])
+        assert database.get_job_status(db_path, "job_a")["status"] == "queued", "New jobs should be written at once"
+
+        for progress in (10, 20, 30):
+            store.update("job_a", status=JobState.PROCESSING, progress=progress)
+        assert store.get("job_a").progress == 30, "Memory should update at once"
+        assert database.get_job_status(db_path, "job_a")["progress"] == 0, "Progress should be written behind"
+
+        store.update("job_b", status=JobState.COMPLETED, progress=100, result_path="/tmp/out")
+        row = database.get_job_status(db_path, "job_b")
+        assert row["status"] == "completed" and row["result_path"] == "/tmp/out", "Terminal states should be written at once"
+
+        store.close()
+        row = database.get_job_status(db_path, "job_a")
+        assert row["status"] == "processing" and row["progress"] == 30, "Flush should write the latest progress"
+
+        assert StatusStore(db_path).get("job_b").status == JobState.COMPLETED, "A new store should read the database"
+        store.update("job_missing", progress=50)
+        assert database.get_job_status(db_path, "job_missing") is None, "Unknown jobs should be ignored"
+
+    print("✅ StatusStore test passed")
+    return True
+
+
+def test_database_connections():
+    """Test WAL connections and in-place status updates"""
+    print("\n=== Testing database connection layer ===")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+
+        database.save_job_status(db_path, "job_a", "queued")
+        created_at = database.get_job_status(db_path, "job_a")["created_at"]
+        database.save_job_status(db_path, "job_a", "processing", progress=40, stage="edit")
+        row = database.get_job_status(db_path, "job_a")
+        assert row["status"] == "processing" and row["progress"] == 40, "Status should be updated"
+        assert row["created_at"] == created_at, "Update should keep created_at"
+
+        conn = database._connect(db_path)
+        assert conn is database._connect(db_path), "Thread should reuse its connection"
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal", "Database should use WAL"
+
+        database.save_cached_result(db_path, "key", "/tmp/a")
+        database.save_cached_result(db_path, "key", "/tmp/b")
+        assert database.get_cached_result(db_path, "key") == "/tmp/b", "Cache entry should be replaced"
+        database.close_connection(db_path)
+
+    print("✅ Database connection test passed")
+    return True
+
+
+def test_checkpoint_resume():
+    """Test resuming an interrupted run and releasing a dead worker's jobs"""
+    print("\n=== Testing checkpoint resume ===")
+
+    calls = []
+    crash = [True]
+
+    def stage(name, fn):
+        def run(*args):
+            calls.append(name)
+            return fn(*args)
+        return run
+
+    def render(mean):
+        if crash[0]:
+            raise RuntimeError("worker died")
+        return mean * 2
+
+    def build():
+        return Pipeline([
+            Stage("blur", stage("blur", lambda img: cv2.blur(img, (3, 3))), ("image",), checkpoint=True),
+            Stage("mean", stage("mean", lambda img: float(img.mean())), ("blur",), checkpoint=True),
+            Stage("render", stage("render", render), ("mean",)),
+        ])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image = np.arange(64 * 64, dtype=np.uint8).reshape(64, 64)
+        try:
+            build().run({"image": image}, checkpoint=StageCache(0, tmpdir)).get("render")
+            assert False, "First run should crash"
+        except RuntimeError:
+            pass
+        assert calls == ["blur", "mean", "render"]
+
+        # A new process (fresh pipeline, no memory cache) resumes after the checkpoints
+        calls.clear()
+        crash[0] = False
+        resumed = build().run({"image": image}, checkpoint=StageCache(0, tmpdir))
+        assert resumed.get("render") > 0
+        assert calls == ["render"], f"Checkpointed stages should not rerun: {calls}"
+
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+        queue = JobQueue(db_path, workers=1, max_depth=3, lease_seconds=60)
+        queue.push([("j1", "easy", 1, "key_j1")], "/tmp/image.png", "alice", 10.0)
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        dead_worker = f"{socket.gethostname()}:{exited.pid}:dead"
+        assert queue.claim(dead_worker) is not None
+        assert queue.claim("worker-2") is None, "A leased batch should not be claimed twice"
+
+        assert queue.reconcile(stale_seconds=600) == 1, "A dead worker's jobs should be released"
+        claimed = queue.claim("worker-2")
+        assert claimed is not None and claimed.variants[0][0] == "j1", "Released batch should be claimable"
+        assert queue.reconcile(stale_seconds=600) == 0, "Live workers keep their jobs"
+
+        # Without status updates for stale_seconds, a job is released anyway
+        assert queue.reconcile(stale_seconds=-1) == 1, "Stale jobs should be released"
+        database.close_connection(db_path)
+
+    print("✅ Checkpoint resume test passed")
+    return True
+
+
+def test_job_cancellation():
+    """Test cancel requests, abandonment and the hard time limit"""
+    print("\n=== Testing job cancellation ===")
+
+    now = [0.0]
+    deadline = Deadline(None, clock=lambda: now[0], limit=10)
+    deadline.check()
+    now[0] = 10.0
+    try:
+        deadline.check()
+        assert False, "Job past its limit should stop"
+    except JobTimeoutError:
+        pass
+
+    calls = []
+    reason = [None]
+    pipeline = Pipeline([
+        Stage("a", lambda x: calls.append("a") or x + 1, ("x",)),
+        Stage("b", lambda a: calls.append("b") or a + 1, ("a",)),
+    ])
+    run = pipeline.run({"x": 1}, check=lambda: Deadline(None, cancelled=lambda: reason[0]).check())
+    run.get("a")
+    reason[0] = "stop"
+    try:
+        run.get("b")
+        assert False, "Cancelled run should stop before its next stage"
+    except JobCancelledError as e:
+        assert str(e) == "stop"
+    assert calls == ["a"]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+        queue = JobQueue(db_path, workers=1, max_depth=3)
+        queue.push([("q1", "easy", 1, "k1"), ("q2", "easy", 2, "k2")], "/tmp/image.png", "alice", 10.0)
+        assert database.cancel_batch(db_path, "q1", "cancelled") == "cancelled"
+        assert database.get_job_status(db_path, "q2")["status"] == "cancelled", "Whole batch should be cancelled"
+        assert queue.claim("worker-1") is None, "Cancelled jobs should leave the queue"
+
+        batch_id = queue.push([("p1", "easy", 1, "k3")], "/tmp/image.png", "alice", 10.0)
+        queue.claim("worker-1")
+        watch = BatchWatch(db_path, batch_id, abandon_seconds=60, interval=0)
+        assert watch() is None, "A fresh job is neither cancelled nor abandoned"
+        assert database.cancel_batch(db_path, "p1", "cancelled") == "processing", "Worker should stop it"
+        assert watch() == "キャンセルされました"
+
+        batch_id = queue.push([("p2", "easy", 1, "k4")], "/tmp/image.png", "bob", 10.0)
+        database.record_poll(db_path, "p2", time.time() - 120)
+        assert BatchWatch(db_path, batch_id, abandon_seconds=60)() is not None, "Unpolled job is abandoned"
+        assert BatchWatch(db_path, batch_id, abandon_seconds=None)() is None
+        database.close_connection(db_path)
+
+    print("✅ Job cancellation test passed")
+    return True
+
+
+def test_memory_budget():
+    """Test the memory model fit and budget-gated claims"""
+    print("\n=== Testing memory budget ===")
+
+    runs = [(mp, v, 200 + 100 * mp + 40 * mp * (v - 1)) for mp in (1, 4, 12) for v in (1, 3)]
+    model = MemoryModel.fit(runs)
+    assert abs(model.base_mb - 200) < 1 and abs(model.mb_per_megapixel - 100) < 1
+    assert abs(model.mb_per_variant_megapixel - 40) < 1
+    assert model.estimate(2, 2) == model.base_mb + 2 * model.mb_per_megapixel + 2 * model.mb_per_variant_megapixel
+
+    rss = [1000.0]
+    budget = MemoryBudget(2000, MemoryModel(100, 100), rss=lambda: rss[0])
+    small, large = budget.estimate(2), budget.estimate(12)  # 300 and 1300 MB
+    assert budget.fits(large), "An idle process admits any job"
+    budget.acquire("s1", small)
+    assert budget.fits(small) and not budget.fits(large), "Large job should wait for running ones"
+    budget.acquire("s2", small)
+    rss[0] = 1900.0
+    assert not budget.fits(small), "Measured memory above the plan should count"
+    budget.release("s1")
+    budget.release("s2")
+    assert budget.fits(large)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+        queue = JobQueue(db_path, workers=2, max_depth=3)
+        queue.push([("big", "easy", 1, "k1")], "/tmp/image.png", "alice", 10.0, megapixels=12)
+        queue.push([("small", "easy", 1, "k2")], "/tmp/image.png", "bob", 10.0, megapixels=2)
+        fits = lambda batch: batch.megapixels < 10
+        assert queue.claim("worker-1", fits=fits) is None, "Smaller batch should not overtake"
+        claimed = queue.claim("worker-1")
+        assert claimed.variants[0][0] == "big" and claimed.megapixels == 12
+        assert queue.claim("worker-2", fits=fits).variants[0][0] == "small"
+        database.close_connection(db_path)
+
+        # Only with several workers per process does the budget gate anything
+        gate = threading.Event()
+        started = []
+
+        class BlockingGenerator:
+            def generate_many(self, image, difficulties, **kwargs):
+                started.append(image.shape[0])
+                gate.wait(10)
+                raise RuntimeError("stopped by test")
+
+            def fingerprint(self):
+                return "blocking"
+
+            def close(self):
+                pass
+
+        db_path = os.path.join(tmpdir, "jobs.db")
+        database.init_db(db_path)
+        small_path = os.path.join(tmpdir, "small.png")  # 0.01 MP, ~400 MB
+        large_path = os.path.join(tmpdir, "large.png")  # 1 MP, ~30 GB
+        cv2.imwrite(small_path, np.full((100, 100, 3), 128, dtype=np.uint8))
+        cv2.imwrite(large_path, np.full((1000, 1000, 3), 128, dtype=np.uint8))
+        budget = MemoryBudget(2000, MemoryModel(100, 30000), rss=lambda: 1000.0)
+        manager = JobManager(
+            BlockingGenerator(), None, None, tmpdir, db_path, max_workers=3,
+            memory_budget=budget, poll_interval=0.05,
+        )
+        manager.submit("s1", small_path, "easy", seed=1, client="alice")
+        manager.submit("s2", small_path, "easy", seed=2, client="bob")
+        manager.submit("l1", large_path, "easy", seed=3, client="carol")
+        end = time.time() + 5
+        while len(started) < 2 and time.time() < end:
+            time.sleep(0.02)
+        time.sleep(0.3)
+        assert started == [100, 100], f"Two small jobs should run together: {started}"
+        assert manager.get_status("l1").status == JobState.QUEUED, "Large job should wait"
+        gate.set()
+        end = time.time() + 5
+        while len(started) < 3 and time.time() < end:
+            time.sleep(0.02)
+        assert started[2] == 1000, "Large job should run once memory is freed"
+        manager.shutdown()
+        database.close_connection(db_path)
+
+    print("✅ Memory budget test passed")
+    return True
+
+
+def test_job_deduplication():
+    """Test that identical and repeated generation requests share jobs"""
+    print("\n=== Testing job deduplication ===")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+        image_path = os.path.join(tmpdir, "upload.png")
+        cv2.imwrite(image_path, np.full((64, 64, 3), 128, dtype=np.uint8))
+        generator = DifferenceGenerator(
+            None, None, InpaintingService(), ColorChanger(), ObjectDuplicator(), Config.DIFFICULTY_CONFIG
+        )
+        manager = JobManager(generator, None, None, tmpdir, db_path, max_workers=0)
+        image_hash = manager.register_upload("upload", image_path)
+        assert manager.upload_hash("upload") == image_hash
+
+        def submit(job_ids, difficulties, seeds=None, key=None, client="alice"):
+            statuses = manager.submit_many(
+                job_ids, image_path, difficulties, seeds, client, image_hash, key
+            )
+            return [status.job_id for status in statuses]
+
+        assert submit(["a1", "a2"], ["easy", "hard"]) == ["a1", "a2"]
+        assert submit(["b1", "b2"], ["easy", "hard"]) == ["a1", "a2"], "Double submit should join"
+        assert database.get_job_status(db_path, "b1") is None, "Duplicate should queue nothing"
+        assert submit(["c1"], ["easy"]) == ["c1"], "Other difficulties are another request"
+        assert submit(["d1"], ["easy"], seeds=[7]) == ["d1"], "A seed makes another request"
+
+        assert submit(["k1"], ["medium"], key="retry-1") == ["k1"]
+        database.cancel_batch(db_path, "k1", "cancelled")
+        assert submit(["k2"], ["medium"], key="retry-1") == ["k1"], "Same key should return the first jobs"
+        assert submit(["k3"], ["medium"]) == ["k3"], "Cancelled jobs are not joined"
+
+        # A keyed request that joins another batch is bound to that batch's jobs
+        assert submit(["m1"], ["hard"]) == ["m1"]
+        assert submit(["n1"], ["hard"], key="retry-2") == ["m1"]
+        assert submit(["n2"], ["hard"], key="retry-2") == ["m1"], "Retry should get the stored jobs"
+        assert database.get_job_status(db_path, "n1") is None
+
+        # A client cancelling a shared batch only leaves it
+        assert submit(["s1"], ["medium"], seeds=[3]) == ["s1"]
+        assert submit(["t1"], ["medium"], seeds=[3], client="bob") == ["s1"]
+        assert manager.cancel("s1", client="bob").status == JobState.QUEUED, "Alice still wants it"
+        assert manager.cancel("s1", client="bob").status == JobState.QUEUED, "Leaving twice is once"
+        assert manager.cancel("s1", client="alice").status == JobState.CANCELLED, "Last requester cancels"
+        manager.shutdown()
+        database.close_connection(db_path)
+
+    print("✅ Job deduplication test passed")
+    return True
+
+
+def test_janitor():
+    """Test background cleanup of expired, orphaned and least recently used files"""
+    print("\n=== Testing janitor ===")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+        uploads = Path(tmpdir) / "uploads"
+        outputs = Path(tmpdir) / "outputs"
+        day_ago = time.time() - 2 * 24 * 3600
+
+        def make(path, size=1000, mtime=None):
+            if path.suffix:
+                path.write_bytes(b"x" * size)
+            else:
+                path.mkdir(parents=True)
+                (path / "modified.png").write_bytes(b"x" * size)
+            if mtime is not None:
+                os.utime(path, (mtime, mtime))
+            return path
+
+        uploads.mkdir()
+        queue = JobQueue(db_path, workers=1, max_depth=3)
+        active_batch = queue.push([("active", "easy", 1, "k")], str(uploads / "in_use.png"), "c", 1.0)
+        old = make(outputs / "old_job", mtime=day_ago)
+        fresh = make(outputs / "fresh_job")
+        running = make(outputs / "active", mtime=day_ago)
+        orphan = make(outputs / f"{CHECKPOINT_PREFIX}gone")
+        checkpoint = make(outputs / f"{CHECKPOINT_PREFIX}{active_batch}")
+        old_upload = make(uploads / "old.png", mtime=day_ago)
+        in_use = make(uploads / "in_use.png", mtime=day_ago)
+        database.save_upload(db_path, "old", "hash")
+
+        usage = [100, 10, 90]
+        janitor = Janitor(
+            db_path, str(uploads), str(outputs), retention_hours=24, delete_rate=0,
+            disk_usage=lambda path: tuple(usage),
+        )
+        report = janitor.run_once()
+        assert report.complete and report.evicted == 0
+        assert not old.exists() and not orphan.exists() and not old_upload.exists()
+        assert fresh.exists() and running.exists() and checkpoint.exists() and in_use.exists()
+        assert report.paths == 3 and report.bytes == 3000, report
+
+        # Disk pressure: least recently used first, down to the low-water mark
+        older = make(outputs / "older_job", size=500_000, mtime=day_ago / 2)
+        newer = make(outputs / "newer_job", size=500_000)
+        usage[:] = [1_000_000, 950_000, 50_000]
+        report = janitor.run_once()
+        assert report.evicted == 1 and not older.exists() and newer.exists(), report
+        assert running.exists() and checkpoint.exists() and in_use.exists()
+
+        # A spent time budget leaves the rest for the next cycle
+        make(outputs / "old_2", mtime=day_ago)
+        usage[:] = [100, 10, 90]
+        slow = Janitor(db_path, str(uploads), str(outputs), cycle_seconds=0)
+        assert not slow.run_once().complete
+        assert (outputs / "old_2").exists()
+        database.close_connection(db_path)
+
+    print("✅ Janitor test passed")
+    return True
+
+
+def test_generation_history():
+    """Test asynchronous history records and the stage timings behind stats"""
+    print("\n=== Testing generation history ===")
+
+    tracker = ProgressTracker(StageDurations({}), variants=2)
+    tracker.handle(ProgressEvent(STAGE_END, "segment", seconds=4.0))
+    tracker.handle(ProgressEvent(STAGE_END, "saliency", seconds=0.0, cached=True))
+    tracker.handle(ProgressEvent(STAGE_END, "edit", 1, seconds=1.5))
+    assert tracker.measured(None) == {"segment": 4.0}, "Cache hits are not measured"
+    assert tracker.measured(1) == {"edit": 1.5} and tracker.measured(0) == {}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+        writer = HistoryWriter(db_path, flush_interval=60)
+
+        def record(job_id, status, difficulty, segment, width=1000):
+            writer.record({
+                "job_id": job_id, "session_id": "batch", "original_filename": "a.png",
+                "original_path": "/tmp/a.png", "output_path": "", "difficulty": difficulty,
+                "num_differences": 3, "processing_time": segment, "metadata": {},
+                "status": status, "width": width, "height": 1000,
+                "stage_timings": {"segment": segment},
+            })
+
+        for i in range(10):
+            record(f"job{i}", "completed", "easy", float(i + 1))
+        record("job10", "failed", "hard", 20.0, width=2000)
+        assert database.get_stage_timings(db_path, "") == {}, "record() must not write"
+        writer.close()
+
+        timings = database.get_stage_timings(db_path, "")
+        assert sorted(timings["segment"]) == [float(i + 1) for i in range(10)] + [20.0]
+        assert database.get_stage_timings(db_path, "9999") == {}, "Outside the window"
+        summary = {(r["status"], r["difficulty"]): r for r in database.get_generation_summary(db_path, "")}
+        assert summary[("completed", "easy")]["jobs"] == 10
+        assert summary[("failed", "hard")]["megapixels"] == [2.0]
+        assert database.get_generation(db_path, "job10")["status"] == "failed"
+
+        # A job recorded twice (e.g. re-run after its lease expired) keeps one set of timings
+        again = {
+            "job_id": "job0", "session_id": "batch", "original_filename": "a.png",
+            "original_path": "/tmp/a.png", "output_path": "", "difficulty": "easy",
+            "num_differences": 3, "processing_time": 9.0, "metadata": {},
+            "stage_timings": {"segment": 9.0, "edit": 2.0},
+        }
+        database.save_generations(db_path, [again, again])
+        timings = database.get_stage_timings(db_path, "")
+        assert len(timings["segment"]) == 11 and "edit" not in timings, "Timings should not be added twice"
+        database.close_connection(db_path)
+
+    print("✅ Generation history test passed")
+    return True
+
+
+def test_status_notifications():
+    """Test that status updates wake followers waiting for a change"""
+    print("\n=== Testing status notifications ===")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "test.db")
+        database.init_db(db_path)
+        store = StatusStore(db_path, flush_interval=60)
+        store.add([JobStatus(job_id="job", status=JobState.QUEUED)])
+
+        version = store.version
+        t0 = time.perf_counter()
+        assert store.wait(version, 0.05) == version, "Nothing changed"
+        assert time.perf_counter() - t0 >= 0.05
+
+        threading.Timer(0.05, store.update, args=("job",), kwargs={"progress": 10}).start()
+        t0 = time.perf_counter()
+        assert store.wait(version, 5.0) > version
+        assert time.perf_counter() - t0 < 1.0, "An update should wake the waiter at once"
+        assert store.get("job").progress == 10
+        store.close()
+        database.close_connection(db_path)
+
+    print("✅ Status notification test passed")
+    return True
+
+
 def run_all_tests():
     """Run all tests."""
     print("="*60)
@@ -262,7 +1338,31 @@ def run_all_tests():
         test_inpainting_service,
         test_color_changer,
         test_object_duplicator,
+        test_object_duplicator_seamless,
         test_quality_evaluator,
+        test_fast_ssim,
+        test_edge_artifact_parity,
+        test_contour_metrics_parity,
+        test_batch_segment_quality,
+        test_edit_log,
+        test_proxy_mask_upscale,
+        test_seeded_changes,
+        test_reroll,
+        test_addition_quality_region,
+        test_deadline,
+        test_stage_pipeline,
+        test_progress_tracker,
+        test_shared_arrays,
+        test_job_queue,
+        test_status_store,
+        test_database_connections,
+        test_checkpoint_resume,
+        test_job_cancellation,
+        test_memory_budget,
+        test_job_deduplication,
+        test_janitor,
+        test_generation_history,
+        test_status_notifications,
     ]
 
     passed = 0